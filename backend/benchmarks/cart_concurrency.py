@@ -0,0 +1,58 @@
+"""
+Hammer one cart session from many coroutines and check that no update is lost.
+
+With the default Mongo cart store, mutations run as update pipelines, which
+mongomock does not evaluate, so point the script at a real server:
+
+    BENCH_MONGO_URL=mongodb://localhost:27017 python -m benchmarks.cart_concurrency
+
+The hash-backed stores run anywhere (``--store memory``) or against Redis
+(``--store redis`` with REDIS_URL).
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+
+from benchmarks.harness import drive, running_app
+
+
+async def main(args):
+    async with running_app(CART_STORE=args.store) as http:
+        products = (await http.get("/api/products")).json()[:args.products]
+        prices = {product["id"]: product["price"] for product in products}
+        expected = {product_id: 0 for product_id in prices}
+        rng = random.Random(args.seed)
+        plan = [(rng.choice(list(prices)), rng.randint(1, 3)) for _ in range(args.requests)]
+        for product_id, quantity in plan:
+            expected[product_id] += quantity
+
+        async def add(i: int):
+            product_id, quantity = plan[i]
+            response = await http.post(f"/api/cart/{args.session}/add",
+                                       json={"product_id": product_id, "quantity": quantity})
+            response.raise_for_status()
+
+        result = await drive(add, args.requests, args.concurrency)
+        cart = (await http.get(f"/api/cart/{args.session}")).json()
+
+    quantities = {item["product_id"]: item["quantity"] for item in cart["items"]}
+    expected = {product_id: quantity for product_id, quantity in expected.items() if quantity}
+    expected_total = sum(prices[product_id] * quantity for product_id, quantity in expected.items())
+    result["lost_updates"] = sum(expected.values()) - sum(quantities.values())
+    result["consistent"] = quantities == expected and abs(cart["total"] - expected_total) < 1e-6
+    print(json.dumps(result, indent=2))
+    if not result["consistent"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--session", default="bench-concurrency")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--store", choices=["mongo", "memory", "redis"], default="mongo")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,60 @@
+"""
+Checkout throughput: synchronous payment vs queued payment.
+
+    python -m benchmarks.checkout --requests 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from models.product import Product
+
+from benchmarks.harness import drive, running_app
+
+ORDER_ITEM = {
+    "product_id": "bench-product",
+    "product_name": "Collier Élégant Doré",
+    "product_price": 25000,
+    "product_image": "https://example.com/collier.jpg",
+    "quantity": 1,
+    "subtotal": 25000,
+}
+
+
+async def run_mode(mode: str, requests: int, concurrency: int) -> dict:
+    async with running_app(PAYMENT_MODE=mode) as http:
+        import server
+
+        product = Product(id="bench-product", name="Collier", price=25000, category="bijoux",
+                          subcategory="colliers", image="", description="")
+        await server.db.products.insert_one(product.dict())
+
+        async def checkout(i: int):
+            response = await http.post("/api/orders", json={
+                "items": [ORDER_ITEM],
+                "payment_method": "moov",
+                "phone_number": "01234567",
+                "session_id": f"bench-{i}",
+            })
+            assert response.status_code in (200, 202, 400, 500), response.text
+
+        result = await drive(checkout, requests, concurrency)
+        if server.payment_queue is not None:
+            start = time.perf_counter()
+            await server.payment_queue.join()
+            result["drain_s"] = round(time.perf_counter() - start, 3)
+        result["mode"] = mode
+        return result
+
+
+async def main(args):
+    results = [await run_mode(mode, args.requests, args.concurrency) for mode in ("sync", "async")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
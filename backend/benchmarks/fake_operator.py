@@ -0,0 +1,49 @@
+"""
+Local stand-in for a mobile money operator API, speaking the default
+PaymentProvider wire format.
+
+    python -m benchmarks.fake_operator --port 9001 --latency 0.05 --error-rate 0.2
+"""
+import argparse
+import asyncio
+import random
+import uuid
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+def create_app(latency: float = 0.05, error_rate: float = 0.0, decline_rate: float = 0.0) -> Starlette:
+    """Operator answering after ``latency`` seconds
+
+    ``error_rate`` of the calls fail with 503, ``decline_rate`` are declined.
+    """
+    async def payments(request: Request):
+        payload = await request.json()
+        await asyncio.sleep(latency)
+        if random.random() < error_rate:
+            return JSONResponse({"message": "Service indisponible"}, status_code=503)
+        if random.random() < decline_rate:
+            return JSONResponse({"status": "failed", "message": "Solde insuffisant"})
+        return JSONResponse({
+            "status": "success",
+            "transaction_id": f"TXN{uuid.uuid4().hex[:10].upper()}",
+            "reference": payload.get("reference"),
+        })
+
+    return Starlette(routes=[Route("/payments", payments, methods=["POST"])])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--decline-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency, args.error_rate, args.decline_rate), port=args.port,
+                access_log=False)
@@ -0,0 +1,144 @@
+"""
+Shared helpers for the benchmark scripts.
+
+The FastAPI app is driven in-process through httpx's ASGI transport against an
+in-memory Mongo stand-in (mongomock-motor), so results only measure the API
+itself. Set BENCH_MONGO_URL to run against a real server instead; each run
+then uses a throwaway database. Run the scripts from the backend directory,
+e.g. ``python -m benchmarks.checkout``.
+
+running_uvicorn() serves the app from uvicorn worker processes instead, which
+needs BENCH_MONGO_URL since the workers cannot share an in-memory database.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import socket
+import statistics
+import sys
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+from services.database import connect
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+@contextlib.asynccontextmanager
+async def running_app(**settings: Any):
+    """Start the app against a fresh in-memory database
+
+    Keyword arguments override module-level settings of server.py
+    (e.g. ``PAYMENT_MODE="async"``) before the startup hooks run.
+    """
+    previous = {name: getattr(server, name) for name in settings}
+    previous_db = server.db
+    for name, value in settings.items():
+        setattr(server, name, value)
+    mongo_url = os.environ.get("BENCH_MONGO_URL")
+    mongo = connect(mongo_url) if mongo_url else AsyncMongoMockClient()
+    server.db = mongo[f"benchmark_{uuid.uuid4().hex[:8]}"]
+
+    await server.app.router.startup()
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            yield http
+    finally:
+        for handler in server.app.router.on_shutdown:
+            if handler is not server.shutdown_db_client:
+                await handler()
+        if mongo_url:
+            await mongo.drop_database(server.db.name)
+            mongo.close()
+        server.db = previous_db
+        for name, value in previous.items():
+            setattr(server, name, value)
+
+
+@contextlib.asynccontextmanager
+async def running_uvicorn(workers: int = 1, **settings: Any):
+    """Serve the app with uvicorn against a throwaway database on BENCH_MONGO_URL
+
+    Keyword arguments are passed to the workers as environment variables.
+    """
+    mongo_url = os.environ.get("BENCH_MONGO_URL")
+    if not mongo_url:
+        raise RuntimeError("running_uvicorn needs BENCH_MONGO_URL")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    database = f"benchmark_{uuid.uuid4().hex[:8]}"
+    env = {**os.environ, **{name: str(value) for name, value in settings.items()},
+           "MONGO_URL": mongo_url, "DB_NAME": database}
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--workers", str(workers),
+        "--no-access-log", env=env, stderr=asyncio.subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+            while True:
+                try:
+                    (await http.get("/api/")).raise_for_status()
+                    break
+                except httpx.TransportError:
+                    if process.returncode is not None:
+                        raise RuntimeError("uvicorn exited during startup")
+                    await asyncio.sleep(0.1)
+            yield http
+    finally:
+        process.terminate()
+        await process.wait()
+        mongo = AsyncIOMotorClient(mongo_url)
+        await mongo.drop_database(database)
+        mongo.close()
+
+
+async def drive(
+    request: Callable[[int], Awaitable[Any]],
+    total: int,
+    concurrency: int
+) -> Dict[str, Any]:
+    """Run ``total`` calls of ``request`` with at most ``concurrency`` in flight"""
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await request(i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, Any]:
+    """Throughput and latency percentiles (milliseconds)"""
+    return {
+        "requests": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
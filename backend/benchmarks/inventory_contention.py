@@ -0,0 +1,82 @@
+"""
+Many buyers reserving one hot product at once, as in a flash sale.
+
+Every buyer reserves a few units of the same product and then pays (commit)
+or fails to (release), for each stock shard count in ``--shards``. The
+script reports reservation throughput and latency and checks that no unit
+was sold twice: units left plus units sold must equal the initial stock,
+and nothing may be sold once stock ran out.
+
+mongomock runs every command one after another, so the difference between
+shard counts only shows against a real server:
+
+    BENCH_MONGO_URL=mongodb://localhost:27017 python -m benchmarks.inventory_contention \\
+        --buyers 5000 --concurrency 500 --shards 1,8,32
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+
+from services.inventory import OutOfStock
+
+from benchmarks.harness import drive, running_app
+
+
+async def sale(server, product_id: str, shards: int, args) -> dict:
+    inventory = server.inventory
+    await inventory.set_stock(product_id, args.stock, shards)
+    rng = random.Random(args.seed)
+    plan = [(rng.randint(1, args.max_quantity), rng.random() < args.payment_failures)
+            for _ in range(args.buyers)]
+    outcome = {"sold": 0, "released": 0, "out_of_stock": 0}
+
+    async def buy(i: int):
+        quantity, fails = plan[i]
+        order_id = f"bench-{shards}-{i}"
+        try:
+            await inventory.reserve(order_id, [(product_id, quantity)])
+        except OutOfStock:
+            outcome["out_of_stock"] += 1
+            return
+        if fails:
+            await inventory.release(order_id)
+            outcome["released"] += quantity
+        else:
+            await inventory.commit(order_id)
+            outcome["sold"] += quantity
+
+    result = await drive(buy, args.buyers, args.concurrency)
+    left, _ = await inventory.stock_level(product_id)
+    result.update(outcome, shards=shards, left=left,
+                  oversold=max(0, outcome["sold"] - args.stock),
+                  consistent=left >= 0 and left + outcome["sold"] == args.stock)
+    return result
+
+
+async def main(args):
+    shard_counts = [int(count) for count in args.shards.split(",")]
+    async with running_app(CART_STORE="memory", INVENTORY_SWEEP_INTERVAL=0,
+                           ANALYTICS_REFRESH_INTERVAL=0) as http:
+        import server
+
+        product_id = (await http.get("/api/products", params={"limit": 1})).json()[0]["id"]
+        results = [await sale(server, product_id, shards, args) for shards in shard_counts]
+
+    print(json.dumps(results, indent=2))
+    if not all(result["consistent"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stock", type=int, default=1000)
+    parser.add_argument("--buyers", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--max-quantity", type=int, default=2)
+    parser.add_argument("--payment-failures", type=float, default=0.1,
+                        help="share of buyers whose payment fails")
+    parser.add_argument("--shards", default="1,8,32", help="comma-separated stock shard counts")
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,88 @@
+"""
+Operator isolation: Moov Money throughput while Airtel Money is healthy vs
+degraded. Each fake operator runs in its own uvicorn process.
+
+    python -m benchmarks.payment_providers --requests 400 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import socket
+import sys
+
+from models.order import PaymentMethod
+from services.payment_providers import AirtelMoneyProvider, CircuitBreaker, MoovMoneyProvider
+from services.payment_service import PaymentService
+
+from benchmarks.harness import drive
+
+PHONES = {PaymentMethod.MOOV_MONEY: "01234567", PaymentMethod.AIRTEL_MONEY: "07234567"}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def serve(*options: str) -> tuple:
+    """Start benchmarks.fake_operator in a subprocess and wait for its port"""
+    port = free_port()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.fake_operator", "--port", str(port), *options,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            break
+        except OSError:
+            await asyncio.sleep(0.05)
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def scenario(name: str, airtel_options: list, args) -> dict:
+    moov_process, moov_url = await serve("--latency", str(args.latency))
+    airtel_process, airtel_url = await serve(*airtel_options)
+    PaymentService.configure({
+        PaymentMethod.MOOV_MONEY: MoovMoneyProvider(moov_url, max_concurrency=args.operator_concurrency,
+                                                    timeout=args.timeout),
+        PaymentMethod.AIRTEL_MONEY: AirtelMoneyProvider(airtel_url, max_concurrency=args.operator_concurrency,
+                                                        timeout=args.timeout,
+                                                        breaker=CircuitBreaker(failure_threshold=10)),
+    })
+
+    async def pay(method: PaymentMethod, i: int):
+        return await PaymentService.process_mobile_payment(PHONES[method], 1000, method, f"BENCH{i}")
+
+    try:
+        moov, airtel = await asyncio.gather(
+            drive(lambda i: pay(PaymentMethod.MOOV_MONEY, i), args.requests, args.concurrency),
+            drive(lambda i: pay(PaymentMethod.AIRTEL_MONEY, i), args.requests, args.concurrency),
+        )
+    finally:
+        await PaymentService.close()
+        for process in (moov_process, airtel_process):
+            process.terminate()
+            await process.wait()
+    return {"scenario": name, "moov": moov, "airtel": airtel}
+
+
+async def main(args):
+    results = [
+        await scenario("airtel healthy", ["--latency", str(args.latency)], args),
+        await scenario("airtel degraded",
+                       ["--latency", str(args.timeout * 2), "--error-rate", "0.5"], args),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--operator-concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,110 @@
+"""
+Check which replica set members serve each kind of request.
+
+Catalog and analytics reads should land on secondaries (with the default
+MONGO_REPLICA_READ_PREFERENCE), carts, checkout and order reads on the
+primary. Every command the app sends is recorded with the server it went
+to; the report lists them per operation along with the pool metrics, and
+the script exits 1 if any operation went to the wrong kind of member.
+
+Needs a replica set with at least one secondary, e.g. two local members:
+
+    mongod --replSet rs0 --port 27017 --dbpath /tmp/rs0-0 --fork --logpath /tmp/rs0-0.log
+    mongod --replSet rs0 --port 27018 --dbpath /tmp/rs0-1 --fork --logpath /tmp/rs0-1.log
+    mongosh --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018", priority: 0}]})'
+    BENCH_MONGO_URL="mongodb://localhost:27017,localhost:27018/?replicaSet=rs0" \\
+        python -m benchmarks.read_routing
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+from pymongo import monitoring
+
+from services.metrics import REGISTRY
+
+from benchmarks.harness import running_app
+
+
+class ServerLog(monitoring.CommandListener):
+    """Every command sent, with the server that received it"""
+
+    def __init__(self):
+        self.commands: List[Tuple[str, str]] = []
+
+    def started(self, event) -> None:
+        host, port = event.connection_id
+        self.commands.append((event.command_name, f"{host}:{port}"))
+
+    def succeeded(self, event) -> None:
+        pass
+
+    def failed(self, event) -> None:
+        pass
+
+
+async def main(args):
+    if not os.environ.get("BENCH_MONGO_URL"):
+        raise SystemExit("Set BENCH_MONGO_URL to a replica set, see the module docstring")
+    log = ServerLog()
+    # Clients created from now on, including the one running_app opens, report to it
+    monitoring.register(log)
+    checks: Dict[str, Dict[str, Any]] = {}
+
+    async with running_app(CART_STORE="mongo", ANALYTICS_REFRESH_INTERVAL=0, CART_COMPACTION_INTERVAL=0,
+                           INVENTORY_SWEEP_INTERVAL=0, OUTBOX_RELAY_INTERVAL=0) as http:
+        import server
+
+        await server.db.command("ping")
+        primary = "{}:{}".format(*server.db.client.primary)
+        # Let the seeded catalog replicate before reading it from a secondary
+        await asyncio.sleep(args.replication_wait)
+
+        async def check(name: str, expected: str, operation) -> Any:
+            start = len(log.commands)
+            result = await operation
+            servers = sorted({server for _, server in log.commands[start:]})
+            on_primary = primary in servers
+            checks[name] = {
+                "expected": expected,
+                "servers": servers,
+                "commands": [command for command, _ in log.commands[start:]],
+                "ok": bool(servers) and (on_primary and len(servers) == 1 if expected == "primary"
+                                         else not on_primary),
+            }
+            return result
+
+        # The seed invalidated the catalog: its next load reads the primary, later ones a secondary
+        await check("catalog reload after a write", "primary", server.catalog_cache.refresh())
+        await check("catalog reload", "secondary", server.catalog_cache.refresh())
+        await check("catalog export", "secondary", http.get("/api/products/export", params={"format": "jsonl"}))
+        await check("analytics", "secondary", http.get("/api/analytics/daily"))
+
+        product_id = next(iter(server.catalog_cache.products))
+        await check("cart", "primary", http.post("/api/cart/routing/add",
+                                                 json={"product_id": product_id, "quantity": 1}))
+        response = await check("checkout", "primary", http.post("/api/orders", json={
+            "items": [{"product_id": product_id, "quantity": 1}],
+            "payment_method": "moov", "phone_number": "01234567", "session_id": "routing"}))
+        if response.status_code in (200, 400):
+            order = await server.db.orders.find_one({"session_id": "routing"}, {"id": 1})
+            await check("order read", "primary", http.get(f"/api/orders/{order['id']}"))
+
+    pool = [line for line in REGISTRY.render().splitlines()
+            if line.startswith(("mongodb_pool_connections", "mongodb_pool_max_size",
+                                "mongodb_pool_wait_seconds_sum", "mongodb_pool_wait_seconds_count",
+                                "mongodb_pool_checkout_failures"))]
+    print(json.dumps({"primary": primary, "checks": checks, "pool": pool}, indent=2))
+    if not all(result["ok"] for result in checks.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replication-wait", type=float, default=2.0,
+                        help="seconds to wait for the seeded catalog to reach the secondaries")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,110 @@
+"""
+Search latency at several catalog sizes: of the in-process product index
+alone, and end to end through GET /api/products?search= (routing, catalog
+cache, pagination and serialization included).
+
+    python -m benchmarks.search --sizes 10000 100000 1000000 --api-sizes 10000 100000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from models.product import Product
+from services.search_index import SearchIndex
+
+from benchmarks.harness import drive, running_app, summarize
+
+NOUNS = ["Collier", "Bracelet", "Bague", "Écouteurs", "Casque", "Ventilateur", "Montre",
+         "Sac", "Portefeuille", "Ceinture", "Lunettes", "Boucles", "Chargeur", "Enceinte"]
+ADJECTIVES = ["Doré", "Argenté", "Élégant", "Délicat", "Premium", "Coloré", "Sans Fil",
+              "Bluetooth", "Miniature", "Cuir", "Perlé", "Rétro", "Sport", "Classique"]
+WORDS = ["haute", "qualité", "réduction", "bruit", "finition", "toutes", "occasions",
+         "portable", "câble", "usb", "son", "fidélité", "élégante", "collection", "cadeau"]
+QUERIES = ["ecouteurs", "Écouteurs sans fil", "collier dore", "bra", "casque bluetooth premium",
+           "cuir", "ventilateur usb", "montre sport", "qualité", "xyz"]
+
+
+def synthetic_products(count: int, seed: int = 42):
+    rng = random.Random(seed)
+    for i in range(count):
+        name = f"{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {i}"
+        description = " ".join(rng.choices(WORDS, k=8))
+        yield Product.model_construct(
+            id=f"p{i:07d}", name=name, description=description, price=float(rng.randint(1000, 50000)),
+            category="bijoux", subcategory="colliers", image=f"/images/p{i:07d}.jpg",
+            rating=round(rng.uniform(3, 5), 1), reviews=rng.randint(0, 500)
+        )
+
+
+def run(size: int, repeat: int) -> dict:
+    products = list(synthetic_products(size))
+    started = time.perf_counter()
+    index = SearchIndex(products)
+    build_s = time.perf_counter() - started
+
+    latencies = []
+    hits = {}
+    for _ in range(repeat):
+        for query in QUERIES:
+            started = time.perf_counter()
+            hits[query] = len(index.search(query))
+            latencies.append(time.perf_counter() - started)
+    result = summarize(latencies, sum(latencies))
+    result.update(products=size, build_s=round(build_s, 2), terms=len(index.terms), hits=hits)
+    return result
+
+
+async def run_api(size: int, requests: int, concurrency: int) -> dict:
+    async with running_app(SEED_SAMPLE_DATA=False) as http:
+        import server
+
+        products = synthetic_products(size)
+        while True:
+            batch = [product.dict(exclude={"image_variants"})
+                     for product in itertools.islice(products, 10_000)]
+            if not batch:
+                break
+            await server.db.products.insert_many(batch)
+        server.catalog_cache.invalidate()
+
+        # The first request loads the catalog cache
+        started = time.perf_counter()
+        (await http.get("/api/products", params={"limit": 1})).raise_for_status()
+        load_s = time.perf_counter() - started
+
+        hits = {}
+        for query in QUERIES:
+            response = await http.get("/api/products", params={"search": query})
+            response.raise_for_status()
+            hits[query] = int(response.headers["X-Total-Count"])
+
+        async def search(i: int):
+            query = QUERIES[i % len(QUERIES)]
+            (await http.get("/api/products", params={"search": query})).raise_for_status()
+
+        result = await drive(search, requests, concurrency)
+    result.update(products=size, cache_load_s=round(load_s, 2), concurrency=concurrency, hits=hits)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--api-sizes", type=int, nargs="*", default=[10_000, 100_000],
+                        help="catalog sizes to search through the API; none to skip")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    results = {
+        "index": [run(size, args.repeat) for size in args.sizes],
+        "api": [asyncio.run(run_api(size, args.requests, args.concurrency)) for size in args.api_sizes],
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
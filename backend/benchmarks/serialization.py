@@ -0,0 +1,76 @@
+"""
+Serialization CPU per request, with and without FAST_JSON_RESPONSES.
+
+    python -m benchmarks.serialization --products 1000 --cart-items 20
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from models.cart import Cart, CartItem
+from models.product import Product
+
+from benchmarks.harness import running_app
+
+
+def synthetic_catalog(count: int):
+    return [
+        Product(
+            id=f"p{i:06d}", name=f"Produit {i}", price=1000 + i, category="tech",
+            subcategory="casques", description="Casque audio bluetooth avec son haute fidélité",
+            image=f"https://images.unsplash.com/photo-{i}?crop=entropy&cs=srgb&fm=jpg&q=85",
+        ).dict()
+        for i in range(count)
+    ]
+
+
+async def measure(http, path: str, requests: int) -> dict:
+    await http.get(path)  # warm the catalog cache
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(requests):
+        response = await http.get(path)
+        response.raise_for_status()
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    return {
+        "path": path,
+        "bytes": len(response.content),
+        "cpu_ms_per_request": round(cpu / requests * 1000, 3),
+        "wall_ms_per_request": round(wall / requests * 1000, 3),
+    }
+
+
+async def run(fast: bool, args) -> list:
+    async with running_app(FAST_JSON_RESPONSES=fast, SEED_SAMPLE_DATA=False) as http:
+        import server
+
+        catalog = synthetic_catalog(args.products)
+        await server.db.products.insert_many(catalog)
+        server.catalog_cache.invalidate()
+        items = [
+            CartItem(product_id=p["id"], product_name=p["name"], product_price=p["price"],
+                     product_image=p["image"], quantity=1, subtotal=p["price"])
+            for p in catalog[:args.cart_items]
+        ]
+        cart = Cart(session_id="bench", items=items, total=sum(i.subtotal for i in items))
+        await server.db.carts.insert_one(cart.dict())
+
+        results = []
+        for path in ("/api/products", "/api/cart/bench"):
+            result = await measure(http, path, args.requests)
+            result["fast"] = fast
+            results.append(result)
+        return results
+
+
+async def main(args):
+    results = await run(False, args) + await run(True, args)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--cart-items", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+"""
+Response bytes on the wire for one scripted shopping session.
+
+The session browses a catalog page, opens a few products, adds them to the
+cart, changes a quantity, removes an item and reloads the cart. It runs once
+as the frontend calls the API today (identity encoding, whole documents) and
+then with compression negotiated, sparse fieldsets and cart deltas:
+
+    python -m benchmarks.session_bytes --encoding br
+"""
+import argparse
+import asyncio
+import json
+
+from benchmarks.harness import running_app
+
+LIST_FIELDS = "id,name,price,image,inStock,rating"
+CART_ITEM_FIELDS = "product_id,quantity,subtotal"
+
+
+def wire_bytes(response) -> int:
+    # httpx decodes the body; Content-Length is what was sent
+    return int(response.headers.get("content-length", len(response.content)))
+
+
+async def session(http, slim: bool, encoding: str, name: str) -> dict:
+    headers = {"Accept-Encoding": encoding if slim else "identity"}
+    list_params = {"fields": LIST_FIELDS} if slim else {}
+    cart_params = {"fields": CART_ITEM_FIELDS, "delta": "true"} if slim else {}
+    sent = {}
+
+    async def call(step: str, method: str, path: str, **kwargs):
+        response = await http.request(method, path, headers=headers, **kwargs)
+        response.raise_for_status()
+        sent[step] = sent.get(step, 0) + wire_bytes(response)
+        return response
+
+    products = (await call("browse", "GET", "/api/products", params={"limit": 24, **list_params})).json()
+    picked = [product["id"] for product in products[:3]]
+    for product_id in picked:
+        await call("product", "GET", f"/api/products/{product_id}")
+    for product_id in picked:
+        await call("cart_mutations", "POST", f"/api/cart/{name}/add", params=cart_params,
+                   json={"product_id": product_id, "quantity": 1})
+    await call("cart_mutations", "PUT", f"/api/cart/{name}/update/{picked[0]}", params=cart_params,
+               json={"quantity": 2})
+    await call("cart_mutations", "DELETE", f"/api/cart/{name}/remove/{picked[1]}", params=cart_params)
+    await call("cart", "GET", f"/api/cart/{name}",
+               params={"fields": CART_ITEM_FIELDS} if slim else {})
+    sent["total"] = sum(sent.values())
+    return sent
+
+
+async def main(args):
+    async with running_app(CART_STORE="memory") as http:
+        before = await session(http, False, args.encoding, "bench-bytes-before")
+        after = await session(http, True, args.encoding, "bench-bytes-after")
+    print(json.dumps({
+        "before": before,
+        "after": after,
+        "reduction": round(1 - after["total"] / before["total"], 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--encoding", default="br, gzip")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,296 @@
+"""
+Mixed shopping workload with per-endpoint throughput and latency percentiles.
+
+Virtual shoppers browse category pages, search, open products, fill carts
+and check out, each picking its next step from a weighted mix. The catalog is
+synthetic and every shopper draws its steps from a seeded generator, so
+runs of the same command replay the same traffic. The report is JSON; pass
+an earlier report as ``--baseline`` to flag endpoints whose p95 or
+throughput regressed beyond ``--tolerance``:
+
+    python -m benchmarks.workload --products 5000 --requests 5000 --concurrency 50 \\
+        --output before.json
+    python -m benchmarks.workload --products 5000 --requests 5000 --concurrency 50 \\
+        --baseline before.json
+
+The app runs in-process against mongomock by default. ``--uvicorn N`` serves
+it from N uvicorn workers instead (needs BENCH_MONGO_URL). Checkout charges
+an in-process benchmarks.fake_operator through the regular provider adapter.
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from models.category import SUBCATEGORY_NAMES
+from models.order import PaymentMethod
+from services.payment_providers import MoovMoneyProvider
+from services.payment_service import PaymentService
+
+from benchmarks import fake_operator
+from benchmarks.harness import running_app, running_uvicorn, summarize
+from benchmarks.search import ADJECTIVES, NOUNS, QUERIES, WORDS
+
+DEFAULT_MIX = "browse=35,search=15,product=25,cart_add=15,cart_view=7,checkout=3"
+SORTS = ["name", "price-asc", "price-desc", "rating"]
+PAGE_SIZE = 24
+
+
+def synthetic_catalog(count: int, seed: int) -> List[Dict[str, Any]]:
+    """Products spread over the known categories, with searchable names"""
+    rng = random.Random(seed)
+    sections = [(category, subcategory) for category, subs in SUBCATEGORY_NAMES.items() for subcategory in subs]
+    products = []
+    for i in range(count):
+        category, subcategory = rng.choice(sections)
+        products.append({
+            "id": f"p{i:07d}",
+            "name": f"{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {i}",
+            "price": rng.randrange(1000, 150000, 500),
+            "category": category,
+            "subcategory": subcategory,
+            "image": f"https://images.unsplash.com/photo-{1500000000000 + i}?crop=entropy&cs=srgb&fm=jpg&q=85",
+            "description": " ".join(rng.choices(WORDS, k=12)),
+            "inStock": rng.random() < 0.9,
+            "rating": round(rng.uniform(3, 5), 1),
+            "reviews": rng.randint(0, 500),
+        })
+    return products
+
+
+def catalog_csv(products: List[Dict[str, Any]]) -> bytes:
+    import pandas as pd
+
+    buffer = io.StringIO()
+    pd.DataFrame(products).to_csv(buffer, index=False)
+    return buffer.getvalue().encode()
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ACTIONS:
+            raise SystemExit(f"Unknown action in --mix: {name.strip()}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+class Shopper:
+    """One virtual user: a cart session and the last page it looked at"""
+
+    def __init__(self, http: httpx.AsyncClient, number: int, catalog: List[Dict[str, Any]], seed: int):
+        self.http = http
+        self.number = number
+        self.catalog = catalog
+        self.rng = random.Random(seed * 100003 + number)
+        self.carts = 0
+        self.session = self.new_session()
+        self.in_cart = 0
+        self.seen: List[str] = []
+
+    def new_session(self) -> str:
+        self.carts += 1
+        return f"bench-{self.number}-{self.carts}"
+
+    def pick_product(self) -> str:
+        # Shoppers mostly open what they just saw listed
+        if self.seen and self.rng.random() < 0.8:
+            return self.rng.choice(self.seen)
+        return self.rng.choice(self.catalog)["id"]
+
+    async def browse(self) -> httpx.Response:
+        category = self.rng.choice(list(SUBCATEGORY_NAMES))
+        params = {"category": category, "sort_by": self.rng.choice(SORTS), "limit": PAGE_SIZE}
+        if self.rng.random() < 0.5:
+            params["subcategory"] = self.rng.choice(list(SUBCATEGORY_NAMES[category]))
+        response = await self.http.get("/api/products", params=params)
+        # Every other browse goes one page further
+        cursor = response.headers.get("x-next-cursor")
+        if cursor and self.rng.random() < 0.5:
+            response = await self.http.get("/api/products", params={**params, "cursor": cursor})
+        if response.status_code == 200:
+            self.seen = [product["id"] for product in response.json()]
+        return response
+
+    async def search(self) -> httpx.Response:
+        response = await self.http.get("/api/products", params={"search": self.rng.choice(QUERIES),
+                                                                 "limit": PAGE_SIZE})
+        if response.status_code == 200 and response.json():
+            self.seen = [product["id"] for product in response.json()]
+        return response
+
+    async def product(self) -> httpx.Response:
+        return await self.http.get(f"/api/products/{self.pick_product()}")
+
+    async def cart_add(self) -> httpx.Response:
+        response = await self.http.post(f"/api/cart/{self.session}/add", json={
+            "product_id": self.pick_product(), "quantity": self.rng.randint(1, 2)})
+        if response.status_code == 200:
+            self.in_cart += 1
+        return response
+
+    async def cart_view(self) -> httpx.Response:
+        return await self.http.get(f"/api/cart/{self.session}")
+
+    async def checkout(self) -> httpx.Response:
+        if not self.in_cart:
+            return await self.cart_add()
+        cart = (await self.http.get(f"/api/cart/{self.session}")).json()
+        response = await self.http.post("/api/orders", json={
+            "items": cart["items"],
+            "payment_method": PaymentMethod.MOOV_MONEY.value,
+            "phone_number": "01234567",
+            "session_id": self.session,
+        })
+        self.session, self.in_cart = self.new_session(), 0
+        return response
+
+
+ACTIONS = {
+    "browse": Shopper.browse,
+    "search": Shopper.search,
+    "product": Shopper.product,
+    "cart_add": Shopper.cart_add,
+    "cart_view": Shopper.cart_view,
+    "checkout": Shopper.checkout,
+}
+
+
+async def run_workload(http: httpx.AsyncClient, catalog: List[Dict[str, Any]], args) -> Dict[str, Any]:
+    weights = parse_mix(args.mix)
+    names, odds = list(weights), list(weights.values())
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    remaining = args.requests
+
+    async def shopper(number: int):
+        nonlocal remaining
+        user = Shopper(http, number, catalog, args.seed)
+        while remaining > 0:
+            remaining -= 1
+            name = user.rng.choices(names, weights=odds)[0]
+            started = time.perf_counter()
+            try:
+                response = await ACTIONS[name](user)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies[name].append(time.perf_counter() - started)
+            errors[name] += failed
+
+    # Warm the catalog cache so the first shoppers do not all wait on its load
+    await http.get("/api/products", params={"limit": 1})
+    started = time.perf_counter()
+    await asyncio.gather(*(shopper(number) for number in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for name in names:
+        endpoints[name] = {**summarize(latencies[name], elapsed), "errors": errors[name]}
+    everything = [latency for values in latencies.values() for latency in values]
+    return {"total": {**summarize(everything, elapsed), "errors": sum(errors.values())},
+            "endpoints": endpoints}
+
+
+def configure_operator(latency: float) -> None:
+    transport = httpx.ASGITransport(app=fake_operator.create_app(latency))
+    PaymentService.configure({PaymentMethod.MOOV_MONEY: MoovMoneyProvider(
+        "http://operator", max_concurrency=1000, transport=transport)})
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """Relative change of p95 and throughput per endpoint; regressions beyond ``tolerance``"""
+    changes, regressions = {}, []
+    for name, current in {"total": report["total"], **report["endpoints"]}.items():
+        before = baseline["total"] if name == "total" else baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        change = {
+            "p95_ms": round(current["p95_ms"] / before["p95_ms"] - 1, 3) if before["p95_ms"] else None,
+            "rps": round(current["rps"] / before["rps"] - 1, 3) if before["rps"] else None,
+        }
+        changes[name] = change
+        if (change["p95_ms"] or 0) > tolerance or (change["rps"] or 0) < -tolerance:
+            regressions.append(name)
+    return {"baseline_commit": baseline.get("config", {}).get("commit"), "changes": changes,
+            "regressions": regressions}
+
+
+async def main(args):
+    catalog = synthetic_catalog(args.products, args.seed)
+    settings = {"SEED_SAMPLE_DATA": False, "PAYMENT_MODE": args.payment_mode,
+                "ANALYTICS_REFRESH_INTERVAL": 0, "CART_COMPACTION_INTERVAL": 0}
+    if args.uvicorn:
+        # Payments go to the simulated operator built into PaymentService
+        context = running_uvicorn(workers=args.uvicorn, CART_STORE=args.store or "mongo", **settings)
+    else:
+        context = running_app(CART_STORE=args.store or "memory", **settings)
+
+    async with context as http:
+        if args.uvicorn:
+            response = await http.post("/api/products/import", files={"file": ("catalog.csv", catalog_csv(catalog))})
+            response.raise_for_status()
+        else:
+            import server
+
+            await server.db.products.insert_many([dict(product) for product in catalog])
+            server.catalog_cache.invalidate()
+            configure_operator(args.operator_latency)
+        report = await run_workload(http, catalog, args)
+
+    report["config"] = {
+        "commit": current_commit(),
+        "products": args.products,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "mix": parse_mix(args.mix),
+        "seed": args.seed,
+        "server": f"uvicorn x{args.uvicorn}" if args.uvicorn else "in-process",
+        "payment_mode": args.payment_mode,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    if report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="action=weight pairs, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--store", choices=["mongo", "memory", "redis"],
+                        help="cart store (memory in-process, mongo under uvicorn)")
+    parser.add_argument("--payment-mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--operator-latency", type=float, default=0.05)
+    parser.add_argument("--uvicorn", type=int, default=0, metavar="WORKERS")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative p95/throughput change reported as a regression")
+    asyncio.run(main(parser.parse_args()))
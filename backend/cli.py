@@ -0,0 +1,151 @@
+"""
+Darling Boutique maintenance commands.
+
+    python cli.py seed data/sample_products.json --batch-size 1000
+    python cli.py indexes --explain
+    python cli.py import-catalog catalog.parquet --chunk-size 50000
+    python cli.py export-catalog catalog.csv
+    python cli.py compact-carts
+    python cli.py analytics --full
+"""
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+import typer
+from dotenv import load_dotenv
+
+from services.catalog_io import catalog_format, export_catalog, import_catalog, read_frames
+from services.catalog_loader import SAMPLE_PRODUCTS_FILE, bulk_upsert_products, read_products
+from services.analytics import refresh_rollups
+from services.cart_compaction import compact_carts
+from services.database import connect
+from services.indexes import ensure_indexes, explain_queries
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+app = typer.Typer(help="Darling Boutique maintenance commands")
+
+
+def get_database():
+    client = connect(os.environ['MONGO_URL'])
+    return client, client[os.environ['DB_NAME']]
+
+
+@app.command()
+def seed(
+    path: Path = typer.Argument(SAMPLE_PRODUCTS_FILE, exists=True, dir_okay=False,
+                                help="Catalog file (.json, .jsonl or .csv)"),
+    batch_size: int = typer.Option(1000, min=1, help="Products per bulk write"),
+):
+    """Upsert products from a catalog file, keyed on id"""
+    async def run():
+        client, db = get_database()
+        try:
+            return await bulk_upsert_products(db, read_products(path), batch_size=batch_size)
+        finally:
+            client.close()
+
+    report = asyncio.run(run())
+    typer.echo(json.dumps(report, indent=2))
+
+
+@app.command("import-catalog")
+def import_catalog_command(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False,
+                                help="Catalog file (.csv, .jsonl or .parquet)"),
+    chunk_size: int = typer.Option(50000, min=1, help="Rows validated and written per chunk"),
+):
+    """Validate and upsert a large catalog file in chunks"""
+    async def run():
+        client, db = get_database()
+        try:
+            return await import_catalog(db, read_frames(path, catalog_format(path.name), chunk_size))
+        finally:
+            client.close()
+
+    typer.echo(json.dumps(asyncio.run(run()), indent=2))
+
+
+@app.command("export-catalog")
+def export_catalog_command(
+    path: Path = typer.Argument(..., dir_okay=False, help="Output file (.csv, .jsonl or .parquet)"),
+    chunk_size: int = typer.Option(50000, min=1, help="Products read and encoded per chunk"),
+):
+    """Write the whole catalog to a file"""
+    async def run():
+        client, db = get_database()
+        try:
+            with open(path, "wb") as f:
+                async for data in export_catalog(db, catalog_format(path.name), chunk_size):
+                    f.write(data)
+        finally:
+            client.close()
+
+    asyncio.run(run())
+    typer.echo(f"Catalog written to {path}")
+
+
+@app.command()
+def indexes(
+    explain: bool = typer.Option(False, help="Report API queries that fall back to COLLSCAN"),
+):
+    """Create the declared indexes"""
+    async def run():
+        client, db = get_database()
+        try:
+            created = await ensure_indexes(db)
+            plans = await explain_queries(db) if explain else []
+            return created, plans
+        finally:
+            client.close()
+
+    created, plans = asyncio.run(run())
+    typer.echo(json.dumps(created, indent=2))
+    for plan in plans:
+        marker = "COLLSCAN" if plan["collscan"] else "ok"
+        typer.echo(f"{marker:>8}  {plan['query']} ({plan['collection']}): {' > '.join(plan['stages'])}")
+    if any(plan["collscan"] for plan in plans):
+        raise typer.Exit(code=1)
+
+
+@app.command("compact-carts")
+def compact_carts_command(
+    grace: float = typer.Option(3600, min=0, help="Only delete carts empty for this many seconds"),
+):
+    """Delete empty carts and report reclaimed documents and bytes"""
+    async def run():
+        client, db = get_database()
+        try:
+            return await compact_carts(db, grace_seconds=grace)
+        finally:
+            client.close()
+
+    typer.echo(json.dumps(asyncio.run(run()), indent=2))
+
+
+@app.command()
+def analytics(
+    full: bool = typer.Option(False, help="Rebuild every day instead of the days touched since the last run"),
+):
+    """Refresh the materialized sales rollups"""
+    async def run():
+        client, db = get_database()
+        try:
+            return await refresh_rollups(db, os.environ.get("ANALYTICS_TIMEZONE", "UTC"), full=full)
+        finally:
+            client.close()
+
+    typer.echo(json.dumps(asyncio.run(run()), indent=2))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,36 @@
+from pydantic import BaseModel
+from typing import Optional
+
+from models.order import OrderStatus, PaymentMethod
+
+class DailySales(BaseModel):
+    day: str
+    orders: int
+    paid_orders: int
+    revenue: float
+
+class StatusCount(BaseModel):
+    status: OrderStatus
+    orders: int
+    amount: float
+
+class PaymentMethodStats(BaseModel):
+    payment_method: PaymentMethod
+    orders: int
+    paid_orders: int
+    cancelled_orders: int
+    # Paid over settled (paid + cancelled) orders; None until one settles
+    success_rate: Optional[float] = None
+    revenue: float
+
+class ProductSales(BaseModel):
+    product_id: str
+    product_name: str
+    category: Optional[str] = None
+    quantity: int
+    revenue: float
+
+class CategorySales(BaseModel):
+    category: Optional[str] = None
+    quantity: int
+    revenue: float
@@ -0,0 +1,32 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+# Display names of known categories; they are listed even when empty
+CATEGORY_NAMES = {
+    "bijoux": "Bijoux",
+    "tech": "Tech",
+}
+SUBCATEGORY_NAMES = {
+    "bijoux": {"colliers": "Colliers", "bracelets": "Bracelets", "bagues": "Bagues"},
+    "tech": {"ecouteurs": "Écouteurs Sans Fil", "casques": "Casques Bluetooth",
+             "ventilateurs": "Ventilateurs Miniatures"},
+}
+
+class FacetStats(BaseModel):
+    count: int = 0
+    in_stock: int = 0
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+
+class SubcategoryFacet(FacetStats):
+    id: str
+    name: str
+
+class CategoryFacet(FacetStats):
+    id: str
+    name: str
+    subcategories: List[SubcategoryFacet] = []
+
+class ProductFacets(FacetStats):
+    # Breakdown of the filtered products by subcategory
+    subcategories: List[SubcategoryFacet] = []
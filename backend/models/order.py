@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional, Set
 from datetime import datetime
 from enum import Enum
 import uuid
@@ -16,6 +16,26 @@ class OrderStatus(str, Enum):
     DELIVERED = "delivered"
     CANCELLED = "cancelled"
 
+# Allowed status changes; DELIVERED and CANCELLED are final
+ORDER_TRANSITIONS: Dict[OrderStatus, Set[OrderStatus]] = {
+    OrderStatus.PENDING: {OrderStatus.CONFIRMED, OrderStatus.CANCELLED},
+    OrderStatus.CONFIRMED: {OrderStatus.PROCESSING, OrderStatus.CANCELLED},
+    OrderStatus.PROCESSING: {OrderStatus.SHIPPED, OrderStatus.CANCELLED},
+    OrderStatus.SHIPPED: {OrderStatus.DELIVERED},
+    OrderStatus.DELIVERED: set(),
+    OrderStatus.CANCELLED: set(),
+}
+
+# Changes made from the back office: only a successful payment confirms a pending order
+MANUAL_TRANSITIONS: Dict[OrderStatus, Set[OrderStatus]] = {
+    **ORDER_TRANSITIONS,
+    OrderStatus.PENDING: {OrderStatus.CANCELLED},
+}
+
+def new_order_number() -> str:
+    # 48 random bits: collisions stay unlikely over many millions of orders
+    return f"DRB{uuid.uuid4().hex[:12].upper()}"
+
 class OrderItem(BaseModel):
     product_id: str
     product_name: str
@@ -26,7 +46,7 @@ class OrderItem(BaseModel):
 
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    order_number: str = Field(default_factory=lambda: f"DRB{str(uuid.uuid4())[:8].upper()}")
+    order_number: str = Field(default_factory=new_order_number)
     user_id: Optional[str] = None
     session_id: Optional[str] = None
     items: List[OrderItem]
@@ -34,15 +54,85 @@ class Order(BaseModel):
     payment_method: PaymentMethod
     phone_number: str
     status: OrderStatus = OrderStatus.PENDING
+    transaction_id: Optional[str] = None
+    payment_error: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class OrderItemCreate(BaseModel):
+    # Names and prices are recomputed from the catalog; client values are ignored
+    product_id: str
+    quantity: int = Field(ge=1)
+    product_name: Optional[str] = None
+    product_price: Optional[float] = None
+    product_image: Optional[str] = None
+    subtotal: Optional[float] = None
+
 class OrderCreate(BaseModel):
-    items: List[OrderItem]
+    items: List[OrderItemCreate] = Field(min_length=1)
     payment_method: PaymentMethod
     phone_number: str
     user_id: Optional[str] = None
     session_id: Optional[str] = None
 
 class OrderStatusUpdate(BaseModel):
-    status: OrderStatus
\ No newline at end of file
+    status: OrderStatus
+
+MAX_BULK_ORDERS = 10000
+
+class OrderFilter(BaseModel):
+    session_id: Optional[str] = None
+    user_id: Optional[str] = None
+    status: Optional[OrderStatus] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+class OrderStatusBulkUpdate(BaseModel):
+    # Either explicit ids or a filter; orders matched by a filter are limited
+    # to those whose current status allows the transition
+    status: OrderStatus
+    order_ids: Optional[List[str]] = Field(default=None, min_length=1, max_length=MAX_BULK_ORDERS)
+    filter: Optional[OrderFilter] = None
+
+class OrderStatusResult(BaseModel):
+    order_id: str
+    updated: bool
+    previous_status: Optional[OrderStatus] = None
+    error: Optional[str] = None
+
+class OrderStatusBulkResult(BaseModel):
+    status: OrderStatus
+    matched: int
+    updated: int
+    results: List[OrderStatusResult]
+
+class OrderItemImport(BaseModel):
+    product_id: str
+    product_name: str
+    product_price: float = Field(ge=0)
+    product_image: str = ""
+    quantity: int = Field(ge=1)
+
+class OrderImport(BaseModel):
+    # Marketplace orders arrive already priced; order_number is the
+    # marketplace reference and makes re-imports idempotent
+    order_number: str
+    items: List[OrderItemImport] = Field(min_length=1)
+    payment_method: PaymentMethod
+    phone_number: str
+    status: OrderStatus = OrderStatus.CONFIRMED
+    user_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class OrderImportResult(BaseModel):
+    index: int
+    order_number: Optional[str] = None
+    order_id: Optional[str] = None
+    result: str  # inserted, existing or rejected
+    error: Optional[str] = None
+
+class OrderImportReport(BaseModel):
+    inserted: int
+    existing: int
+    rejected: int
+    results: List[OrderImportResult]
@@ -1,8 +1,12 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, computed_field
+from typing import Dict, Optional, List
 from datetime import datetime
+import hashlib
 import uuid
 
+# Resized copies of product images (longest side in pixels), see services/images.py
+IMAGE_VARIANTS: Dict[str, int] = {"thumbnail": 160, "card": 480, "detail": 1200}
+
 class Product(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -12,14 +16,27 @@ class Product(BaseModel):
     image: str
     description: str
     inStock: bool = True
+    # Units left, None when stock is not tracked; see services/inventory.py
+    stock: Optional[int] = Field(default=None, ge=0)
     rating: float = Field(default=4.0, ge=0, le=5)
     reviews: int = Field(default=0, ge=0)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+    @computed_field
+    @property
+    def image_variants(self) -> Dict[str, str]:
+        """API paths of the resized copies of ``image``; ``v`` changes with it"""
+        version = hashlib.sha256(self.image.encode()).hexdigest()[:16]
+        return {variant: f"/api/products/{self.id}/images/{variant}?v={version}" for variant in IMAGE_VARIANTS}
+
+class ProductImport(Product):
+    # Checked on the way in only, so that one bad stored document cannot break catalog reads
+    price: float = Field(ge=0)
+
 class ProductCreate(BaseModel):
     name: str
-    price: float
+    price: float = Field(ge=0)
     category: str
     subcategory: str
     image: str
@@ -30,11 +47,22 @@ class ProductCreate(BaseModel):
 
 class ProductUpdate(BaseModel):
     name: Optional[str] = None
-    price: Optional[float] = None
+    price: Optional[float] = Field(default=None, ge=0)
     category: Optional[str] = None
     subcategory: Optional[str] = None
     image: Optional[str] = None
     description: Optional[str] = None
     inStock: Optional[bool] = None
     rating: Optional[float] = None
-    reviews: Optional[int] = None
\ No newline at end of file
+    reviews: Optional[int] = None
+
+class StockUpdate(BaseModel):
+    # None stops tracking the product's stock
+    stock: Optional[int] = Field(ge=0)
+    # Counters the stock is spread over; more than one for products sold in flash sales
+    shards: int = Field(default=1, ge=1, le=256)
+
+class StockLevel(BaseModel):
+    product_id: str
+    stock: Optional[int]
+    shards: int
@@ -1,29 +1,176 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Response, UploadFile, File
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from pymongo.errors import DuplicateKeyError
+from typing import Any, Dict, List, Optional
 import uuid
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 # Import models
-from models.product import Product, ProductCreate, ProductUpdate
+from models.product import IMAGE_VARIANTS, Product, ProductCreate, ProductUpdate, StockLevel, StockUpdate
 from models.cart import Cart, CartItem, CartItemAdd, CartItemUpdate
-from models.order import Order, OrderCreate, OrderStatusUpdate, PaymentMethod, OrderStatus
+from models.order import (
+    Order, OrderCreate, OrderStatusUpdate, PaymentMethod, OrderStatus, OrderStatusBulkUpdate,
+    OrderStatusBulkResult, OrderImportReport, MAX_BULK_ORDERS, new_order_number
+)
+from models.category import ProductFacets
+from models.analytics import CategorySales, DailySales, PaymentMethodStats, ProductSales, StatusCount
 from models.user import User, UserCreate, UserUpdate
 from services.payment_service import PaymentService
+from services.payment_queue import PaymentQueue, QueueFull
+from services.payment_providers import build_providers_from_env
+from services.catalog_cache import CatalogCache
+from services.http_cache import CatalogHttpCache
+from services.compression import CompressionMiddleware
+from services.fieldsets import parse_fields, project
+from services.metrics import REGISTRY, RequestMetricsMiddleware
+from services.cart_store import (
+    CartStore, HashCartStore, ItemNotInCart, LocalCartHashes, MongoCartStore, RedisCartHashes
+)
+from services.catalog_loader import seed_sample_products
+from services.catalog_io import FORMATS, catalog_format, export_catalog, import_catalog, read_frames
+from services.database import connect, replica_reads
+from services.images import IMAGE_FORMATS, ImageSourceError, ImageStore
+from services.indexes import ensure_indexes
+from services.inventory import Inventory, OutOfStock
+from services.outbox import ORDER_CREATED, OutboxRelay, WebhookSink, log_sink, order_event, transition
+from services.cart_compaction import run_compaction
+from services.idempotency import (
+    IdempotencyKeyReused, IdempotencyStore, IdempotencyTimeout, StoredResponse, fingerprint
+)
+from services import analytics
+from services.order_bulk import import_orders, transition_orders
+from services.pricing import PricingEngine, UnknownProductsError
+from services.pagination import CountCache, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection, pool configured by MONGO_* variables (services/database.py);
+# commands and pool waits are timed into /metrics. Catalog and analytics
+# reads go through replica_db, which may read from secondaries.
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = connect(mongo_url)
 db = client[os.environ['DB_NAME']]
+replica_db = None
+
+# Payment mode: "sync" charges inside POST /api/orders, "async" queues the
+# payment and answers 202 with the pending order. Checkout answers 503 while
+# PAYMENT_QUEUE_SIZE orders wait. Queued orders are leased to their process for
+# PAYMENT_LEASE_SECONDS and recovered by any process once the lease runs out;
+# shutdown waits up to PAYMENT_DRAIN_SECONDS for the queue to empty.
+PAYMENT_MODE = os.environ.get('PAYMENT_MODE', 'sync')
+PAYMENT_WORKERS = int(os.environ.get('PAYMENT_WORKERS', '8'))
+PAYMENT_QUEUE_SIZE = int(os.environ.get('PAYMENT_QUEUE_SIZE', '1000'))
+PAYMENT_LEASE_SECONDS = float(os.environ.get('PAYMENT_LEASE_SECONDS', '300'))
+PAYMENT_RECOVERY_INTERVAL = float(os.environ.get('PAYMENT_RECOVERY_INTERVAL', '30'))
+PAYMENT_DRAIN_SECONDS = float(os.environ.get('PAYMENT_DRAIN_SECONDS', '30'))
+payment_queue: Optional[PaymentQueue] = None
+
+# In-memory catalog, see services/catalog_cache.py
+CATALOG_CACHE_TTL = float(os.environ.get('CATALOG_CACHE_TTL', '300'))
+CATALOG_CHANGE_STREAM = os.environ.get('CATALOG_CHANGE_STREAM', '0') == '1'
+catalog_cache: Optional[CatalogCache] = None
+catalog_watch_task: Optional[asyncio.Task] = None
+
+# Catalog responses carry ETag/Last-Modified and may be cached by clients and
+# proxies for CATALOG_MAX_AGE seconds, then served stale for up to
+# CATALOG_STALE_WHILE_REVALIDATE seconds while they revalidate
+CATALOG_HTTP_CACHE = os.environ.get('CATALOG_HTTP_CACHE', '1') == '1'
+CATALOG_MAX_AGE = int(os.environ.get('CATALOG_MAX_AGE', '60'))
+CATALOG_STALE_WHILE_REVALIDATE = int(os.environ.get('CATALOG_STALE_WHILE_REVALIDATE', '300'))
+
+# Product images are resized once into IMAGE_CACHE_DIR by IMAGE_WORKERS
+# processes and served from there, see services/images.py. Image fields that
+# are not URLs name files under IMAGE_SOURCE_DIR.
+IMAGE_CACHE_DIR = Path(os.environ.get('IMAGE_CACHE_DIR', str(ROOT_DIR / 'image_cache')))
+IMAGE_SOURCE_DIR = Path(os.environ.get('IMAGE_SOURCE_DIR', str(ROOT_DIR / 'data' / 'images')))
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '2'))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '80'))
+images: Optional[ImageStore] = None
+
+# Checkout prices come from the catalog through a short-lived price cache
+PRICE_CACHE_TTL = float(os.environ.get('PRICE_CACHE_TTL', '30'))
+pricing: Optional[PricingEngine] = None
+
+# Opt-in fast path: catalog and cart handlers write trusted documents straight
+# to orjson instead of validating them into models and again on the way out
+FAST_JSON_RESPONSES = os.environ.get('FAST_JSON_RESPONSES', '0') == '1'
+
+# Brotli/gzip encoding of JSON and text responses of at least
+# COMPRESSION_MIN_SIZE bytes, see services/compression.py
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', '1') == '1'
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+
+# Cart backend, see services/cart_store.py: "mongo", "memory" (in-process
+# hashes, single worker) or "redis". Hash-backed carts are written to MongoDB
+# at checkout and every CART_FLUSH_INTERVAL seconds.
+CART_STORE = os.environ.get('CART_STORE', 'mongo')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+CART_FLUSH_INTERVAL = float(os.environ.get('CART_FLUSH_INTERVAL', '5'))
+CART_HASH_TTL = float(os.environ.get('CART_HASH_TTL', '86400'))
+cart_store: Optional[CartStore] = None
+
+# Retries of POST /api/orders carrying the same Idempotency-Key get the first
+# attempt's response; duplicates arriving meanwhile wait up to
+# IDEMPOTENCY_WAIT_SECONDS for it
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '30'))
+idempotency: Optional[IdempotencyStore] = None
+
+# Stock reserved at checkout is put back if the order is not paid within
+# RESERVATION_TTL_SECONDS; expired reservations are swept every
+# INVENTORY_SWEEP_INTERVAL seconds (0 disables), see services/inventory.py
+RESERVATION_TTL_SECONDS = float(os.environ.get('RESERVATION_TTL_SECONDS', '900'))
+INVENTORY_SWEEP_INTERVAL = float(os.environ.get('INVENTORY_SWEEP_INTERVAL', '30'))
+inventory: Optional[Inventory] = None
+inventory_task: Optional[asyncio.Task] = None
+
+# Order events (creation, status changes) are delivered to OUTBOX_WEBHOOK_URL,
+# or logged when it is empty, in chunks of OUTBOX_BATCH_SIZE orders every
+# OUTBOX_RELAY_INTERVAL seconds (0 disables), see services/outbox.py. A relay
+# holds the orders it claimed for OUTBOX_CLAIM_SECONDS; an order the sink keeps
+# rejecting has its events moved to outbox_failed after OUTBOX_MAX_ATTEMPTS.
+OUTBOX_WEBHOOK_URL = os.environ.get('OUTBOX_WEBHOOK_URL', '')
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_RELAY_INTERVAL = float(os.environ.get('OUTBOX_RELAY_INTERVAL', '1'))
+OUTBOX_CLAIM_SECONDS = float(os.environ.get('OUTBOX_CLAIM_SECONDS', '60'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '5'))
+outbox_sink: Optional[WebhookSink] = None
+outbox_task: Optional[asyncio.Task] = None
+
+# Cached total counts for paginated order listings
+ORDER_COUNT_TTL = float(os.environ.get('ORDER_COUNT_TTL', '30'))
+order_counts = CountCache(ttl=ORDER_COUNT_TTL)
+
+# Create the indexes declared in services/indexes.py on startup
+ENSURE_INDEXES = os.environ.get('ENSURE_INDEXES', '1') == '1'
+
+# Background removal of empty carts (seconds, 0 disables)
+CART_COMPACTION_INTERVAL = float(os.environ.get('CART_COMPACTION_INTERVAL', '3600'))
+CART_EMPTY_GRACE_SECONDS = float(os.environ.get('CART_EMPTY_GRACE_SECONDS', '3600'))
+cart_compaction_task: Optional[asyncio.Task] = None
+
+# Sales rollups read by /api/analytics, refreshed every
+# ANALYTICS_REFRESH_INTERVAL seconds (0 disables); days are cut in ANALYTICS_TIMEZONE
+ANALYTICS_REFRESH_INTERVAL = float(os.environ.get('ANALYTICS_REFRESH_INTERVAL', '300'))
+ANALYTICS_TIMEZONE = os.environ.get('ANALYTICS_TIMEZONE', 'UTC')
+analytics_task: Optional[asyncio.Task] = None
+
+# Prometheus metrics at /metrics, see services/metrics.py. Requests slower than
+# SLOW_REQUEST_MS (0 disables) are logged with their MongoDB commands and the
+# query plan of the slowest one.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '0'))
+
+# Load data/sample_products.json into an empty catalog on startup
+SEED_SAMPLE_DATA = os.environ.get('SEED_SAMPLE_DATA', '1') == '1'
 
 # Create the main app without a prefix
 app = FastAPI(title="Darling Boutique API", version="1.0.0")
@@ -31,290 +178,334 @@ app = FastAPI(title="Darling Boutique API", version="1.0.0")
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Initialize sample data flag
-sample_data_initialized = False
-
-async def initialize_sample_data():
-    """Initialize sample products if database is empty"""
-    global sample_data_initialized
-    if sample_data_initialized:
-        return
-    
-    # Check if products already exist
-    existing_products = await db.products.count_documents({})
-    if existing_products > 0:
-        sample_data_initialized = True
-        return
-    
-    # Sample products data
-    sample_products = [
-        {
-            "name": "Collier Élégant Doré",
-            "price": 25000,
-            "category": "bijoux",
-            "subcategory": "colliers",
-            "image": "https://images.unsplash.com/photo-1611652022419-a9419f74343d?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDk1NzZ8MHwxfHNlYXJjaHwyfHxqZXdlbHJ5fGVufDB8fHx8MTc1MzU2NTYyMHww&ixlib=rb-4.1.0&q=85",
-            "description": "Magnifique collier doré pour toutes occasions",
-            "inStock": True,
-            "rating": 4.8,
-            "reviews": 23
-        },
-        {
-            "name": "Bagues Dorées Set de 3",
-            "price": 15000,
-            "category": "bijoux",
-            "subcategory": "bagues",
-            "image": "https://images.unsplash.com/photo-1543294001-f7cd5d7fb516?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDk1NzZ8MHwxfHNlYXJjaHw0fHxqZXdlbHJ5fGVufDB8fHx8MTc1MzU2NTYyMHww&ixlib=rb-4.1.0&q=85",
-            "description": "Ensemble de 3 bagues dorées élégantes",
-            "inStock": True,
-            "rating": 4.5,
-            "reviews": 18
-        },
-        {
-            "name": "Bracelet Argent Délicat",
-            "price": 18000,
-            "category": "bijoux",
-            "subcategory": "bracelets",
-            "image": "https://images.unsplash.com/photo-1611652022419-a9419f74343d?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDk1NzZ8MHwxfHNlYXJjaHwyfHxqZXdlbHJ5fGVufDB8fHx8MTc1MzU2NTYyMHww&ixlib=rb-4.1.0&q=85",
-            "description": "Bracelet en argent avec finition délicate",
-            "inStock": True,
-            "rating": 4.7,
-            "reviews": 31
-        },
-        {
-            "name": "AirPods Pro Sans Fil",
-            "price": 85000,
-            "category": "tech",
-            "subcategory": "ecouteurs",
-            "image": "https://images.unsplash.com/photo-1572569511254-d8f925fe2cbb?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDQ2MzR8MHwxfHNlYXJjaHwzfHx3aXJlbGVzcyUyMGVhcmJ1ZHN8ZW58MHx8fHwxNzUzNTY1NjI2fDA&ixlib=rb-4.1.0&q=85",
-            "description": "Écouteurs sans fil de haute qualité avec réduction de bruit",
-            "inStock": True,
-            "rating": 4.9,
-            "reviews": 156
-        },
-        {
-            "name": "Casque Bluetooth Premium",
-            "price": 75000,
-            "category": "tech",
-            "subcategory": "casques",
-            "image": "https://images.unsplash.com/photo-1628329567705-f8f7150c3cff?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDk1Nzd8MHwxfHNlYXJjaHwxfHxibHVldG9vdGglMjBoZWFkcGhvbmVzfGVufDB8fHx8MTc1MzU2NTYzMHww&ixlib=rb-4.1.0&q=85",
-            "description": "Casque audio bluetooth avec son haute fidélité",
-            "inStock": True,
-            "rating": 4.6,
-            "reviews": 89
-        },
-        {
-            "name": "Écouteurs Colorés Set",
-            "price": 35000,
-            "category": "tech",
-            "subcategory": "ecouteurs",
-            "image": "https://images.unsplash.com/photo-1590658268037-6bf12165a8df?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDQ2MzR8MHwxfHNlYXJjaHw0fHx3aXJlbGVzcyUyMGVhcmJ1ZHN8ZW58MHx8fHwxNzUzNTY1NjI2fDA&ixlib=rb-4.1.0&q=85",
-            "description": "Collection d'écouteurs sans fil colorés",
-            "inStock": True,
-            "rating": 4.3,
-            "reviews": 67
-        },
-        {
-            "name": "Ventilateur Miniature USB",
-            "price": 12000,
-            "category": "tech",
-            "subcategory": "ventilateurs",
-            "image": "https://images.unsplash.com/photo-1628329567705-f8f7150c3cff?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDk1Nzd8MHwxfHNlYXJjaHwxfHxibHVldG9vdGglMjBoZWFkcGhvbmVzfGVufDB8fHx8MTc1MzU2NTYzMHww&ixlib=rb-4.1.0&q=85",
-            "description": "Ventilateur portable miniature avec câble USB",
-            "inStock": True,
-            "rating": 4.1,
-            "reviews": 42
-        }
-    ]
-    
-    # Insert sample products
-    for product_data in sample_products:
-        product = Product(**product_data)
-        await db.products.insert_one(product.dict())
-    
-    sample_data_initialized = True
-    logging.info("Sample products initialized")
-
 # Dependency to get session_id from headers or generate one
 async def get_session_id(session_id: Optional[str] = None) -> str:
     if not session_id:
         return str(uuid.uuid4())
     return session_id
 
+def sparse_fields(fields: Optional[str], model) -> Optional[List[str]]:
+    try:
+        return parse_fields(fields, model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # Product routes
+def set_page_headers(response: Response, next_cursor: Optional[str], total: int):
+    """Pagination metadata travels in headers so list bodies stay unchanged"""
+    response.headers["X-Total-Count"] = str(total)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
 @api_router.get("/products", response_model=List[Product])
 async def get_products(
+    response: Response,
     category: Optional[str] = None,
     subcategory: Optional[str] = None,
     search: Optional[str] = None,
-    sort_by: Optional[str] = "name"
+    sort_by: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
 ):
-    """Get all products with optional filtering and sorting"""
-    await initialize_sample_data()
-    
-    # Build filter query
-    filter_query = {}
-    if category:
-        filter_query["category"] = category
-    if subcategory:
-        filter_query["subcategory"] = subcategory
-    if search:
-        filter_query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
-    
-    # Build sort query
-    sort_query = []
-    if sort_by == "price-asc":
-        sort_query = [("price", 1)]
-    elif sort_by == "price-desc":
-        sort_query = [("price", -1)]
-    elif sort_by == "rating":
-        sort_query = [("rating", -1)]
-    else:  # name
-        sort_query = [("name", 1)]
+    """Get all products with optional filtering and sorting
+
+    sort_by: name, price-asc, price-desc, rating or relevance (the default
+    when searching). Pass the X-Next-Cursor response header back as
+    ``cursor`` to fetch the next page. ``fields`` (e.g. id,name,price)
+    limits each product to those fields.
+    """
+    selected = sparse_fields(fields, Product)
+    try:
+        if search:
+            page = await catalog_cache.search(
+                search, category, subcategory, sort_by or "relevance", cursor, limit
+            )
+        else:
+            page = await catalog_cache.get_products(
+                category, subcategory, sort_by or "name", cursor, limit
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    products = await db.products.find(filter_query).sort(sort_query).to_list(1000)
-    return [Product(**product) for product in products]
+    if selected:
+        sparse = ORJSONResponse([product.dict(include=set(selected)) for product in page.items])
+        set_page_headers(sparse, page.next_cursor, page.total)
+        return sparse
+    if FAST_JSON_RESPONSES:
+        encoded = Response(catalog_cache.products_json(page.items), media_type="application/json")
+        set_page_headers(encoded, page.next_cursor, page.total)
+        return encoded
+    # Serialized through response_model; the headers go on the injected response
+    set_page_headers(response, page.next_cursor, page.total)
+    return page.items
+
+@api_router.get("/products/facets", response_model=ProductFacets)
+async def get_product_facets(
+    category: Optional[str] = None,
+    subcategory: Optional[str] = None,
+    search: Optional[str] = None
+):
+    """Counts and price range of the products /api/products returns for the same filters"""
+    return await catalog_cache.get_facets(category, subcategory, search)
+
+CATALOG_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+@api_router.post("/products/import")
+async def import_products(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|jsonl|parquet)$"),
+    chunk_size: int = Query(50000, ge=1000, le=500000)
+):
+    """Upsert products from a CSV, JSON lines or Parquet catalog, keyed on id
+
+    The format defaults to the file extension. Invalid rows are skipped and
+    the first ones are listed in the report.
+    """
+    try:
+        fmt = format or catalog_format(file.filename or "")
+        report = await import_catalog(db, read_frames(file.file, fmt, chunk_size))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    catalog_cache.invalidate()
+    pricing.invalidate()
+    return report
+
+@api_router.get("/products/export")
+async def export_products(
+    format: str = Query("csv", pattern="^(csv|jsonl|parquet)$"),
+    chunk_size: int = Query(50000, ge=1000, le=500000)
+):
+    """Stream the whole catalog in the format accepted by /products/import"""
+    extension = next(suffix for suffix, fmt in FORMATS.items() if fmt == format)
+    return StreamingResponse(
+        export_catalog(replica_db, format, chunk_size),
+        media_type=CATALOG_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="catalog{extension}"'}
+    )
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
+async def get_product(product_id: str, fields: Optional[str] = None):
     """Get a specific product by ID"""
-    product = await db.products.find_one({"id": product_id})
+    selected = sparse_fields(fields, Product)
+    product = await catalog_cache.get_product(product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if selected:
+        return ORJSONResponse(product.dict(include=set(selected)))
+    if FAST_JSON_RESPONSES:
+        return Response(catalog_cache.product_json(product), media_type="application/json")
+    return product
+
+@api_router.get("/products/{product_id}/images/{variant}", response_class=FileResponse)
+async def get_product_image(
+    product_id: str,
+    variant: str,
+    v: Optional[str] = None,
+    format: Optional[str] = Query(None, pattern="^(webp|jpeg)$"),
+    accept: Optional[str] = Header(None)
+):
+    """A resized copy of the product image (see Product.image_variants)
+
+    WebP unless the client does not accept it or ``format`` says otherwise.
+    URLs carrying the current ``v`` are cached for a year.
+    """
+    if variant not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=404, detail="Unknown image variant")
+    product = await catalog_cache.get_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return Product(**product)
+    fmt = format or ("webp" if accept and "image/webp" in accept else "jpeg")
+    try:
+        path = await images.variant(product.image, variant, fmt)
+    except ImageSourceError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    # v is derived from the image URL: a new image gets new URLs
+    current = v is not None and product.image_variants[variant].endswith(f"?v={v}")
+    headers = {"Cache-Control": "public, max-age=31536000, immutable" if current else "public, max-age=300"}
+    if format is None:
+        headers["Vary"] = "Accept"
+    # Streamed from disk in chunks: uvicorn does not implement the zero-copy
+    # http.response.pathsend extension
+    return FileResponse(path, media_type=IMAGE_FORMATS[fmt][1], headers=headers)
+
+@api_router.get("/products/{product_id}/stock", response_model=StockLevel)
+async def get_product_stock(product_id: str):
+    """Units left of a product (null when its stock is not tracked)"""
+    level = await inventory.stock_level(product_id)
+    if level is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    stock, shards = level
+    return StockLevel(product_id=product_id, stock=stock, shards=shards)
+
+@api_router.put("/products/{product_id}/stock", response_model=StockLevel)
+async def set_product_stock(product_id: str, update: StockUpdate):
+    """Set the units left of a product
+
+    Products expecting many concurrent buyers (flash sales) should spread
+    their stock over several ``shards``.
+    """
+    if not await inventory.set_stock(product_id, update.stock, update.shards):
+        raise HTTPException(status_code=404, detail="Product not found")
+    catalog_cache.invalidate()
+    pricing.invalidate()
+    return StockLevel(product_id=product_id, stock=update.stock,
+                      shards=update.shards if update.stock is not None else 1)
 
 # Cart routes
 @api_router.get("/cart/{session_id}", response_model=Cart)
-async def get_cart(session_id: str):
-    """Get cart for a session"""
-    cart = await db.carts.find_one({"session_id": session_id})
+async def get_cart(session_id: str, fields: Optional[str] = None):
+    """Get cart for a session; ``fields`` limits each item to those CartItem fields"""
+    item_fields = sparse_fields(fields, CartItem)
+    cart = await cart_store.get(session_id)
     if not cart:
-        # Create empty cart
-        new_cart = Cart(session_id=session_id, items=[], total=0.0)
-        await db.carts.insert_one(new_cart.dict())
-        return new_cart
+        # Carts are persisted on first add; unknown sessions get an unsaved empty cart
+        return Cart(session_id=session_id, items=[], total=0.0)
+    
+    if await pricing.reprice_cart(cart):
+        await cart_store.save_prices(session_id, cart)
+    if item_fields:
+        return ORJSONResponse(cart_payload(cart, item_fields))
+    if FAST_JSON_RESPONSES:
+        return ORJSONResponse(cart)
     return Cart(**cart)
 
+def cart_payload(cart: dict, item_fields: Optional[List[str]]) -> dict:
+    """The cart as stored (fast JSON mode) or validated, items trimmed to ``item_fields``"""
+    if not FAST_JSON_RESPONSES:
+        cart = Cart(**cart).dict()
+    if item_fields:
+        cart = {**cart, "items": [project(item, item_fields) for item in cart["items"]]}
+    return cart
+
+def cart_response(message: str, cart: dict, item_fields: Optional[List[str]] = None,
+                  changed: Optional[str] = None):
+    """The stored cart is returned as-is in fast JSON mode, as a Cart otherwise
+
+    With ``changed`` (the product id a mutation touched) only that item, null
+    once removed, and the new totals are returned instead of the whole cart.
+    """
+    if changed is not None:
+        item = next((item for item in cart_payload(cart, None)["items"] if item["product_id"] == changed), None)
+        return ORJSONResponse({
+            "message": message,
+            "product_id": changed,
+            "item": project(item, item_fields) if item and item_fields else item,
+            "total": cart["total"],
+            "item_count": len(cart["items"]),
+        })
+    if item_fields:
+        return ORJSONResponse({"message": message, "cart": cart_payload(cart, item_fields)})
+    if FAST_JSON_RESPONSES:
+        return ORJSONResponse({"message": message, "cart": cart})
+    return {"message": message, "cart": Cart(**cart)}
+
 @api_router.post("/cart/{session_id}/add")
-async def add_to_cart(session_id: str, item: CartItemAdd):
-    """Add item to cart"""
+async def add_to_cart(session_id: str, item: CartItemAdd, fields: Optional[str] = None, delta: bool = False):
+    """Add item to cart
+
+    ``delta=true`` returns the added item and the new total instead of the cart.
+    """
+    item_fields = sparse_fields(fields, CartItem)
     # Get product details
-    product = await db.products.find_one({"id": item.product_id})
+    product = (await pricing.lookup([item.product_id])).get(item.product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    # Stock is only reserved at checkout; this check may be a few seconds stale
+    if product.get("stock") is not None:
+        cart = await cart_store.get(session_id)
+        in_cart = sum(line["quantity"] for line in (cart or {}).get("items", [])
+                      if line["product_id"] == item.product_id)
+        if product["stock"] < in_cart + item.quantity:
+            raise HTTPException(status_code=409, detail="Stock insuffisant")
     
-    # Get or create cart
-    cart = await db.carts.find_one({"session_id": session_id})
-    if not cart:
-        cart = Cart(session_id=session_id, items=[], total=0.0).dict()
-    else:
-        cart = Cart(**cart).dict()
-    
-    # Check if item already exists in cart
-    existing_item = None
-    for i, cart_item in enumerate(cart["items"]):
-        if cart_item["product_id"] == item.product_id:
-            existing_item = i
-            break
-    
-    if existing_item is not None:
-        # Update quantity
-        cart["items"][existing_item]["quantity"] += item.quantity
-        cart["items"][existing_item]["subtotal"] = cart["items"][existing_item]["quantity"] * cart["items"][existing_item]["product_price"]
-    else:
-        # Add new item
-        cart_item = CartItem(
-            product_id=item.product_id,
-            product_name=product["name"],
-            product_price=product["price"],
-            product_image=product["image"],
-            quantity=item.quantity,
-            subtotal=product["price"] * item.quantity
-        )
-        cart["items"].append(cart_item.dict())
-    
-    # Recalculate total
-    cart["total"] = sum(item["subtotal"] for item in cart["items"])
-    cart["updated_at"] = datetime.utcnow()
-    
-    # Update in database
-    await db.carts.replace_one(
-        {"session_id": session_id},
-        cart,
-        upsert=True
+    cart_item = CartItem(
+        product_id=item.product_id,
+        product_name=product["name"],
+        product_price=product["price"],
+        product_image=product["image"],
+        quantity=item.quantity,
+        subtotal=product["price"] * item.quantity
     )
+    cart = await cart_store.add_item(session_id, cart_item)
     
-    return {"message": "Item added to cart", "cart": Cart(**cart)}
+    return cart_response("Item added to cart", cart, item_fields, item.product_id if delta else None)
 
 @api_router.put("/cart/{session_id}/update/{product_id}")
-async def update_cart_item(session_id: str, product_id: str, update: CartItemUpdate):
+async def update_cart_item(session_id: str, product_id: str, update: CartItemUpdate,
+                           fields: Optional[str] = None, delta: bool = False):
     """Update item quantity in cart"""
-    cart = await db.carts.find_one({"session_id": session_id})
+    item_fields = sparse_fields(fields, CartItem)
+    product = (await pricing.lookup([product_id])).get(product_id)
+    if product and product.get("stock") is not None and product["stock"] < update.quantity:
+        raise HTTPException(status_code=409, detail="Stock insuffisant")
+    try:
+        cart = await cart_store.set_quantity(session_id, product_id, update.quantity)
+    except ItemNotInCart:
+        raise HTTPException(status_code=404, detail="Item not found in cart")
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
     
-    cart = Cart(**cart).dict()
-    
-    # Find and update item
-    item_found = False
-    for item in cart["items"]:
-        if item["product_id"] == product_id:
-            item["quantity"] = update.quantity
-            item["subtotal"] = item["product_price"] * update.quantity
-            item_found = True
-            break
-    
-    if not item_found:
-        raise HTTPException(status_code=404, detail="Item not found in cart")
-    
-    # Recalculate total
-    cart["total"] = sum(item["subtotal"] for item in cart["items"])
-    cart["updated_at"] = datetime.utcnow()
-    
-    # Update in database
-    await db.carts.replace_one({"session_id": session_id}, cart)
-    
-    return {"message": "Cart updated", "cart": Cart(**cart)}
+    return cart_response("Cart updated", cart, item_fields, product_id if delta else None)
 
 @api_router.delete("/cart/{session_id}/remove/{product_id}")
-async def remove_from_cart(session_id: str, product_id: str):
+async def remove_from_cart(session_id: str, product_id: str, fields: Optional[str] = None, delta: bool = False):
     """Remove item from cart"""
-    cart = await db.carts.find_one({"session_id": session_id})
+    item_fields = sparse_fields(fields, CartItem)
+    cart = await cart_store.remove_item(session_id, product_id)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
     
-    cart = Cart(**cart).dict()
-    
-    # Remove item
-    cart["items"] = [item for item in cart["items"] if item["product_id"] != product_id]
-    
-    # Recalculate total
-    cart["total"] = sum(item["subtotal"] for item in cart["items"])
-    cart["updated_at"] = datetime.utcnow()
-    
-    # Update in database
-    await db.carts.replace_one({"session_id": session_id}, cart)
-    
-    return {"message": "Item removed from cart", "cart": Cart(**cart)}
+    return cart_response("Item removed from cart", cart, item_fields, product_id if delta else None)
 
 @api_router.delete("/cart/{session_id}/clear")
 async def clear_cart(session_id: str):
     """Clear all items from cart"""
+    await cart_store.clear(session_id)
     empty_cart = Cart(session_id=session_id, items=[], total=0.0)
-    await db.carts.replace_one(
-        {"session_id": session_id},
-        empty_cart.dict(),
-        upsert=True
-    )
     return {"message": "Cart cleared", "cart": empty_cart}
 
 # Order routes
-@api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate):
-    """Create a new order"""
+@api_router.post("/orders", response_model=Order, responses={202: {"model": Order}})
+async def create_order(
+    order_data: OrderCreate,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255)
+):
+    """Create a new order
+
+    Clients should send an Idempotency-Key header, the same on every retry of
+    one checkout: the order is then created and charged once, and retries get
+    the first response back (with Idempotent-Replayed: true).
+    """
+    if not idempotency_key:
+        return await place_order(order_data)
+
+    async def attempt() -> StoredResponse:
+        try:
+            result = await place_order(order_data)
+        except HTTPException as e:
+            result = JSONResponse(status_code=e.status_code, content={"detail": e.detail})
+        if not isinstance(result, Response):
+            result = JSONResponse(content=jsonable_encoder(result))
+        return StoredResponse(result.status_code, result.body, result.media_type)
+
+    try:
+        stored, replayed = await idempotency.run(
+            "orders", idempotency_key, fingerprint(jsonable_encoder(order_data)), attempt
+        )
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyTimeout as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(stored.body, status_code=stored.status_code, media_type=stored.media_type,
+                    headers={"Idempotent-Replayed": "true" if replayed else "false"})
+
+async def place_order(order_data: OrderCreate):
     # Validate payment method and phone number
     if not PaymentService.validate_phone_number(order_data.phone_number, order_data.payment_method):
         raise HTTPException(
@@ -322,12 +513,19 @@ async def create_order(order_data: OrderCreate):
             detail=f"Numéro de téléphone invalide pour {order_data.payment_method}"
         )
     
-    # Calculate total
-    total = sum(item.subtotal for item in order_data.items)
+    # Price the order from the catalog, never from client-sent subtotals
+    try:
+        items = await pricing.price_items(order_data.items)
+    except UnknownProductsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total = sum(item.subtotal for item in items)
+    
+    if payment_queue is not None and payment_queue.full():
+        raise HTTPException(status_code=503, detail="Service de paiement saturé, réessayez plus tard")
     
     # Create order
     order = Order(
-        items=order_data.items,
+        items=items,
         total=total,
         payment_method=order_data.payment_method,
         phone_number=order_data.phone_number,
@@ -336,8 +534,35 @@ async def create_order(order_data: OrderCreate):
         status=OrderStatus.PENDING
     )
     
-    # Save order
-    await db.orders.insert_one(order.dict())
+    # Hold the stock until the order is paid
+    try:
+        await inventory.reserve(order.id, ((item.product_id, item.quantity) for item in items))
+    except OutOfStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    # Save order with its creation event, and the cart it came from when carts
+    # live outside MongoDB
+    try:
+        await insert_order(order, {
+            "outbox": [order_event(ORDER_CREATED, order.status, None, order.created_at)],
+            **(payment_queue.lease_fields() if payment_queue is not None else {})
+        })
+    except BaseException:
+        await inventory.release(order.id)
+        raise
+    if order_data.session_id:
+        await cart_store.persist(order_data.session_id)
+    
+    if payment_queue is not None:
+        # Payment settles in the background; poll GET /api/orders/{id} for status
+        try:
+            payment_queue.enqueue(order)
+        except QueueFull:
+            # Filled up while the order was being written: it is never charged
+            await settle_order(order, OrderStatus.CANCELLED, payment_error="Payment queue full")
+            await inventory.release(order.id)
+            raise HTTPException(status_code=503, detail="Service de paiement saturé, réessayez plus tard")
+        return JSONResponse(status_code=202, content=jsonable_encoder(order))
     
     # Process payment
     try:
@@ -349,31 +574,57 @@ async def create_order(order_data: OrderCreate):
         )
         
         if payment_result["success"]:
-            # Update order status
-            order.status = OrderStatus.CONFIRMED
-            await db.orders.replace_one({"id": order.id}, order.dict())
+            await settle_order(order, OrderStatus.CONFIRMED, transaction_id=payment_result.get("transaction_id"))
+            await inventory.commit(order.id)
             
             # Clear cart if session_id provided
             if order_data.session_id:
-                await db.carts.delete_one({"session_id": order_data.session_id})
+                await cart_store.clear(order_data.session_id)
             
             return order
         else:
-            # Payment failed, update order status
-            order.status = OrderStatus.CANCELLED
-            await db.orders.replace_one({"id": order.id}, order.dict())
+            await settle_order(order, OrderStatus.CANCELLED, payment_error=payment_result["error"])
+            await inventory.release(order.id)
             
             raise HTTPException(
                 status_code=400,
                 detail=f"Échec du paiement: {payment_result['error']}"
             )
     
+    except HTTPException:
+        raise
     except Exception as e:
-        # Update order status to cancelled
-        order.status = OrderStatus.CANCELLED
-        await db.orders.replace_one({"id": order.id}, order.dict())
+        # Cancels the order unless it was confirmed before the failure
+        await settle_order(order, OrderStatus.CANCELLED, payment_error=str(e))
+        await inventory.release(order.id)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def insert_order(order: Order, fields: Dict[str, Any], attempts: int = 3) -> None:
+    """Insert a new order, drawing another order number if it is already taken"""
+    for attempt in range(attempts):
+        try:
+            await db.orders.insert_one({**order.dict(), **fields})
+            return
+        except DuplicateKeyError as e:
+            if "order_number" not in (e.details or {}).get("keyPattern", {}) or attempt == attempts - 1:
+                raise
+            logger.warning("Order number %s already taken, drawing another", order.order_number)
+            order.order_number = new_order_number()
+
+async def settle_order(order: Order, status: OrderStatus, **fields: Any) -> bool:
+    """Move a pending order to ``status`` with a partial update, queuing its outbox event"""
+    now = datetime.utcnow()
+    result = await db.orders.update_one(
+        {"id": order.id, "status": OrderStatus.PENDING},
+        transition(status, OrderStatus.PENDING, now, **fields)
+    )
+    if not result.modified_count:
+        return False
+    order.status, order.updated_at = status, now
+    for name, value in fields.items():
+        setattr(order, name, value)
+    return True
+
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str):
     """Get a specific order"""
@@ -383,43 +634,131 @@ async def get_order(order_id: str):
     return Order(**order)
 
 @api_router.get("/orders", response_model=List[Order])
-async def get_orders(session_id: Optional[str] = None, user_id: Optional[str] = None):
-    """Get orders for a session or user"""
+async def get_orders(
+    response: Response,
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """Get orders for a session or user, newest first"""
     filter_query = {}
     if session_id:
         filter_query["session_id"] = session_id
     if user_id:
         filter_query["user_id"] = user_id
     
-    orders = await db.orders.find(filter_query).sort([("created_at", -1)]).to_list(1000)
+    page_query = filter_query
+    if cursor:
+        try:
+            created_at, last_id = decode_cursor(cursor, "created_at")
+            created_at = datetime.fromisoformat(created_at)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # Resume strictly after the last (created_at, id) already returned
+        page_query = {
+            **filter_query,
+            "$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": last_id}}
+            ]
+        }
+    
+    orders = await db.orders.find(page_query).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        last = orders[-1]
+        next_cursor = encode_cursor("created_at", [last["created_at"].isoformat(), last["id"]])
+    
+    total = await order_counts.count(db.orders, filter_query)
+    set_page_headers(response, next_cursor, total)
     return [Order(**order) for order in orders]
 
+@api_router.put("/orders/{order_id}/status", response_model=Order)
+async def update_order_status(order_id: str, update: OrderStatusUpdate):
+    """Move an order to a new status, following MANUAL_TRANSITIONS"""
+    outcome = await transition_orders(db, update.status, order_ids=[order_id], inventory=inventory)
+    result = outcome.results[0]
+    if not result.updated:
+        raise HTTPException(status_code=404 if result.previous_status is None else 409,
+                            detail=result.error)
+    return Order(**await db.orders.find_one({"id": order_id}))
+
+@api_router.post("/orders/bulk/status", response_model=OrderStatusBulkResult)
+async def bulk_update_order_status(update: OrderStatusBulkUpdate):
+    """Move many orders to a new status with per-order results
+
+    Give either ``order_ids`` or a ``filter``; a filter selects at most
+    MAX_BULK_ORDERS orders whose status allows the transition, so repeat the
+    call until ``matched`` is 0.
+    """
+    if (update.order_ids is None) == (update.filter is None):
+        raise HTTPException(status_code=400, detail="Provide either order_ids or filter")
+    return await transition_orders(db, update.status, update.order_ids, update.filter, inventory)
+
+@api_router.post("/orders/bulk/import", response_model=OrderImportReport)
+async def bulk_import_orders(rows: List[Dict[str, Any]]):
+    """Import already-priced marketplace orders, keyed by order_number"""
+    if len(rows) > MAX_BULK_ORDERS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ORDERS} orders per import")
+    report = await import_orders(db, rows)
+    if report.inserted:
+        order_counts.clear()
+    return report
+
+# Analytics routes, served from the rollups of services/analytics.py
+def analytics_range(start: Optional[date], end: Optional[date]):
+    """Inclusive day range, the last 30 days by default"""
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return start.isoformat(), end.isoformat()
+
+@api_router.get("/analytics/daily", response_model=List[DailySales])
+async def get_daily_sales(start: Optional[date] = None, end: Optional[date] = None):
+    """Orders and paid revenue per day"""
+    return await analytics.daily_sales(replica_db, *analytics_range(start, end))
+
+@api_router.get("/analytics/status", response_model=List[StatusCount])
+async def get_status_counts(start: Optional[date] = None, end: Optional[date] = None):
+    """Order counts and amounts by status"""
+    return await analytics.status_counts(replica_db, *analytics_range(start, end))
+
+@api_router.get("/analytics/payment-methods", response_model=List[PaymentMethodStats])
+async def get_payment_method_stats(start: Optional[date] = None, end: Optional[date] = None):
+    """Revenue and payment success rate per operator"""
+    return await analytics.payment_method_stats(replica_db, *analytics_range(start, end))
+
+@api_router.get("/analytics/top-products", response_model=List[ProductSales])
+async def get_top_products(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = Query(10, ge=1, le=100)
+):
+    """Best-selling products by paid revenue"""
+    return await analytics.product_sales(replica_db, *analytics_range(start, end), limit)
+
+@api_router.get("/analytics/categories", response_model=List[CategorySales])
+async def get_category_sales(start: Optional[date] = None, end: Optional[date] = None):
+    """Paid revenue per product category"""
+    return await analytics.category_sales(replica_db, *analytics_range(start, end))
+
+@api_router.post("/analytics/refresh")
+async def refresh_analytics(full: bool = False):
+    """Refresh the rollups now instead of waiting for the periodic job"""
+    return await analytics.refresh_rollups(db, ANALYTICS_TIMEZONE, full=full)
+
 # Categories route
 @api_router.get("/categories")
 async def get_categories():
-    """Get product categories"""
-    return {
-        "categories": [
-            {
-                "id": "bijoux",
-                "name": "Bijoux",
-                "subcategories": [
-                    {"id": "colliers", "name": "Colliers"},
-                    {"id": "bracelets", "name": "Bracelets"},
-                    {"id": "bagues", "name": "Bagues"}
-                ]
-            },
-            {
-                "id": "tech",
-                "name": "Tech",
-                "subcategories": [
-                    {"id": "ecouteurs", "name": "Écouteurs Sans Fil"},
-                    {"id": "casques", "name": "Casques Bluetooth"},
-                    {"id": "ventilateurs", "name": "Ventilateurs Miniatures"}
-                ]
-            }
-        ]
-    }
+    """Product categories with product counts, in-stock counts and price ranges"""
+    categories = await catalog_cache.get_categories()
+    return {"categories": [category.dict() for category in categories]}
 
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
@@ -429,14 +768,39 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Added before CORS so that 304 responses get CORS headers too, and in this
+# order so that compression sees the ETag the cache set
+if CATALOG_HTTP_CACHE:
+    app.add_middleware(
+        CatalogHttpCache,
+        get_catalog=lambda: catalog_cache,
+        max_age=CATALOG_MAX_AGE,
+        stale_while_revalidate=CATALOG_STALE_WHILE_REVALIDATE,
+    )
+
+if RESPONSE_COMPRESSION:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag", "Idempotent-Replayed"],
 )
 
+async def explain(database: str, command: dict) -> dict:
+    return await db.client[database].command(command)
+
+# Outermost, so that latencies include the other middlewares
+if METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware, slow_request_ms=SLOW_REQUEST_MS, explain=explain)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -444,6 +808,144 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def route_replica_reads():
+    global replica_db
+    replica_db = replica_reads(db)
+
+@app.on_event("startup")
+async def create_indexes():
+    if ENSURE_INDEXES:
+        await ensure_indexes(db)
+
+@app.on_event("startup")
+async def start_catalog_cache():
+    global catalog_cache, catalog_watch_task, pricing
+    catalog_cache = CatalogCache(db, ttl=CATALOG_CACHE_TTL, replica_db=replica_db)
+    pricing = PricingEngine(db, ttl=PRICE_CACHE_TTL)
+    if CATALOG_CHANGE_STREAM:
+        catalog_watch_task = asyncio.create_task(catalog_cache.watch())
+
+@app.on_event("startup")
+async def start_idempotency_store():
+    global idempotency
+    idempotency = IdempotencyStore(db, wait_timeout=IDEMPOTENCY_WAIT_SECONDS)
+
+@app.on_event("startup")
+async def start_inventory():
+    global inventory, inventory_task
+    inventory = Inventory(db, reservation_ttl=RESERVATION_TTL_SECONDS)
+    if INVENTORY_SWEEP_INTERVAL > 0:
+        inventory_task = asyncio.create_task(inventory.run(INVENTORY_SWEEP_INTERVAL))
+
+@app.on_event("shutdown")
+async def stop_inventory_sweep():
+    if inventory_task is not None:
+        inventory_task.cancel()
+
+@app.on_event("startup")
+async def start_outbox_relay():
+    global outbox_sink, outbox_task
+    if OUTBOX_RELAY_INTERVAL > 0:
+        outbox_sink = WebhookSink(OUTBOX_WEBHOOK_URL) if OUTBOX_WEBHOOK_URL else None
+        relay = OutboxRelay(db, outbox_sink or log_sink, batch_size=OUTBOX_BATCH_SIZE,
+                            interval=OUTBOX_RELAY_INTERVAL, claim_lease=OUTBOX_CLAIM_SECONDS,
+                            max_attempts=OUTBOX_MAX_ATTEMPTS)
+        outbox_task = asyncio.create_task(relay.run())
+
+@app.on_event("shutdown")
+async def stop_outbox_relay():
+    if outbox_task is not None:
+        outbox_task.cancel()
+    if outbox_sink is not None:
+        await outbox_sink.close()
+
+@app.on_event("startup")
+async def start_image_store():
+    global images
+    images = ImageStore(IMAGE_CACHE_DIR, IMAGE_SOURCE_DIR, workers=IMAGE_WORKERS, quality=IMAGE_QUALITY)
+
+@app.on_event("shutdown")
+async def stop_image_store():
+    await images.close()
+
+@app.on_event("startup")
+async def start_cart_store():
+    global cart_store
+    if CART_STORE == "mongo":
+        cart_store = MongoCartStore(db)
+    else:
+        hashes = (RedisCartHashes(REDIS_URL, CART_HASH_TTL) if CART_STORE == "redis"
+                  else LocalCartHashes(CART_HASH_TTL))
+        cart_store = HashCartStore(hashes, db, flush_interval=CART_FLUSH_INTERVAL)
+    await cart_store.start()
+
+@app.on_event("startup")
+async def seed_sample_data():
+    if SEED_SAMPLE_DATA and await seed_sample_products(db):
+        catalog_cache.invalidate()
+        pricing.invalidate()
+
+@app.on_event("shutdown")
+async def stop_catalog_watch():
+    if catalog_watch_task is not None:
+        catalog_watch_task.cancel()
+
+@app.on_event("startup")
+async def start_cart_compaction():
+    global cart_compaction_task
+    if CART_COMPACTION_INTERVAL > 0:
+        cart_compaction_task = asyncio.create_task(run_compaction(
+            db, CART_COMPACTION_INTERVAL, CART_EMPTY_GRACE_SECONDS))
+
+@app.on_event("shutdown")
+async def stop_cart_compaction():
+    if cart_compaction_task is not None:
+        cart_compaction_task.cancel()
+
+@app.on_event("startup")
+async def start_analytics_refresh():
+    global analytics_task
+    if ANALYTICS_REFRESH_INTERVAL > 0:
+        analytics_task = asyncio.create_task(analytics.run_refresh(
+            db, ANALYTICS_REFRESH_INTERVAL, ANALYTICS_TIMEZONE))
+
+@app.on_event("shutdown")
+async def stop_analytics_refresh():
+    if analytics_task is not None:
+        analytics_task.cancel()
+
+@app.on_event("startup")
+async def configure_payment_providers():
+    PaymentService.configure(build_providers_from_env())
+
+@app.on_event("startup")
+async def start_payment_queue():
+    global payment_queue
+    if PAYMENT_MODE == "async":
+        payment_queue = PaymentQueue(db, cart_store, inventory, workers=PAYMENT_WORKERS,
+                                     maxsize=PAYMENT_QUEUE_SIZE, lease=PAYMENT_LEASE_SECONDS,
+                                     recovery_interval=PAYMENT_RECOVERY_INTERVAL)
+        payment_queue.start()
+
+@app.on_event("shutdown")
+async def stop_payment_queue():
+    global payment_queue
+    if payment_queue is not None:
+        await payment_queue.stop(PAYMENT_DRAIN_SECONDS)
+        payment_queue = None
+
+@app.on_event("shutdown")
+async def close_payment_providers():
+    # After the payment queue drained: its workers charge through the providers
+    await PaymentService.close()
+
+@app.on_event("shutdown")
+async def stop_cart_store():
+    # Flushes pending carts, so it must run after the payment workers stopped and
+    # before the client is closed
+    await cart_store.stop()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -0,0 +1,232 @@
+"""
+Materialized sales rollups behind the /api/analytics routes.
+
+refresh_rollups() recomputes the rollups of every day with orders created or
+updated since its previous run, using aggregation pipelines that end in
+``$merge``. It writes one document per day into each collection:
+
+    sales_daily           {_id: "YYYY-MM-DD", breakdown: [{status, payment_method, orders, amount}]}
+    sales_products_daily  {_id: "YYYY-MM-DD", products: [{product_id, product_name, category,
+                                                          quantity, revenue}]}
+
+Reports then read one small document per day instead of scanning orders.
+"""
+import asyncio
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone
+from datetime import time as day_start
+from typing import Any, Dict, List, Tuple
+from zoneinfo import ZoneInfo
+
+from models.analytics import CategorySales, DailySales, PaymentMethodStats, ProductSales, StatusCount
+from models.order import OrderStatus
+
+logger = logging.getLogger(__name__)
+
+PAID_STATUSES = [OrderStatus.CONFIRMED, OrderStatus.PROCESSING, OrderStatus.SHIPPED, OrderStatus.DELIVERED]
+ROLLUPS = ("sales_daily", "sales_products_daily")
+STATE_ID = "sales"
+
+# Orders written while a refresh runs may carry an updated_at slightly older
+# than its start; the next refresh looks back this far to catch them
+WATERMARK_LAG = timedelta(minutes=1)
+
+
+def day_expression(field: str, tz: str) -> Dict[str, Any]:
+    expression = {"format": "%Y-%m-%d", "date": field}
+    if tz != "UTC":
+        expression["timezone"] = tz
+    return {"$dateToString": expression}
+
+
+def day_bounds(first: str, last: str, tz: str) -> Tuple[datetime, datetime]:
+    """Naive UTC range covering the local days ``first`` to ``last``"""
+    zone = ZoneInfo(tz)
+
+    def utc(day: date) -> datetime:
+        return datetime.combine(day, day_start(), zone).astimezone(timezone.utc).replace(tzinfo=None)
+
+    return utc(date.fromisoformat(first)), utc(date.fromisoformat(last) + timedelta(days=1))
+
+
+def day_ranges(days: List[str], tz: str) -> List[Tuple[datetime, datetime]]:
+    """Naive UTC ranges covering the sorted local ``days``, consecutive days merged"""
+    ranges: List[Tuple[str, str]] = []
+    for day in days:
+        if ranges and date.fromisoformat(day) == date.fromisoformat(ranges[-1][1]) + timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return [day_bounds(first, last, tz) for first, last in ranges]
+
+
+def merge_into(collection: str) -> Dict[str, Any]:
+    return {"$merge": {"into": collection, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+
+
+def daily_pipeline(match: Dict[str, Any], tz: str, now: datetime) -> List[Dict[str, Any]]:
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"day": day_expression("$created_at", tz), "status": "$status",
+                    "payment_method": "$payment_method"},
+            "orders": {"$sum": 1},
+            "amount": {"$sum": "$total"},
+        }},
+        {"$group": {
+            "_id": "$_id.day",
+            "breakdown": {"$push": {
+                "status": "$_id.status",
+                "payment_method": "$_id.payment_method",
+                "orders": "$orders",
+                "amount": "$amount",
+            }},
+        }},
+        {"$set": {"refreshed_at": now}},
+        merge_into("sales_daily"),
+    ]
+
+
+def products_pipeline(match: Dict[str, Any], tz: str, now: datetime) -> List[Dict[str, Any]]:
+    return [
+        {"$match": {**match, "status": {"$in": PAID_STATUSES}}},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"day": day_expression("$created_at", tz), "product_id": "$items.product_id"},
+            "product_name": {"$last": "$items.product_name"},
+            "quantity": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": "$items.subtotal"},
+        }},
+        {"$lookup": {"from": "products", "localField": "_id.product_id", "foreignField": "id",
+                     "as": "product"}},
+        {"$group": {
+            "_id": "$_id.day",
+            "products": {"$push": {
+                "product_id": "$_id.product_id",
+                "product_name": "$product_name",
+                "category": {"$arrayElemAt": ["$product.category", 0]},
+                "quantity": "$quantity",
+                "revenue": "$revenue",
+            }},
+        }},
+        {"$set": {"refreshed_at": now}},
+        merge_into("sales_products_daily"),
+    ]
+
+
+async def refresh_rollups(db, tz: str = "UTC", full: bool = False) -> Dict[str, Any]:
+    """Recompute the rollups of days touched since the last run (every day if ``full``)"""
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    state = await db.analytics_state.find_one({"_id": STATE_ID})
+    touched: List[Dict[str, Any]] = [{"$group": {"_id": day_expression("$created_at", tz)}}]
+    if state and not full:
+        touched.insert(0, {"$match": {"updated_at": {"$gte": state["watermark"]}}})
+    days = sorted([row["_id"] async for row in db.orders.aggregate(touched)])
+
+    if days:
+        # Only the touched days: an old order updated today must not recompute the months between
+        match = {"$or": [{"created_at": {"$gte": start, "$lt": end}} for start, end in day_ranges(days, tz)]}
+        await db.orders.aggregate(daily_pipeline(match, tz, now)).to_list(None)
+        await db.orders.aggregate(products_pipeline(match, tz, now)).to_list(None)
+        # Days left without rows this time (e.g. every order cancelled) keep no stale rollup
+        for collection in ROLLUPS:
+            await db[collection].delete_many({"_id": {"$in": days}, "refreshed_at": {"$lt": now}})
+
+    await db.analytics_state.update_one(
+        {"_id": STATE_ID}, {"$set": {"watermark": now - WATERMARK_LAG}}, upsert=True
+    )
+    report = {"days": len(days), "seconds": round(time.perf_counter() - started, 3)}
+    if days:
+        logger.info("Sales rollups refreshed for %d days in %s..%s: %s", len(days), days[0], days[-1], report)
+    return report
+
+
+async def run_refresh(db, interval: float, tz: str = "UTC") -> None:
+    """Refresh the rollups every ``interval`` seconds until cancelled"""
+    while True:
+        try:
+            await refresh_rollups(db, tz)
+        except Exception:
+            logger.exception("Sales rollup refresh failed")
+        await asyncio.sleep(interval)
+
+
+async def rollup_rows(db, collection: str, start: str, end: str) -> List[Dict[str, Any]]:
+    return await db[collection].find({"_id": {"$gte": start, "$lte": end}}).sort("_id", 1).to_list(None)
+
+
+async def daily_sales(db, start: str, end: str) -> List[DailySales]:
+    sales = []
+    for row in await rollup_rows(db, "sales_daily", start, end):
+        paid = [entry for entry in row["breakdown"] if entry["status"] in PAID_STATUSES]
+        sales.append(DailySales(
+            day=row["_id"],
+            orders=sum(entry["orders"] for entry in row["breakdown"]),
+            paid_orders=sum(entry["orders"] for entry in paid),
+            revenue=sum(entry["amount"] for entry in paid),
+        ))
+    return sales
+
+
+async def status_counts(db, start: str, end: str) -> List[StatusCount]:
+    counts: Dict[str, StatusCount] = {}
+    for row in await rollup_rows(db, "sales_daily", start, end):
+        for entry in row["breakdown"]:
+            count = counts.setdefault(entry["status"], StatusCount(status=entry["status"], orders=0, amount=0))
+            count.orders += entry["orders"]
+            count.amount += entry["amount"]
+    return sorted(counts.values(), key=lambda count: count.orders, reverse=True)
+
+
+async def payment_method_stats(db, start: str, end: str) -> List[PaymentMethodStats]:
+    stats: Dict[str, PaymentMethodStats] = {}
+    for row in await rollup_rows(db, "sales_daily", start, end):
+        for entry in row["breakdown"]:
+            method = stats.setdefault(entry["payment_method"], PaymentMethodStats(
+                payment_method=entry["payment_method"], orders=0, paid_orders=0,
+                cancelled_orders=0, revenue=0
+            ))
+            method.orders += entry["orders"]
+            if entry["status"] in PAID_STATUSES:
+                method.paid_orders += entry["orders"]
+                method.revenue += entry["amount"]
+            elif entry["status"] == OrderStatus.CANCELLED:
+                method.cancelled_orders += entry["orders"]
+    for method in stats.values():
+        settled = method.paid_orders + method.cancelled_orders
+        if settled:
+            method.success_rate = round(method.paid_orders / settled, 4)
+    return list(stats.values())
+
+
+async def product_sales(db, start: str, end: str, limit: int) -> List[ProductSales]:
+    rows = await db.sales_products_daily.aggregate([
+        {"$match": {"_id": {"$gte": start, "$lte": end}}},
+        {"$unwind": "$products"},
+        {"$group": {
+            "_id": "$products.product_id",
+            "product_name": {"$last": "$products.product_name"},
+            "category": {"$last": "$products.category"},
+            "quantity": {"$sum": "$products.quantity"},
+            "revenue": {"$sum": "$products.revenue"},
+        }},
+        {"$sort": {"revenue": -1, "_id": 1}},
+        {"$limit": limit},
+    ]).to_list(limit)
+    return [ProductSales(product_id=row.pop("_id"), **row) for row in rows]
+
+
+async def category_sales(db, start: str, end: str) -> List[CategorySales]:
+    rows = await db.sales_products_daily.aggregate([
+        {"$match": {"_id": {"$gte": start, "$lte": end}}},
+        {"$unwind": "$products"},
+        {"$group": {
+            "_id": "$products.category",
+            "quantity": {"$sum": "$products.quantity"},
+            "revenue": {"$sum": "$products.revenue"},
+        }},
+        {"$sort": {"revenue": -1}},
+    ]).to_list(None)
+    return [CategorySales(category=row.pop("_id"), **row) for row in rows]
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+
+async def compact_carts(db, grace_seconds: float = 3600) -> Dict[str, Any]:
+    """
+    Delete carts left empty for longer than ``grace_seconds``
+
+    Abandoned carts with items expire through the TTL index on updated_at;
+    this removes the empty ones (last item removed, legacy empty carts)
+    straight away. Returns the number of documents and BSON bytes reclaimed.
+    """
+    empty = {
+        "$or": [{"items": {"$size": 0}}, {"items": {"$exists": False}}],
+        "updated_at": {"$lt": datetime.utcnow() - timedelta(seconds=grace_seconds)},
+    }
+    stats = await db.carts.aggregate([
+        {"$match": empty},
+        {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}},
+    ]).to_list(1)
+    result = await db.carts.delete_many(empty)
+    report = {
+        "deleted": result.deleted_count,
+        "bytes": stats[0]["bytes"] if stats and result.deleted_count else 0,
+    }
+    if report["deleted"]:
+        logger.info("Cart compaction reclaimed %d documents (%d bytes)",
+                    report["deleted"], report["bytes"])
+    return report
+
+
+async def run_compaction(db, interval: float, grace_seconds: float = 3600) -> None:
+    """Compact carts every ``interval`` seconds until cancelled"""
+    while True:
+        try:
+            await compact_carts(db, grace_seconds)
+        except Exception:
+            logger.exception("Cart compaction failed")
+        await asyncio.sleep(interval)
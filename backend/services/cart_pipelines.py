@@ -0,0 +1,72 @@
+"""
+Update pipelines for single round-trip, atomic cart mutations.
+
+Each pipeline rewrites ``items`` and recomputes ``total`` inside MongoDB, so
+concurrent requests on one session cannot overwrite each other's changes.
+User-supplied values are wrapped in ``$literal`` so they are never read as
+field paths.
+Use them with ``find_one_and_update(..., return_document=ReturnDocument.AFTER)``.
+"""
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List
+
+from models.cart import CartItem
+
+
+def _totals_stage() -> Dict[str, Any]:
+    now = datetime.utcnow()
+    return {"$set": {
+        "total": {"$sum": "$items.subtotal"},
+        "updated_at": now,
+        # Filled in when the update creates the cart
+        "id": {"$ifNull": ["$id", str(uuid.uuid4())]},
+        "user_id": {"$ifNull": ["$user_id", None]},
+        "created_at": {"$ifNull": ["$created_at", now]},
+    }}
+
+
+def _with_quantity(quantity: Any) -> Dict[str, Any]:
+    return {"$mergeObjects": ["$$item", {
+        "quantity": quantity,
+        "subtotal": {"$multiply": [quantity, "$$item.product_price"]},
+    }]}
+
+
+def _map_item(product_id: str, replacement: Dict[str, Any]) -> Dict[str, Any]:
+    return {"$map": {"input": "$items", "as": "item", "in": {"$cond": [
+        {"$eq": ["$$item.product_id", {"$literal": product_id}]}, replacement, "$$item"
+    ]}}}
+
+
+def add_item_pipeline(item: CartItem) -> List[Dict[str, Any]]:
+    """Increase the quantity of ``item`` in the cart, appending it if absent"""
+    items = {"$ifNull": ["$items", []]}
+    return [
+        {"$set": {"items": {"$cond": [
+            {"$in": [{"$literal": item.product_id}, {"$ifNull": ["$items.product_id", []]}]},
+            _map_item(item.product_id, _with_quantity({"$add": ["$$item.quantity", item.quantity]})),
+            {"$concatArrays": [items, [{"$literal": item.dict()}]]},
+        ]}}},
+        _totals_stage(),
+    ]
+
+
+def set_quantity_pipeline(product_id: str, quantity: int) -> List[Dict[str, Any]]:
+    """Set the quantity of an item already in the cart"""
+    return [
+        {"$set": {"items": _map_item(product_id, _with_quantity({"$literal": quantity}))}},
+        _totals_stage(),
+    ]
+
+
+def remove_item_pipeline(product_id: str) -> List[Dict[str, Any]]:
+    """Drop an item from the cart"""
+    return [
+        {"$set": {"items": {"$filter": {
+            "input": {"$ifNull": ["$items", []]},
+            "as": "item",
+            "cond": {"$ne": ["$$item.product_id", {"$literal": product_id}]},
+        }}}},
+        _totals_stage(),
+    ]
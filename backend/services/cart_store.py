@@ -0,0 +1,550 @@
+"""
+Session cart storage behind the /api/cart routes.
+
+``MongoCartStore`` keeps every cart in the carts collection and mutates it
+with the update pipelines of services/cart_pipelines.py.
+
+``HashCartStore`` keeps each cart in one key-value hash (``cart:<session_id>``)
+and writes it through to MongoDB only at checkout and from a periodic flush of
+the sessions changed since the last one. Its hashes live either in Redis
+(``RedisCartHashes``, shared by every worker) or in the process itself
+(``LocalCartHashes``, for tests, benchmarks and single-worker deployments).
+
+Hash layout::
+
+    meta          {"id", "user_id", "created_at"}   absent in a tombstone
+    updated_at    ISO timestamp
+    seq           insertion counter, keeps items in the order they were added
+    item:<id>     JSON cart item, with its "seq"
+
+A hash without ``meta`` is a tombstone: the session is known to have no cart,
+so neither reads nor the next flush need to look at MongoDB.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pymongo import DeleteOne, ReplaceOne, ReturnDocument
+
+from models.cart import Cart, CartItem
+from services.cart_pipelines import add_item_pipeline, remove_item_pipeline, set_quantity_pipeline
+
+logger = logging.getLogger(__name__)
+
+CART_FIELDS = {field: 1 for field in Cart.model_fields} | {"_id": 0}
+ITEM_PREFIX = "item:"
+PRICE_KEYS = ("product_name", "product_price", "product_image")
+
+
+class ItemNotInCart(LookupError):
+    """The cart exists but does not hold the product"""
+
+
+class CartStore:
+    """
+    Interface of the cart backends.
+
+    Carts are plain dicts shaped like models.cart.Cart; mutations return the
+    cart after the change, or None when the session has no cart.
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def add_item(self, session_id: str, item: CartItem) -> Dict[str, Any]:
+        """Increase the quantity of ``item``, creating the cart and the line if needed"""
+        raise NotImplementedError
+
+    async def set_quantity(self, session_id: str, product_id: str, quantity: int) -> Optional[Dict[str, Any]]:
+        """Set the quantity of a line; ItemNotInCart if the cart lacks it"""
+        raise NotImplementedError
+
+    async def remove_item(self, session_id: str, product_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def save_prices(self, session_id: str, cart: Dict[str, Any]) -> None:
+        """Store prices refreshed by PricingEngine.reprice_cart on a cart from get()"""
+        raise NotImplementedError
+
+    async def clear(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    async def persist(self, session_id: str) -> None:
+        """Make sure MongoDB holds the current cart of the session"""
+
+
+class MongoCartStore(CartStore):
+    """Carts stored in MongoDB, one atomic update pipeline per mutation"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.carts.find_one({"session_id": session_id}, CART_FIELDS)
+
+    async def _apply(self, filter_query: Dict[str, Any], pipeline: List[Dict[str, Any]],
+                     upsert: bool = False) -> Optional[Dict[str, Any]]:
+        return await self.db.carts.find_one_and_update(
+            filter_query,
+            pipeline,
+            projection=CART_FIELDS,
+            upsert=upsert,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def add_item(self, session_id: str, item: CartItem) -> Dict[str, Any]:
+        return await self._apply({"session_id": session_id}, add_item_pipeline(item), upsert=True)
+
+    async def set_quantity(self, session_id: str, product_id: str, quantity: int) -> Optional[Dict[str, Any]]:
+        cart = await self._apply(
+            {"session_id": session_id, "items.product_id": product_id},
+            set_quantity_pipeline(product_id, quantity)
+        )
+        if cart is None and await self.db.carts.count_documents({"session_id": session_id}, limit=1):
+            raise ItemNotInCart(product_id)
+        return cart
+
+    async def remove_item(self, session_id: str, product_id: str) -> Optional[Dict[str, Any]]:
+        return await self._apply({"session_id": session_id}, remove_item_pipeline(product_id))
+
+    async def save_prices(self, session_id: str, cart: Dict[str, Any]) -> None:
+        # Only persist if no mutation landed since the read
+        await self.db.carts.update_one(
+            {"session_id": session_id, "updated_at": cart["updated_at"]},
+            {"$set": {"items": cart["items"], "total": cart["total"]}}
+        )
+
+    async def clear(self, session_id: str) -> None:
+        await self.db.carts.delete_one({"session_id": session_id})
+
+
+def cart_to_hash(cart: Dict[str, Any]) -> Dict[str, str]:
+    """Hash fields of a cart document"""
+    fields = {
+        "meta": json.dumps({
+            "id": cart["id"],
+            "user_id": cart.get("user_id"),
+            "created_at": cart["created_at"].isoformat(),
+        }),
+        "updated_at": cart["updated_at"].isoformat(),
+        "seq": str(len(cart.get("items", []))),
+    }
+    for seq, item in enumerate(cart.get("items", []), start=1):
+        fields[ITEM_PREFIX + item["product_id"]] = json.dumps({**item, "seq": seq})
+    return fields
+
+
+def cart_from_hash(session_id: str, fields: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Cart document of a hash, None for a tombstone"""
+    if "meta" not in fields:
+        return None
+    meta = json.loads(fields["meta"])
+    items = [json.loads(value) for key, value in fields.items() if key.startswith(ITEM_PREFIX)]
+    items.sort(key=itemgetter("seq"))
+    for item in items:
+        del item["seq"]
+    return {
+        "id": meta["id"],
+        "user_id": meta.get("user_id"),
+        "session_id": session_id,
+        "items": items,
+        "total": sum(item["subtotal"] for item in items),
+        "created_at": datetime.fromisoformat(meta["created_at"]),
+        "updated_at": datetime.fromisoformat(fields["updated_at"]),
+    }
+
+
+class LocalCartHashes:
+    """
+    In-process stand-in for RedisCartHashes with the same semantics.
+
+    Every operation runs without awaiting, so each one is atomic like the
+    Lua scripts it mirrors. Expired hashes are dropped lazily.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._hashes: Dict[str, Tuple[float, Dict[str, str]]] = {}
+        self._dirty: Set[str] = set()
+
+    def _fields(self, session_id: str) -> Optional[Dict[str, str]]:
+        entry = self._hashes.get(session_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._hashes[session_id]
+            return None
+        return entry[1]
+
+    def _touch(self, session_id: str, fields: Dict[str, str], now: str) -> Dict[str, str]:
+        fields["updated_at"] = now
+        self._hashes[session_id] = (time.monotonic() + self.ttl, fields)
+        self._dirty.add(session_id)
+        return dict(fields)
+
+    async def get(self, session_id: str) -> Dict[str, str]:
+        return dict(self._fields(session_id) or {})
+
+    async def load(self, session_id: str, fields: Dict[str, str]) -> None:
+        if self._fields(session_id) is None:
+            self._hashes[session_id] = (time.monotonic() + self.ttl, dict(fields))
+
+    async def add_item(self, session_id: str, item: Dict[str, Any], meta: str, now: str,
+                       create: bool) -> Optional[Dict[str, str]]:
+        fields = self._fields(session_id)
+        if fields is None:
+            if not create:
+                return None
+            fields = {}
+        fields.setdefault("meta", meta)
+        key = ITEM_PREFIX + item["product_id"]
+        if key in fields:
+            current = json.loads(fields[key])
+            current["quantity"] += item["quantity"]
+            current["subtotal"] = current["quantity"] * current["product_price"]
+        else:
+            fields["seq"] = str(int(fields.get("seq", 0)) + 1)
+            current = {**item, "seq": int(fields["seq"])}
+        fields[key] = json.dumps(current)
+        return self._touch(session_id, fields, now)
+
+    async def set_quantity(self, session_id: str, product_id: str, quantity: int,
+                           now: str) -> Optional[Dict[str, str]]:
+        fields = self._fields(session_id)
+        if fields is None:
+            return None
+        key = ITEM_PREFIX + product_id
+        if key not in fields:
+            return dict(fields)
+        current = json.loads(fields[key])
+        current["quantity"] = quantity
+        current["subtotal"] = quantity * current["product_price"]
+        fields[key] = json.dumps(current)
+        return self._touch(session_id, fields, now)
+
+    async def remove_item(self, session_id: str, product_id: str, now: str) -> Optional[Dict[str, str]]:
+        fields = self._fields(session_id)
+        if fields is None:
+            return None
+        if "meta" not in fields:
+            return dict(fields)
+        fields.pop(ITEM_PREFIX + product_id, None)
+        return self._touch(session_id, fields, now)
+
+    async def set_prices(self, session_id: str, prices: List[Dict[str, Any]]) -> None:
+        fields = self._fields(session_id)
+        if fields is None:
+            return
+        for price in prices:
+            key = ITEM_PREFIX + price["product_id"]
+            if key in fields:
+                current = {**json.loads(fields[key]), **price}
+                current["subtotal"] = current["quantity"] * current["product_price"]
+                fields[key] = json.dumps(current)
+        self._dirty.add(session_id)
+
+    async def clear(self, session_id: str, now: str) -> None:
+        self._touch(session_id, {}, now)
+
+    async def pop_dirty(self, count: int) -> List[str]:
+        popped = []
+        while self._dirty and len(popped) < count:
+            popped.append(self._dirty.pop())
+        return popped
+
+    async def mark_dirty(self, session_ids: List[str]) -> None:
+        self._dirty.update(session_ids)
+
+    async def close(self) -> None:
+        pass
+
+
+# Lua scripts of RedisCartHashes. KEYS: cart hash, dirty set.
+# ARGV[1] now, ARGV[2] ttl, ARGV[3] session id, then per script arguments.
+TOUCH = """
+local function touch()
+    redis.call('HSET', KEYS[1], 'updated_at', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('SADD', KEYS[2], ARGV[3])
+    return redis.call('HGETALL', KEYS[1])
+end
+"""
+
+# ARGV[4] product id, ARGV[5] item JSON, ARGV[6] meta JSON, ARGV[7] "1" to create
+ADD_ITEM = TOUCH + """
+if redis.call('EXISTS', KEYS[1]) == 0 and ARGV[7] ~= '1' then
+    return false
+end
+redis.call('HSETNX', KEYS[1], 'meta', ARGV[6])
+local key = 'item:' .. ARGV[4]
+local item = cjson.decode(ARGV[5])
+local current = redis.call('HGET', KEYS[1], key)
+if current then
+    local quantity = item.quantity
+    item = cjson.decode(current)
+    item.quantity = item.quantity + quantity
+    item.subtotal = item.quantity * item.product_price
+else
+    item.seq = redis.call('HINCRBY', KEYS[1], 'seq', 1)
+end
+redis.call('HSET', KEYS[1], key, cjson.encode(item))
+return touch()
+"""
+
+# ARGV[4] product id, ARGV[5] quantity
+SET_QUANTITY = TOUCH + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local key = 'item:' .. ARGV[4]
+local current = redis.call('HGET', KEYS[1], key)
+if not current then
+    return redis.call('HGETALL', KEYS[1])
+end
+local item = cjson.decode(current)
+item.quantity = tonumber(ARGV[5])
+item.subtotal = item.quantity * item.product_price
+redis.call('HSET', KEYS[1], key, cjson.encode(item))
+return touch()
+"""
+
+# ARGV[4] product id
+REMOVE_ITEM = TOUCH + """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+if redis.call('HEXISTS', KEYS[1], 'meta') == 0 then
+    return redis.call('HGETALL', KEYS[1])
+end
+redis.call('HDEL', KEYS[1], 'item:' .. ARGV[4])
+return touch()
+"""
+
+# ARGV[4] JSON list of {product_id, product_name, product_price, product_image}
+SET_PRICES = """
+for _, price in ipairs(cjson.decode(ARGV[4])) do
+    local key = 'item:' .. price.product_id
+    local current = redis.call('HGET', KEYS[1], key)
+    if current then
+        local item = cjson.decode(current)
+        item.product_name = price.product_name
+        item.product_price = price.product_price
+        item.product_image = price.product_image
+        item.subtotal = item.quantity * item.product_price
+        redis.call('HSET', KEYS[1], key, cjson.encode(item))
+    end
+end
+redis.call('SADD', KEYS[2], ARGV[3])
+"""
+
+CLEAR = TOUCH + """
+redis.call('DEL', KEYS[1])
+touch()
+"""
+
+# ARGV[4..] field, value pairs
+LOAD = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class RedisCartHashes:
+    """Cart hashes in Redis; every mutation is one Lua script, so one atomic round trip"""
+
+    dirty_key = "carts:dirty"
+
+    def __init__(self, url: str, ttl: float, client: Optional[Any] = None):
+        if client is None:
+            # Imported here so that the other cart stores never load the client
+            import redis.asyncio as redis
+
+            client = redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.ttl = int(ttl)
+        self._scripts = {
+            name: self.redis.register_script(source)
+            for name, source in (("add_item", ADD_ITEM), ("set_quantity", SET_QUANTITY),
+                                 ("remove_item", REMOVE_ITEM), ("set_prices", SET_PRICES),
+                                 ("clear", CLEAR), ("load", LOAD))
+        }
+
+    async def _run(self, name: str, session_id: str, now: str, *args: Any) -> Optional[Dict[str, str]]:
+        result = await self._scripts[name](
+            keys=[f"cart:{session_id}", self.dirty_key],
+            args=[now, self.ttl, session_id, *args]
+        )
+        if not isinstance(result, list):
+            return None
+        return dict(zip(result[::2], result[1::2]))
+
+    async def get(self, session_id: str) -> Dict[str, str]:
+        return await self.redis.hgetall(f"cart:{session_id}")
+
+    async def load(self, session_id: str, fields: Dict[str, str]) -> None:
+        pairs = [value for pair in fields.items() for value in pair]
+        await self._run("load", session_id, "", *pairs)
+
+    async def add_item(self, session_id: str, item: Dict[str, Any], meta: str, now: str,
+                       create: bool) -> Optional[Dict[str, str]]:
+        return await self._run("add_item", session_id, now, item["product_id"],
+                               json.dumps(item), meta, "1" if create else "0")
+
+    async def set_quantity(self, session_id: str, product_id: str, quantity: int,
+                           now: str) -> Optional[Dict[str, str]]:
+        return await self._run("set_quantity", session_id, now, product_id, quantity)
+
+    async def remove_item(self, session_id: str, product_id: str, now: str) -> Optional[Dict[str, str]]:
+        return await self._run("remove_item", session_id, now, product_id)
+
+    async def set_prices(self, session_id: str, prices: List[Dict[str, Any]]) -> None:
+        await self._run("set_prices", session_id, "", json.dumps(prices))
+
+    async def clear(self, session_id: str, now: str) -> None:
+        await self._run("clear", session_id, now)
+
+    async def pop_dirty(self, count: int) -> List[str]:
+        return await self.redis.spop(self.dirty_key, count) or []
+
+    async def mark_dirty(self, session_ids: List[str]) -> None:
+        await self.redis.sadd(self.dirty_key, *session_ids)
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+class HashCartStore(CartStore):
+    """
+    Carts in key-value hashes, written through to MongoDB at checkout
+    (``persist``) and every ``flush_interval`` seconds for changed sessions.
+
+    Sessions unknown to the hashes are loaded from MongoDB once, so carts
+    survive restarts and expiry of the hashes.
+    """
+
+    def __init__(self, hashes, db, flush_interval: float = 5, flush_batch: int = 500):
+        self.hashes = hashes
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.flush_interval > 0 and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        await self.hashes.close()
+
+    async def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        cart = await self.db.carts.find_one({"session_id": session_id}, CART_FIELDS)
+        fields = cart_to_hash(cart) if cart else {"updated_at": datetime.utcnow().isoformat()}
+        await self.hashes.load(session_id, fields)
+        return cart
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        fields = await self.hashes.get(session_id)
+        if not fields:
+            return await self._load(session_id)
+        return cart_from_hash(session_id, fields)
+
+    async def add_item(self, session_id: str, item: CartItem) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        meta = json.dumps({"id": Cart().id, "user_id": None, "created_at": now.isoformat()})
+        fields = await self.hashes.add_item(session_id, item.dict(), meta, now.isoformat(), False)
+        if fields is None:
+            await self._load(session_id)
+            fields = await self.hashes.add_item(session_id, item.dict(), meta, now.isoformat(), True)
+        return cart_from_hash(session_id, fields)
+
+    async def _mutate(self, operation: str, session_id: str, *args: Any) -> Optional[Dict[str, str]]:
+        now = datetime.utcnow().isoformat()
+        fields = await getattr(self.hashes, operation)(session_id, *args, now)
+        if fields is None:
+            await self._load(session_id)
+            fields = await getattr(self.hashes, operation)(session_id, *args, now)
+        return fields
+
+    async def set_quantity(self, session_id: str, product_id: str, quantity: int) -> Optional[Dict[str, Any]]:
+        fields = await self._mutate("set_quantity", session_id, product_id, quantity)
+        cart = cart_from_hash(session_id, fields)
+        if cart is not None and ITEM_PREFIX + product_id not in fields:
+            raise ItemNotInCart(product_id)
+        return cart
+
+    async def remove_item(self, session_id: str, product_id: str) -> Optional[Dict[str, Any]]:
+        fields = await self._mutate("remove_item", session_id, product_id)
+        return cart_from_hash(session_id, fields)
+
+    async def save_prices(self, session_id: str, cart: Dict[str, Any]) -> None:
+        prices = [
+            {"product_id": item["product_id"], **{key: item[key] for key in PRICE_KEYS}}
+            for item in cart["items"]
+        ]
+        await self.hashes.set_prices(session_id, prices)
+
+    async def clear(self, session_id: str) -> None:
+        # The tombstone keeps a later flush from writing back a stale cart
+        await self.hashes.clear(session_id, datetime.utcnow().isoformat())
+        await self.db.carts.delete_one({"session_id": session_id})
+
+    def _write(self, session_id: str, fields: Dict[str, str]):
+        cart = cart_from_hash(session_id, fields)
+        if cart is None:
+            return DeleteOne({"session_id": session_id})
+        return ReplaceOne({"session_id": session_id}, cart, upsert=True)
+
+    async def persist(self, session_id: str) -> None:
+        fields = await self.hashes.get(session_id)
+        if fields:
+            await self.db.carts.bulk_write([self._write(session_id, fields)])
+
+    async def flush(self) -> int:
+        """Write every cart changed since the last flush to MongoDB"""
+        written = 0
+        while True:
+            session_ids = await self.hashes.pop_dirty(self.flush_batch)
+            try:
+                operations = []
+                for session_id in session_ids:
+                    fields = await self.hashes.get(session_id)
+                    # Expired hashes keep their last flushed state in MongoDB
+                    if fields:
+                        operations.append(self._write(session_id, fields))
+                if operations:
+                    await self.db.carts.bulk_write(operations, ordered=False)
+            except BaseException:
+                # Back in the set, so the next flush writes these carts
+                if session_ids:
+                    await self.hashes.mark_dirty(session_ids)
+                raise
+            written += len(operations)
+            if len(session_ids) < self.flush_batch:
+                return written
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Cart flush failed")
@@ -0,0 +1,336 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import orjson
+from pydantic import ValidationError
+from pymongo.errors import PyMongoError
+
+from models.category import (
+    CATEGORY_NAMES, SUBCATEGORY_NAMES, CategoryFacet, FacetStats, ProductFacets, SubcategoryFacet
+)
+from models.product import Product
+from services.metrics import record_cache
+from services.pagination import decode_cursor, encode_cursor
+from services.search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# sort_by value -> (sort key, descending)
+SORT_ORDERS = {
+    "name": (lambda p: p.name, False),
+    "price-asc": (lambda p: p.price, False),
+    "price-desc": (lambda p: p.price, True),
+    "rating": (lambda p: p.rating, True),
+}
+
+ViewKey = Tuple[Optional[str], Optional[str], str]
+FacetKey = Tuple[Optional[str], Optional[str]]
+
+
+class CatalogVersion(NamedTuple):
+    # Digest of every (id, updated_at): equal across workers serving the same catalog
+    etag: str
+    last_modified: Optional[datetime]
+
+
+class ProductPage(NamedTuple):
+    items: List[Product]
+    next_cursor: Optional[str]
+    total: int
+
+
+def paginate(
+    items: List[Product],
+    sort_by: str,
+    sort_key: Callable[[Product], Any],
+    descending: bool,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None
+) -> ProductPage:
+    """
+    Keyset page of ``items``, which must be ordered by (sort key, id) with the
+    sort key in ``descending`` order. The cursor holds the last row's key, so
+    locating the page is a binary search.
+    """
+    def position(product: Product):
+        value = sort_key(product)
+        return (-value if descending else value, product.id)
+
+    start = 0
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_by)
+        try:
+            last = (-value if descending else value, last_id)
+            start = bisect.bisect_right(items, last, key=position)
+        except TypeError as e:
+            raise ValueError("Invalid cursor") from e
+
+    end = len(items) if limit is None else start + limit
+    page = items[start:end]
+    next_cursor = None
+    if end < len(items) and page:
+        next_cursor = encode_cursor(sort_by, [sort_key(page[-1]), page[-1].id])
+    return ProductPage(page, next_cursor, len(items))
+
+
+def facet_stats(products: List[Product]) -> FacetStats:
+    """Count, in-stock count and price range of ``products``"""
+    if not products:
+        return FacetStats()
+    prices = [product.price for product in products]
+    return FacetStats(
+        count=len(products),
+        in_stock=sum(product.inStock for product in products),
+        min_price=min(prices),
+        max_price=max(prices)
+    )
+
+
+class CatalogCache:
+    """
+    Read-through in-memory copy of the products collection.
+
+    The whole catalog is loaded in one query and every (category, subcategory,
+    sort_by) combination is precomputed, so a catalog read is a dictionary
+    lookup; so are the facets (counts, price range) of every (category,
+    subcategory). Entries expire after ``ttl`` seconds; writers call
+    ``invalidate()`` and ``watch()`` can follow a Mongo change stream when a
+    replica set is available.
+
+    Expired catalogs are reloaded from ``replica_db`` (a secondary, when
+    reads are routed there); the reload following an invalidation reads
+    ``db`` so that it sees the write behind it.
+    """
+
+    def __init__(self, db, ttl: float = 300, replica_db=None):
+        self.db = db
+        self.replica_db = replica_db if replica_db is not None else db
+        self.ttl = ttl
+        self.products: Dict[str, Product] = {}
+        self._views: Dict[ViewKey, List[Product]] = {}
+        self.search_index = SearchIndex([])
+        self.facets: Dict[FacetKey, FacetStats] = {}
+        self.version = CatalogVersion("", None)
+        self._json: Dict[str, bytes] = {}
+        self._expires_at = 0.0
+        self._generation = 0
+        self._written = False
+        self._lock = asyncio.Lock()
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self._expires_at
+
+    def invalidate(self) -> None:
+        """Drop the cached catalog; the next read reloads it"""
+        self._generation += 1
+        self._written = True
+        self._expires_at = 0.0
+
+    async def ensure_fresh(self) -> None:
+        if self.fresh:
+            record_cache("catalog", hits=1)
+            return
+        async with self._lock:
+            if not self.fresh:
+                record_cache("catalog", misses=1)
+                await self.refresh()
+
+    async def refresh(self) -> None:
+        """Reload the catalog and rebuild every sorted view"""
+        started = time.monotonic()
+        generation = self._generation
+        source = self.db if self._written else self.replica_db
+        documents = await source.products.find({}, {"_id": 0}).to_list(None)
+        # Validation, sorting and indexing are CPU-bound; keep them off the event loop
+        products, views, search_index, facets, version = await asyncio.to_thread(self._build, documents)
+
+        self.products = {product.id: product for product in products}
+        self._views = views
+        self.search_index = search_index
+        self.facets = facets
+        self.version = version
+        self._json = {}
+        # A write that landed while loading leaves the cache stale
+        if generation == self._generation:
+            self._written = False
+            self._expires_at = time.monotonic() + self.ttl
+        logger.info("Catalog cache loaded %d products in %.1f ms",
+                    len(products), (time.monotonic() - started) * 1000)
+
+    @staticmethod
+    def _build(documents: List[dict]) -> Tuple[
+        List[Product], Dict[ViewKey, List[Product]], SearchIndex, Dict[FacetKey, FacetStats], CatalogVersion
+    ]:
+        products = []
+        for document in documents:
+            try:
+                products.append(Product(**document))
+            except ValidationError as e:
+                # One bad document must not take the whole catalog down
+                logger.warning("Skipping product %s in the catalog cache: %s",
+                               document.get("id"), e.errors()[0]["msg"])
+
+        # Sort by id first so that ties keep a stable order
+        by_id = sorted(products, key=lambda p: p.id)
+        digest = hashlib.blake2b(digest_size=16)
+        for product in by_id:
+            digest.update(f"{product.id}\0{product.updated_at.isoformat()}\n".encode())
+        version = CatalogVersion(
+            digest.hexdigest(),
+            max((product.updated_at for product in products), default=None)
+        )
+        views: Dict[ViewKey, List[Product]] = {}
+        for sort_by, (sort_key, descending) in SORT_ORDERS.items():
+            ordered = sorted(by_id, key=sort_key, reverse=descending)
+            for product in ordered:
+                for category, subcategory in (
+                    (None, None),
+                    (product.category, None),
+                    (None, product.subcategory),
+                    (product.category, product.subcategory),
+                ):
+                    views.setdefault((category, subcategory, sort_by), []).append(product)
+
+        facets = {
+            (category, subcategory): facet_stats(view)
+            for (category, subcategory, sort_by), view in views.items() if sort_by == "name"
+        }
+        return products, views, SearchIndex(products), facets, version
+
+    async def get_products(
+        self,
+        category: Optional[str] = None,
+        subcategory: Optional[str] = None,
+        sort_by: str = "name",
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> ProductPage:
+        """Page of products matching the filters, in ``sort_by`` order"""
+        await self.ensure_fresh()
+        if sort_by not in SORT_ORDERS:
+            sort_by = "name"
+        sort_key, descending = SORT_ORDERS[sort_by]
+        view = self._views.get((category, subcategory, sort_by), [])
+        return paginate(view, sort_by, sort_key, descending, cursor, limit)
+
+    async def search(
+        self,
+        query: str,
+        category: Optional[str] = None,
+        subcategory: Optional[str] = None,
+        sort_by: str = "relevance",
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> ProductPage:
+        """Page of full-text matches for ``query``, by relevance or in ``sort_by`` order"""
+        await self.ensure_fresh()
+        scores = dict(self.search_index.search(query))
+        results = self._search_hits(scores, category, subcategory)
+        if sort_by in SORT_ORDERS:
+            sort_key, descending = SORT_ORDERS[sort_by]
+            results.sort(key=lambda p: p.id)
+            results.sort(key=sort_key, reverse=descending)
+        else:
+            # Already ranked by (score desc, id)
+            sort_by, sort_key, descending = "relevance", lambda p: scores[p.id], True
+        return paginate(results, sort_by, sort_key, descending, cursor, limit)
+
+    def _search_hits(self, scores: Dict[str, float], category: Optional[str],
+                     subcategory: Optional[str]) -> List[Product]:
+        return [
+            product for product in map(self.products.__getitem__, scores)
+            if (category is None or product.category == category)
+            and (subcategory is None or product.subcategory == subcategory)
+        ]
+
+    async def get_facets(
+        self,
+        category: Optional[str] = None,
+        subcategory: Optional[str] = None,
+        search: Optional[str] = None
+    ) -> ProductFacets:
+        """Facets of the products a /api/products query with these filters returns
+
+        Precomputed for category filters; computed from the hits when searching.
+        """
+        await self.ensure_fresh()
+        if search:
+            hits = self._search_hits(dict(self.search_index.search(search)), category, subcategory)
+            by_subcategory: Dict[str, List[Product]] = {}
+            for product in hits:
+                by_subcategory.setdefault(product.subcategory, []).append(product)
+            total = facet_stats(hits)
+            children = {key: facet_stats(products) for key, products in by_subcategory.items()}
+        else:
+            total = self.facets.get((category, subcategory), FacetStats())
+            children = {
+                key[1]: stats for key, stats in self.facets.items()
+                if key[0] == category and key[1] is not None and subcategory in (None, key[1])
+            }
+        names = SUBCATEGORY_NAMES.get(category, {}) if category else {
+            sub: name for subs in SUBCATEGORY_NAMES.values() for sub, name in subs.items()
+        }
+        return ProductFacets(**total.dict(), subcategories=[
+            SubcategoryFacet(id=key, name=names.get(key, key.capitalize()), **stats.dict())
+            for key, stats in sorted(children.items())
+        ])
+
+    async def get_categories(self) -> List[CategoryFacet]:
+        """Category tree with facets; known categories are listed even when empty"""
+        await self.ensure_fresh()
+        subcategories: Dict[str, Dict[str, str]] = {
+            category: dict(names) for category, names in SUBCATEGORY_NAMES.items()
+        }
+        for category, subcategory in self.facets:
+            if category is not None and subcategory is not None:
+                subcategories.setdefault(category, {}).setdefault(subcategory, subcategory.capitalize())
+        return [
+            CategoryFacet(
+                id=category,
+                name=CATEGORY_NAMES.get(category, category.capitalize()),
+                **self.facets.get((category, None), FacetStats()).dict(),
+                subcategories=[
+                    SubcategoryFacet(id=subcategory, name=name,
+                                     **self.facets.get((category, subcategory), FacetStats()).dict())
+                    for subcategory, name in names.items()
+                ]
+            )
+            for category, names in subcategories.items()
+        ]
+
+    async def get_product(self, product_id: str) -> Optional[Product]:
+        """Product by id, falling back to the database on a cache miss"""
+        await self.ensure_fresh()
+        product = self.products.get(product_id)
+        if product is None:
+            document = await self.db.products.find_one({"id": product_id}, {"_id": 0})
+            if document:
+                product = Product(**document)
+        return product
+
+    def product_json(self, product: Product) -> bytes:
+        """JSON encoding of a cached product, computed once per catalog load"""
+        encoded = self._json.get(product.id)
+        if encoded is None:
+            encoded = self._json[product.id] = orjson.dumps(product.dict())
+        return encoded
+
+    def products_json(self, products: List[Product]) -> bytes:
+        """JSON array of cached products, joined from their stored encodings"""
+        return b"[" + b",".join(map(self.product_json, products)) + b"]"
+
+    async def watch(self) -> None:
+        """Invalidate on every products change (needs a replica set)"""
+        try:
+            async with self.db.products.watch() as stream:
+                logger.info("Catalog cache following the products change stream")
+                async for _ in stream:
+                    self.invalidate()
+        except PyMongoError as e:
+            logger.warning("Catalog change stream unavailable, relying on TTL: %s", e)
@@ -0,0 +1,269 @@
+"""
+Chunked catalog import and export with pandas.
+
+Catalog files (CSV, JSON lines or Parquet) are read ``chunk_size`` rows at a
+time. The constraints of models.product.ProductImport are checked with
+column-wise operations instead of one model per row, and each chunk is upserted
+with a single unordered bulk_write. The next chunk is parsed in a worker thread while
+the current one is written, so memory stays bounded by two chunks.
+"""
+import asyncio
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+from models.product import Product
+from services.catalog_loader import product_id_for, product_upserts
+
+# Columns a catalog file may carry; timestamps are managed by the import, stock
+# levels (and inStock of tracked products) by /api/products/{id}/stock
+PRODUCT_COLUMNS = [field for field in Product.model_fields if field not in ("created_at", "updated_at", "stock")]
+REQUIRED_TEXT = ["name", "category", "subcategory", "image", "description"]
+DEFAULTS = {field: Product.model_fields[field].default for field in ("inStock", "rating", "reviews")}
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet", ".pq": "parquet"}
+MAX_REPORTED_ERRORS = 20
+
+TRUE_VALUES = {"true", "1", "yes", "oui"}
+FALSE_VALUES = {"false", "0", "no", "non"}
+
+
+def catalog_format(filename: str) -> str:
+    fmt = FORMATS.get(Path(filename).suffix.lower())
+    if fmt is None:
+        raise ValueError(f"Unsupported catalog format: {Path(filename).suffix or filename}")
+    return fmt
+
+
+def read_frames(source: Any, fmt: str, chunk_size: int = 50000) -> Iterator[pd.DataFrame]:
+    """DataFrames of at most ``chunk_size`` rows from a path or binary file object"""
+    if fmt == "csv":
+        # Everything as text: numbers are parsed and checked by validate_frame
+        with pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False) as reader:
+            yield from reader
+    elif fmt == "jsonl":
+        with pd.read_json(source, lines=True, chunksize=chunk_size, dtype=False) as reader:
+            yield from reader
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported catalog format: {fmt}")
+
+
+def _blank(column: pd.Series) -> pd.Series:
+    return column.isna() | (column.astype("string").str.strip() == "")
+
+
+def _number(frame: pd.DataFrame, column: str, default: Any = None) -> Tuple[pd.Series, pd.Series]:
+    """Column as floats, with blanks set to ``default``, and the mask of unparseable cells"""
+    if column not in frame:
+        return pd.Series(np.nan if default is None else default, index=frame.index, dtype="float64"), \
+            pd.Series(default is None, index=frame.index)
+    raw = frame[column]
+    blank = _blank(raw)
+    values = pd.to_numeric(raw.where(~blank), errors="coerce").astype("float64")
+    if default is not None:
+        values = values.where(~blank, default)
+    return values, values.isna() | ~np.isfinite(values)
+
+
+def _flag(frame: pd.DataFrame, column: str, default: bool) -> Tuple[pd.Series, pd.Series]:
+    if column not in frame:
+        return pd.Series(default, index=frame.index), pd.Series(False, index=frame.index)
+    raw = frame[column]
+    if raw.dtype == bool:
+        return raw, pd.Series(False, index=frame.index)
+    text = raw.astype("string").str.strip().str.lower().fillna("")
+    values = text.isin(TRUE_VALUES) | ((text == "") & default)
+    return values, ~(text.isin(TRUE_VALUES) | text.isin(FALSE_VALUES) | (text == ""))
+
+
+def validate_frame(frame: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+    """Valid products of a chunk, normalized to PRODUCT_COLUMNS, and the
+    rejection reason of every other row (indexed like ``frame``)"""
+    price, bad_price = _number(frame, "price")
+    rating, bad_rating = _number(frame, "rating", DEFAULTS["rating"])
+    reviews, bad_reviews = _number(frame, "reviews", DEFAULTS["reviews"])
+    in_stock, bad_stock = _flag(frame, "inStock", DEFAULTS["inStock"])
+
+    checks = [
+        (_blank(frame[column]) if column in frame else pd.Series(True, index=frame.index), f"missing {column}")
+        for column in REQUIRED_TEXT
+    ]
+    checks += [
+        (bad_price | (price < 0), "price must be a non-negative number"),
+        (bad_rating | (rating < 0) | (rating > 5), "rating must be between 0 and 5"),
+        (bad_reviews | (reviews < 0) | (reviews % 1 != 0), "reviews must be a non-negative integer"),
+        (bad_stock, "inStock must be a boolean"),
+    ]
+    reasons = pd.Series(
+        np.select([mask.to_numpy(dtype=bool) for mask, _ in checks], [reason for _, reason in checks], ""),
+        index=frame.index
+    )
+    ok = (reasons == "").to_numpy()
+
+    valid = pd.DataFrame({
+        column: frame.loc[ok, column].astype(str).str.strip() for column in REQUIRED_TEXT
+    })
+    valid["price"] = price[ok]
+    valid["rating"] = rating[ok]
+    valid["reviews"] = reviews[ok].astype("int64")
+    valid["inStock"] = in_stock[ok].astype(bool)
+
+    ids = frame.loc[ok, "id"] if "id" in frame else pd.Series(None, index=valid.index, dtype=object)
+    missing = _blank(ids)
+    if missing.any():
+        ids = ids.astype(object).copy()
+        ids[missing] = [product_id_for(row) for row in valid.loc[missing, REQUIRED_TEXT].to_dict("records")]
+    valid["id"] = ids.astype(str)
+    # A file may list the same product twice; the last row wins, as with ordered upserts
+    valid = valid.drop_duplicates("id", keep="last")
+    return valid[PRODUCT_COLUMNS], reasons[~ok]
+
+
+def upsert_operations(valid: pd.DataFrame, now: datetime) -> List[UpdateOne]:
+    # Zipping native column lists is several times faster than to_dict("records")
+    values = [valid[column].tolist() for column in PRODUCT_COLUMNS]
+    return [
+        operation
+        for row in zip(*values)
+        for operation in product_upserts(dict(zip(PRODUCT_COLUMNS, row)), now)
+    ]
+
+
+async def import_catalog(db, frames: Iterator[pd.DataFrame]) -> Dict[str, Any]:
+    """Validate and upsert catalog chunks on ``id``
+
+    Returns the same report as catalog_loader.bulk_upsert_products, plus the
+    first rejected rows (1-based data row numbers) and their reason.
+    """
+    started = time.perf_counter()
+    report: Dict[str, Any] = {"products": 0, "inserted": 0, "updated": 0, "rejected": 0, "batches": 0}
+    errors: List[Dict[str, Any]] = []
+    frames = iter(frames)
+    offset = 0
+
+    def prepare() -> Optional[Tuple[List[UpdateOne], int, pd.Series, pd.DataFrame, int]]:
+        nonlocal offset
+        frame = next(frames, None)
+        if frame is None:
+            return None
+        first_row = offset + 1
+        offset += len(frame)
+        frame = frame.reset_index(drop=True)
+        valid, rejected = validate_frame(frame)
+        return upsert_operations(valid, datetime.utcnow()), len(valid), rejected, frame, first_row
+
+    prepared = await asyncio.to_thread(prepare)
+    while prepared is not None:
+        operations, products, rejected, frame, first_row = prepared
+        for position, reason in rejected.head(MAX_REPORTED_ERRORS - len(errors)).items():
+            errors.append({"row": first_row + position,
+                           "name": frame.at[position, "name"] if "name" in frame else None,
+                           "reason": reason})
+        report["rejected"] += len(rejected)
+        report["batches"] += 1
+
+        # Parse the next chunk while this one is written
+        upcoming = asyncio.ensure_future(asyncio.to_thread(prepare))
+        try:
+            if operations:
+                result = await db.products.bulk_write(operations, ordered=False)
+                report["inserted"] += result.upserted_count
+                report["updated"] += result.modified_count
+                report["products"] += products
+        finally:
+            prepared = await upcoming
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["per_second"] = round(report["products"] / elapsed, 1) if elapsed else 0.0
+    report["errors"] = errors
+    return report
+
+
+class _StreamSink:
+    """Write-only file object handing out what was written since the last drain"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class FrameWriter:
+    """Encodes successive DataFrames of one export into bytes"""
+
+    def __init__(self, fmt: str):
+        if fmt not in FORMATS.values():
+            raise ValueError(f"Unsupported catalog format: {fmt}")
+        self.fmt = fmt
+        self._started = False
+        self._sink = _StreamSink()
+        self._parquet = None
+
+    def write(self, frame: pd.DataFrame) -> bytes:
+        first, self._started = not self._started, True
+        if self.fmt == "csv":
+            return frame.to_csv(index=False, header=first).encode()
+        if self.fmt == "jsonl":
+            return frame.to_json(orient="records", lines=True, force_ascii=False).encode() if len(frame) else b""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self._sink, table.schema)
+        self._parquet.write_table(table)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        if self._parquet is not None:
+            self._parquet.close()
+        return self._sink.drain()
+
+
+async def export_catalog(db, fmt: str, chunk_size: int = 50000) -> AsyncIterator[bytes]:
+    """Stream the catalog as ``fmt``, ``chunk_size`` products at a time"""
+    writer = FrameWriter(fmt)
+    projection = {"_id": 0, **{column: 1 for column in PRODUCT_COLUMNS}}
+    cursor = db.products.find({}, projection).sort("id", 1).batch_size(chunk_size)
+    batch: List[Dict[str, Any]] = []
+    written = False
+    async for product in cursor:
+        batch.append(product)
+        if len(batch) == chunk_size:
+            yield await asyncio.to_thread(writer.write, pd.DataFrame(batch, columns=PRODUCT_COLUMNS))
+            batch, written = [], True
+    # An empty catalog still gets a CSV header or Parquet schema
+    if batch or not written:
+        yield await asyncio.to_thread(writer.write, pd.DataFrame(batch, columns=PRODUCT_COLUMNS))
+    yield writer.close()
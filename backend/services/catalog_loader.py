@@ -0,0 +1,142 @@
+import csv
+import itertools
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+
+from models.product import ProductImport
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_PRODUCTS_FILE = Path(__file__).parent.parent / "data" / "sample_products.json"
+
+
+def read_products(path: Path) -> Iterator[Dict[str, Any]]:
+    """
+    Stream product rows from a .json (array), .jsonl/.ndjson or .csv file
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".json":
+        with open(path, encoding="utf-8") as f:
+            yield from json.load(f)
+    elif suffix in (".jsonl", ".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif suffix == ".csv":
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                # Empty cells fall back to the model defaults
+                yield {key: value for key, value in row.items() if value not in ("", None)}
+    else:
+        raise ValueError(f"Unsupported catalog format: {path.suffix}")
+
+
+def product_id_for(row: Dict[str, Any]) -> str:
+    """Stable id for rows that do not carry one, so reloads stay idempotent"""
+    key = f"darling-boutique/{row.get('name', '')}"
+    if row.get("category") or row.get("subcategory"):
+        key = f"{key}/{row.get('category', '')}/{row.get('subcategory', '')}"
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, key))
+
+
+# Left to services/inventory.py on existing products; it also owns inStock once
+# a product's stock is tracked
+INVENTORY_FIELDS = ("stock", "stock_shards", "inStock")
+
+
+def product_upserts(document: Dict[str, Any], now: datetime) -> List[UpdateOne]:
+    """Writes upserting one product document on ``id``
+
+    A new product is inserted whole. An existing one gets the catalog fields,
+    and inStock only while its stock is untracked; it is only written, and
+    updated_at moved, when one of them differs. The writes exclude each other,
+    so they may run in any order and at most one modifies a given product.
+    """
+    product_id = document["id"]
+    catalog = {key: value for key, value in document.items()
+               if key not in INVENTORY_FIELDS and key not in ("created_at", "updated_at")}
+    on_insert = {**catalog, "created_at": document.get("created_at", now), "updated_at": now}
+    on_insert.update((field, document[field]) for field in INVENTORY_FIELDS if field in document)
+    # Matches the product as the file has it; image_variants is computed from
+    # image on every read, never stored
+    same = {**catalog, "image_variants": {"$exists": False}}
+    update = {"$set": {**catalog, "updated_at": now}, "$unset": {"image_variants": ""}}
+
+    operations = [UpdateOne({"id": product_id}, {"$setOnInsert": on_insert}, upsert=True)]
+    if "inStock" in document:
+        in_stock = document["inStock"]
+        operations += [
+            UpdateOne({"id": product_id, "stock": None, "$nor": [{**same, "inStock": in_stock}]},
+                      {"$set": {**update["$set"], "inStock": in_stock}, "$unset": update["$unset"]}),
+            UpdateOne({"id": product_id, "stock": {"$ne": None}, "$nor": [same]}, update),
+        ]
+    else:
+        operations.append(UpdateOne({"id": product_id, "$nor": [same]}, update))
+    return operations
+
+
+async def bulk_upsert_products(
+    db,
+    rows: Iterable[Dict[str, Any]],
+    batch_size: int = 1000
+) -> Dict[str, Any]:
+    """
+    Validate rows into products and upsert them on ``id`` in bounded batches
+
+    Returns a report with counts and throughput; invalid rows are skipped.
+    """
+    started = time.perf_counter()
+    report = {"products": 0, "inserted": 0, "updated": 0, "rejected": 0, "batches": 0}
+    rows = iter(rows)
+    row_number = 0
+
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+
+        operations: List[UpdateOne] = []
+        products = 0
+        now = datetime.utcnow()
+        for row in batch:
+            row_number += 1
+            if not row.get("id"):
+                row = {**row, "id": product_id_for(row)}
+            try:
+                product = ProductImport(**row)
+                operations.extend(product_upserts(product.dict(exclude={"image_variants"}), now))
+                products += 1
+            except ValidationError as e:
+                report["rejected"] += 1
+                logger.warning("Skipping product row %d: %s", row_number, e.errors()[0]["msg"])
+
+        if operations:
+            result = await db.products.bulk_write(operations, ordered=True)
+            report["inserted"] += result.upserted_count
+            report["updated"] += result.modified_count
+            report["products"] += products
+        report["batches"] += 1
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["per_second"] = round(report["products"] / elapsed, 1) if elapsed else 0.0
+    return report
+
+
+async def seed_sample_products(db) -> bool:
+    """Load the sample catalog into an empty products collection"""
+    if await db.products.estimated_document_count() > 0:
+        return False
+    report = await bulk_upsert_products(db, read_products(SAMPLE_PRODUCTS_FILE))
+    logger.info("Sample products initialized: %s", report)
+    return True
@@ -0,0 +1,134 @@
+"""
+Negotiated brotli/gzip compression of API responses.
+
+Catalog pages and carts repeat long image URLs and product names, which
+compress very well. CompressionMiddleware encodes single-body responses of a
+textual media type once they reach ``minimum_size`` bytes, picking brotli
+over gzip when the client accepts both. Streamed responses (the catalog
+export) pass through untouched.
+
+brotli is optional: without the package only gzip is offered.
+"""
+import gzip
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def accepted_encodings(header: str) -> List[Tuple[str, float]]:
+    """(coding, q) pairs of an Accept-Encoding header"""
+    encodings = []
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            encodings.append((coding.strip().lower(), q))
+    return encodings
+
+
+def negotiate(header: str, available: Tuple[str, ...]) -> Optional[str]:
+    """Preferred coding of ``available`` (in server preference order) the client accepts"""
+    weights = dict(accepted_encodings(header))
+    wildcard = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for coding in available:
+        q = weights.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing textual responses of at least ``minimum_size`` bytes"""
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.available = ("br", "gzip") if brotli is not None else ("gzip",)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value.decode("latin-1") for name, value in scope["headers"]
+                       if name == b"accept-encoding"), "")
+        coding = negotiate(accept, self.available) if accept else None
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                if message["status"] == 304:
+                    # Validates the representation the client holds, which was likely encoded
+                    message = {**message, "headers": weakened(message.get("headers", []))}
+                    await send(message)
+                else:
+                    start = message
+                return
+            if start is None:
+                await send(message)
+                return
+
+            response_start, start = start, None
+            headers = response_start.get("headers", [])
+            body = message.get("body", b"")
+            if (message.get("more_body") or len(body) < self.minimum_size
+                    or not self.compressible(headers)):
+                await send(response_start)
+                await send(message)
+                return
+
+            encoded = self.encode(body, coding)
+            headers = [(name, value) for name, value in weakened(headers)
+                       if name not in (b"content-length", b"vary")]
+            vary = [value for name, value in response_start.get("headers", []) if name == b"vary"]
+            if not any(b"accept-encoding" in value.lower() for value in vary):
+                vary.append(b"Accept-Encoding")
+            headers += [(b"vary", value) for value in vary]
+            headers += [(b"content-encoding", coding.encode()), (b"content-length", str(len(encoded)).encode())]
+            await send({**response_start, "headers": headers})
+            await send({**message, "body": encoded})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def compressible(headers) -> bool:
+        content_type = b""
+        for name, value in headers:
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value
+        return content_type.decode("latin-1").startswith(COMPRESSIBLE_TYPES)
+
+    def encode(self, body: bytes, coding: str) -> bytes:
+        if coding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+
+def weakened(headers):
+    """Headers with a strong ETag made weak: an encoded body is not byte-identical
+    to the identity representation the ETag was computed for"""
+    return [
+        (name, b"W/" + value if name == b"etag" and value.startswith(b'"') else value)
+        for name, value in headers
+    ]
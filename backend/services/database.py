@@ -0,0 +1,77 @@
+"""
+MongoDB client construction and read routing.
+
+Pool sizing and timeouts come from the environment; unset values keep the
+driver defaults:
+
+    MONGO_MAX_POOL_SIZE                  connections per server (100)
+    MONGO_MIN_POOL_SIZE                  connections kept open (0)
+    MONGO_MAX_CONNECTING                 connections being opened at once (2)
+    MONGO_WAIT_QUEUE_TIMEOUT_MS          fail an operation that waited this long for a connection
+    MONGO_SERVER_SELECTION_TIMEOUT_MS    (30000)
+    MONGO_CONNECT_TIMEOUT_MS             (20000)
+    MONGO_SOCKET_TIMEOUT_MS
+    MONGO_MAX_IDLE_TIME_MS
+
+Carts, orders, stock and checkout pricing read from the primary. Catalog and
+analytics reads, which tolerate slightly old data, go through replica_reads()
+and follow MONGO_REPLICA_READ_PREFERENCE (secondaryPreferred), never from a
+secondary more than MONGO_MAX_STALENESS_SECONDS (90, the smallest value
+MongoDB accepts; -1 for no bound) behind. Without a replica set every read
+goes to the one server.
+"""
+import os
+from typing import Any, Dict, Iterable
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+from services.metrics import MongoCommandMetrics, MongoPoolMetrics
+
+# Environment variable -> MongoClient option, all integers
+POOL_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_CONNECTING": "maxConnecting",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+}
+DEFAULT_MAX_POOL_SIZE = 100
+
+READ_PREFERENCES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def client_options_from_env() -> Dict[str, Any]:
+    return {option: int(os.environ[name]) for name, option in POOL_OPTIONS.items() if os.environ.get(name)}
+
+
+def replica_read_preference_from_env():
+    mode = os.environ.get("MONGO_REPLICA_READ_PREFERENCE", "secondaryPreferred")
+    if mode == "primary":
+        return Primary()
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown MONGO_REPLICA_READ_PREFERENCE: {mode}")
+    max_staleness = int(os.environ.get("MONGO_MAX_STALENESS_SECONDS", "90"))
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+def connect(url: str, event_listeners: Iterable[Any] = ()) -> AsyncIOMotorClient:
+    """Client with the configured pool whose commands and pool are timed into /metrics"""
+    options = client_options_from_env()
+    pool_metrics = MongoPoolMetrics(options.get("maxPoolSize", DEFAULT_MAX_POOL_SIZE))
+    return AsyncIOMotorClient(
+        url, event_listeners=[MongoCommandMetrics(), pool_metrics, *event_listeners], **options
+    )
+
+
+def replica_reads(db):
+    """``db`` reading with the replica read preference"""
+    return db.client.get_database(db.name, read_preference=replica_read_preference_from_env())
@@ -0,0 +1,26 @@
+"""
+Sparse fieldsets: ``?fields=id,name,price`` trims each returned document to
+the listed fields of its model.
+"""
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[List[str]]:
+    """Field names of a ``fields`` query parameter, or None to return whole documents
+
+    Raises ValueError on a name ``model`` does not define.
+    """
+    if fields is None:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names
+               if name not in model.model_fields and name not in model.model_computed_fields]
+    if unknown or not names:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}" if unknown else "fields is empty")
+    return names
+
+
+def project(document: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    return {name: document[name] for name in fields if name in document}
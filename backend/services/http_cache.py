@@ -0,0 +1,108 @@
+"""
+Conditional GET for the catalog routes.
+
+Every catalog response is rendered from services.catalog_cache, so the cache's
+catalog version is a strong validator for all of them. CatalogHttpCache tags
+those responses with ``ETag``/``Last-Modified`` and a ``Cache-Control`` that
+lets a CDN or reverse proxy serve them (and keep serving them while it
+revalidates). A request whose ``If-None-Match`` (or, without one,
+``If-Modified-Since``) matches the current version is answered 304 before the
+route runs.
+"""
+import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, List, Optional, Tuple
+
+from services.catalog_cache import CatalogCache, CatalogVersion
+from services.metrics import record_cache
+
+# /api/products, /api/products/facets, /api/products/{id} and /api/categories;
+# the export streams straight from MongoDB, not from the cache
+CATALOG_PATHS = re.compile(r"^/api/(?:products(?:/(?!export$)[^/]+)?|categories)/?$")
+
+
+def etag_for(version: CatalogVersion) -> str:
+    return f'"{version.etag}"'
+
+
+def http_date(moment: datetime) -> str:
+    # Stored timestamps are naive UTC
+    return format_datetime(moment.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison, as RFC 9110 prescribes for If-None-Match"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
+
+
+def not_modified_since(if_modified_since: str, last_modified: Optional[datetime]) -> bool:
+    if last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+
+class CatalogHttpCache:
+    """ASGI middleware adding validators and answering conditional catalog GETs
+
+    ``get_catalog`` returns the current CatalogCache (it is created on
+    startup, after the middleware stack is built) or None to pass through.
+    """
+
+    def __init__(self, app, get_catalog: Callable[[], Optional[CatalogCache]],
+                 max_age: int = 60, stale_while_revalidate: int = 300):
+        self.app = app
+        self.get_catalog = get_catalog
+        self.cache_control = f"public, max-age={max_age}, stale-while-revalidate={stale_while_revalidate}"
+
+    async def __call__(self, scope, receive, send):
+        catalog = self.get_catalog()
+        if (scope["type"] != "http" or scope["method"] not in ("GET", "HEAD")
+                or catalog is None or not CATALOG_PATHS.match(scope["path"])):
+            await self.app(scope, receive, send)
+            return
+
+        # Only reloads when the catalog has expired, which the route would do anyway
+        await catalog.ensure_fresh()
+        version = catalog.version
+        headers = {name.decode(): value.decode("latin-1") for name, value in scope["headers"]
+                   if name in (b"if-none-match", b"if-modified-since")}
+        if "if-none-match" in headers:
+            not_modified = etag_matches(headers["if-none-match"], etag_for(version))
+        else:
+            not_modified = "if-modified-since" in headers and not_modified_since(
+                headers["if-modified-since"], version.last_modified)
+        if headers:
+            # Conditional requests only: a hit is a 304 instead of a full body
+            record_cache("http_conditional", hits=int(not_modified), misses=int(not not_modified))
+        if not_modified:
+            await send({"type": "http.response.start", "status": 304, "headers": self.validators(version)})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_validators(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                # The version the body was rendered from, should a reload have finished meanwhile
+                validators = self.validators(catalog.version)
+                message = {**message, "headers": [*message.get("headers", []), *validators]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
+
+    def validators(self, version: CatalogVersion) -> List[Tuple[bytes, bytes]]:
+        headers = [
+            (b"etag", etag_for(version).encode()),
+            (b"cache-control", self.cache_control.encode()),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if version.last_modified is not None:
+            headers.append((b"last-modified", http_date(version.last_modified).encode()))
+        return headers
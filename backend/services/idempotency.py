@@ -0,0 +1,176 @@
+"""
+Idempotency keys for retried requests.
+
+A client sends the same ``Idempotency-Key`` header on every retry of one
+logical request. The first attempt claims the key by inserting
+``{_id: "<scope>:<key>"}`` into the ``idempotency_keys`` collection, whose
+unique ``_id`` makes the claim atomic across workers; it then stores its
+response there. Retries get the stored response back without redoing the
+work, and retries arriving while the first attempt runs wait for it.
+
+A claim holds a lease, renewed while the request runs: if its worker dies
+mid-request, a retry takes the key over once the lease expires. Keys are removed by a TTL index
+(services/indexes.py) after IDEMPOTENCY_TTL_SECONDS.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+IN_PROGRESS = "in_progress"
+DONE = "done"
+
+
+class IdempotencyKeyReused(ValueError):
+    """The key was first used with a different request body"""
+
+
+class IdempotencyTimeout(Exception):
+    """The first attempt with this key is still running"""
+
+
+class StoredResponse(NamedTuple):
+    status_code: int
+    body: bytes
+    media_type: str
+
+
+def fingerprint(payload: Any) -> str:
+    """Digest of a JSON-able request body, independent of key order"""
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Runs a request at most once per key and replays its response.
+
+    Responses with a 5xx status are not stored: the key is released so that a
+    retry runs the request again.
+    """
+
+    def __init__(self, db, lease: float = 60, wait_timeout: float = 30, poll_interval: float = 0.05):
+        self.db = db
+        self.lease = lease
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        # Attempts running in this process, so local duplicates wait without polling
+        self._running: Dict[str, asyncio.Future] = {}
+
+    async def run(
+        self,
+        scope: str,
+        key: str,
+        request_fingerprint: str,
+        work: Callable[[], Awaitable[StoredResponse]]
+    ) -> Tuple[StoredResponse, bool]:
+        """The response of ``work`` for this key, and whether it is a replay
+
+        Raises IdempotencyKeyReused if the key came with another request body
+        and IdempotencyTimeout if the first attempt outlasts ``wait_timeout``.
+        """
+        key_id = f"{scope}:{key}"
+        deadline = time.monotonic() + self.wait_timeout
+        delay = self.poll_interval
+        while True:
+            owner = await self._claim(key_id, request_fingerprint)
+            if owner is not None:
+                return await self._execute(key_id, owner, work), False
+
+            existing = await self.db.idempotency_keys.find_one({"_id": key_id})
+            if existing is None:
+                # Released or expired meanwhile: claim it again
+                continue
+            if existing["fingerprint"] != request_fingerprint:
+                raise IdempotencyKeyReused(f"Idempotency-Key {key} was used for a different request")
+            if existing["state"] == DONE:
+                response = existing["response"]
+                return StoredResponse(response["status_code"], response["body"], response["media_type"]), True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IdempotencyTimeout(f"Request with Idempotency-Key {key} is still in progress")
+            running = self._running.get(key_id)
+            if running is not None:
+                await asyncio.wait([running], timeout=remaining)
+            else:
+                # Running in another worker
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, 1.0)
+
+    async def _claim(self, key_id: str, request_fingerprint: str) -> Optional[str]:
+        """Owner token if this attempt now holds the key"""
+        owner = uuid.uuid4().hex
+        now = datetime.utcnow()
+        lease = {"state": IN_PROGRESS, "owner": owner, "locked_until": now + timedelta(seconds=self.lease)}
+        try:
+            await self.db.idempotency_keys.insert_one({
+                "_id": key_id, "fingerprint": request_fingerprint, "created_at": now, **lease
+            })
+            return owner
+        except DuplicateKeyError:
+            pass
+        # Take over a claim whose lease ran out: its worker died mid-request
+        result = await self.db.idempotency_keys.update_one(
+            {"_id": key_id, "state": IN_PROGRESS, "fingerprint": request_fingerprint,
+             "locked_until": {"$lt": now}},
+            {"$set": lease}
+        )
+        if result.modified_count:
+            logger.warning("Took over expired idempotency claim %s", key_id)
+            return owner
+        return None
+
+    async def _execute(self, key_id: str, owner: str,
+                       work: Callable[[], Awaitable[StoredResponse]]) -> StoredResponse:
+        finished = self._running[key_id] = asyncio.get_running_loop().create_future()
+        renewal = asyncio.create_task(self._keep_lease(key_id, owner))
+        try:
+            try:
+                response = await work()
+            except BaseException:
+                renewal.cancel()
+                await self._release(key_id, owner)
+                raise
+            renewal.cancel()
+            if response.status_code >= 500:
+                await self._release(key_id, owner)
+            else:
+                await self.db.idempotency_keys.update_one({"_id": key_id, "owner": owner}, {"$set": {
+                    "state": DONE,
+                    "response": response._asdict(),
+                    "completed_at": datetime.utcnow(),
+                }})
+            return response
+        finally:
+            # Wake local duplicates once the outcome is stored
+            self._running.pop(key_id, None)
+            finished.set_result(None)
+
+    async def _keep_lease(self, key_id: str, owner: str) -> None:
+        """Extend the lease every third of it until cancelled, so slow requests are not taken over"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                result = await self.db.idempotency_keys.update_one(
+                    {"_id": key_id, "owner": owner, "state": IN_PROGRESS},
+                    {"$set": {"locked_until": datetime.utcnow() + timedelta(seconds=self.lease)}}
+                )
+            except PyMongoError as e:
+                # The lease may still be valid; try again on the next beat
+                logger.warning("Could not renew idempotency claim %s: %s", key_id, e)
+                continue
+            if not result.matched_count:
+                logger.warning("Lost idempotency claim %s", key_id)
+                return
+
+    async def _release(self, key_id: str, owner: str) -> None:
+        await self.db.idempotency_keys.delete_one({"_id": key_id, "owner": owner})
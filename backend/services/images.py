@@ -0,0 +1,175 @@
+"""
+Resized copies of product images, kept in a content-addressed disk cache.
+
+The first request for an image fetches its source once (an http(s) URL, or
+a path under the local source directory), stores it under the SHA-256 of its
+bytes and renders every variant in WebP and JPEG in a process pool:
+
+    <cache_dir>/urls/<sha256 of url>            digest of the source it points to
+    <cache_dir>/sources/<digest[:2]>/<digest>   source bytes
+    <cache_dir>/variants/<digest[:2]>/<digest>-<variant>.<webp|jpg>
+
+Sources sharing the same bytes share their variants. Files are written under
+a temporary name and renamed, so a file in the cache is always complete and
+several workers may fill it at once.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+import httpx
+
+from models.product import IMAGE_VARIANTS
+from services.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+# format -> (file extension, media type, Pillow format)
+IMAGE_FORMATS = {
+    "webp": ("webp", "image/webp", "WEBP"),
+    "jpeg": ("jpg", "image/jpeg", "JPEG"),
+}
+
+
+class ImageSourceError(Exception):
+    """The source image could not be fetched or decoded"""
+
+
+def _write_atomic(path: Path, write) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def render_variants(source: str, variant_paths: Dict[str, Dict[str, str]], quality: int) -> None:
+    """Write every variant of ``source``; runs in a worker process"""
+    from PIL import Image, ImageOps
+
+    sizes = sorted(IMAGE_VARIANTS.items(), key=lambda item: item[1], reverse=True)
+    with Image.open(source) as image:
+        # JPEG sources decode straight at a reduced scale, still larger than the biggest variant
+        image.draft("RGB", (sizes[0][1], sizes[0][1]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        # Largest first: each variant is resampled from the previous one
+        for variant, size in sizes:
+            image = image.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+            for fmt, path in variant_paths[variant].items():
+                options = {"progressive": True, "optimize": True} if fmt == "jpeg" else {}
+                _write_atomic(Path(path), lambda f: image.save(
+                    f, IMAGE_FORMATS[fmt][2], quality=quality, **options))
+
+
+class ImageStore:
+    def __init__(
+        self,
+        cache_dir: Path,
+        source_dir: Optional[Path] = None,
+        workers: int = 2,
+        quality: int = 80,
+        fetch_timeout: float = 10.0,
+        max_source_bytes: int = 20 * 1024 * 1024,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.source_dir = Path(source_dir).resolve() if source_dir else None
+        self.quality = quality
+        self.max_source_bytes = max_source_bytes
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(fetch_timeout), follow_redirects=True,
+                                        transport=transport)
+        # Sources being ingested in this process, so concurrent requests fetch once
+        self._running: Dict[str, asyncio.Future] = {}
+
+    async def close(self) -> None:
+        await self.client.aclose()
+        self.pool.shutdown(cancel_futures=True)
+
+    def variant_path(self, digest: str, variant: str, fmt: str) -> Path:
+        return self.cache_dir / "variants" / digest[:2] / f"{digest}-{variant}.{IMAGE_FORMATS[fmt][0]}"
+
+    async def variant(self, url: str, variant: str, fmt: str) -> Path:
+        """Path of a variant of the image at ``url``, rendering it on first use
+
+        Raises ImageSourceError if the source cannot be fetched or decoded.
+        """
+        url_key = hashlib.sha256(url.encode()).hexdigest()
+        digest = self._cached_digest(url_key)
+        if digest is not None:
+            path = self.variant_path(digest, variant, fmt)
+            if path.exists():
+                record_cache("image", hits=1)
+                return path
+        record_cache("image", misses=1)
+
+        running = self._running.get(url_key)
+        if running is None:
+            running = self._running[url_key] = asyncio.ensure_future(self._ingest(url, url_key))
+            running.add_done_callback(lambda _: self._running.pop(url_key, None))
+        digest = await asyncio.shield(running)
+        return self.variant_path(digest, variant, fmt)
+
+    def _cached_digest(self, url_key: str) -> Optional[str]:
+        try:
+            return (self.cache_dir / "urls" / url_key).read_text()
+        except FileNotFoundError:
+            return None
+
+    async def _ingest(self, url: str, url_key: str) -> str:
+        data = await self._fetch(url)
+        digest = hashlib.sha256(data).hexdigest()
+        source = self.cache_dir / "sources" / digest[:2] / digest
+        if not source.exists():
+            await asyncio.to_thread(_write_atomic, source, lambda f: f.write(data))
+        paths = {variant: {fmt: str(self.variant_path(digest, variant, fmt)) for fmt in IMAGE_FORMATS}
+                 for variant in IMAGE_VARIANTS}
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self.pool, render_variants, str(source), paths, self.quality)
+        except Exception as e:
+            raise ImageSourceError(f"Cannot decode image {url}") from e
+        # Recorded last: a url entry means its variants are all on disk
+        await asyncio.to_thread(_write_atomic, self.cache_dir / "urls" / url_key,
+                                lambda f: f.write(digest.encode()))
+        logger.info("Rendered image variants of %s", url)
+        return digest
+
+    async def _fetch(self, url: str) -> bytes:
+        if url.startswith(("http://", "https://")):
+            try:
+                async with self.client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    data = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        data += chunk
+                        if len(data) > self.max_source_bytes:
+                            raise ImageSourceError(f"Image {url} is larger than {self.max_source_bytes} bytes")
+                    return bytes(data)
+            except httpx.HTTPError as e:
+                raise ImageSourceError(f"Cannot fetch image {url}: {e}") from e
+
+        # Local sources must stay inside source_dir
+        path = (self.source_dir / url).resolve() if self.source_dir else None
+        if path is None or not path.is_relative_to(self.source_dir) or not path.is_file():
+            raise ImageSourceError(f"Unknown image source {url}")
+        if path.stat().st_size > self.max_source_bytes:
+            raise ImageSourceError(f"Image {url} is larger than {self.max_source_bytes} bytes")
+        return await asyncio.to_thread(path.read_bytes)
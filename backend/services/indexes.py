@@ -0,0 +1,152 @@
+import logging
+import os
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Carts untouched for this long are removed by MongoDB's TTL monitor
+CART_TTL_SECONDS = int(os.environ.get('CART_TTL_SECONDS', str(30 * 24 * 3600)))
+
+# Idempotency keys (and the responses stored with them) are kept this long
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+
+INDEX_OPTIONS_CONFLICT = 85
+
+# Indexes backing every query the API issues, per collection
+INDEXES: Dict[str, List[IndexModel]] = {
+    "products": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("category", ASCENDING), ("subcategory", ASCENDING), ("price", ASCENDING)],
+                   name="category_subcategory_price"),
+        IndexModel([("category", ASCENDING), ("subcategory", ASCENDING), ("rating", DESCENDING)],
+                   name="category_subcategory_rating"),
+        IndexModel([("category", ASCENDING), ("subcategory", ASCENDING), ("name", ASCENDING)],
+                   name="category_subcategory_name"),
+        # Only products whose stock is tracked; the inventory sweeper syncs their inStock
+        IndexModel([("stock", ASCENDING)], name="stock", sparse=True),
+    ],
+    "carts": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at_ttl", expireAfterSeconds=CART_TTL_SECONDS),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("order_number", ASCENDING)], name="order_number_unique", unique=True),
+        IndexModel([("session_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+                   name="session_id_created_at_id"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+                   name="user_id_created_at_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+        # Only orders with undelivered events, read by the outbox relay
+        IndexModel([("outbox.id", ASCENDING)], name="outbox_pending",
+                   partialFilterExpression={"outbox.id": {"$exists": True}}),
+        # Leases of queued payments, read by PaymentQueue.recover()
+        IndexModel([("payment_lease_until", ASCENDING)], name="payment_lease_pending",
+                   partialFilterExpression={"status": "pending"}),
+    ],
+    # Reservations are keyed by order id; the sweeper looks up expired holds
+    "inventory_reservations": [
+        IndexModel([("state", ASCENDING), ("expires_at", ASCENDING)], name="state_expires_at"),
+    ],
+    "inventory_shards": [
+        IndexModel([("product_id", ASCENDING), ("stock", ASCENDING)], name="product_id_stock"),
+    ],
+    # Keys are unique through _id; this only expires them
+    "idempotency_keys": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS),
+    ],
+}
+
+# Representative shapes of the queries issued by server.py, checked by explain_queries()
+QUERY_SHAPES: List[Dict[str, Any]] = [
+    {"name": "product by id", "collection": "products", "filter": {"id": "x"}},
+    {"name": "products by category", "collection": "products",
+     "filter": {"category": "x", "subcategory": "y"}, "sort": {"price": 1}},
+    {"name": "cart by session", "collection": "carts", "filter": {"session_id": "x"}},
+    {"name": "order by id", "collection": "orders", "filter": {"id": "x"}},
+    {"name": "orders by session", "collection": "orders",
+     "filter": {"session_id": "x"}, "sort": {"created_at": -1, "id": -1}},
+    {"name": "orders by user", "collection": "orders",
+     "filter": {"user_id": "x"}, "sort": {"created_at": -1, "id": -1}},
+    {"name": "all orders", "collection": "orders", "filter": {}, "sort": {"created_at": -1, "id": -1}},
+    {"name": "orders updated since", "collection": "orders", "filter": {"updated_at": {"$gte": "x"}}},
+    {"name": "orders by status", "collection": "orders", "filter": {"status": {"$in": ["x", "y"]}}},
+    {"name": "orders with pending events", "collection": "orders", "filter": {"outbox.id": {"$exists": True}}},
+    {"name": "pending payments with expired lease", "collection": "orders",
+     "filter": {"status": "pending", "payment_lease_until": {"$lt": "x"}}},
+    {"name": "expired reservations", "collection": "inventory_reservations",
+     "filter": {"state": "held", "expires_at": {"$lt": "x"}}},
+    {"name": "stock shards of product", "collection": "inventory_shards",
+     "filter": {"product_id": "x", "stock": {"$gt": 0}}},
+]
+
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """Create every declared index; existing ones are left untouched"""
+    created: Dict[str, List[str]] = {}
+    for collection, indexes in INDEXES.items():
+        try:
+            created[collection] = await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            if e.code == INDEX_OPTIONS_CONFLICT and await sync_ttl(db, collection, indexes):
+                created[collection] = await db[collection].create_indexes(indexes)
+                continue
+            # e.g. duplicate values preventing a unique index; keep serving
+            logger.error("Could not create indexes on %s: %s", collection, e)
+            created[collection] = []
+    return created
+
+
+async def sync_ttl(db, collection: str, indexes: List[IndexModel]) -> bool:
+    """Apply a changed expireAfterSeconds to existing TTL indexes with collMod"""
+    existing = await db[collection].index_information()
+    changed = False
+    for index in indexes:
+        document = index.document
+        name = document["name"]
+        if "expireAfterSeconds" not in document or name not in existing:
+            continue
+        if existing[name].get("expireAfterSeconds") != document["expireAfterSeconds"]:
+            await db.command({"collMod": collection, "index": {
+                "name": name, "expireAfterSeconds": document["expireAfterSeconds"]
+            }})
+            logger.info("TTL of %s.%s set to %ss", collection, name, document["expireAfterSeconds"])
+            changed = True
+    return changed
+
+
+def plan_stages(plan: Any) -> List[str]:
+    """Every stage name in an explain plan tree"""
+    stages: List[str] = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+async def explain_queries(db) -> List[Dict[str, Any]]:
+    """Winning plan stages of each query shape, flagging collection scans"""
+    report = []
+    for shape in QUERY_SHAPES:
+        find = {"find": shape["collection"], "filter": shape["filter"]}
+        if "sort" in shape:
+            find["sort"] = shape["sort"]
+        explain = await db.command({"explain": find, "verbosity": "queryPlanner"})
+        stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+        report.append({
+            "query": shape["name"],
+            "collection": shape["collection"],
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
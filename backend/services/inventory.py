@@ -0,0 +1,256 @@
+"""
+Stock levels and checkout reservations.
+
+``products.stock`` holds the units left of a product; products without it
+(or with null) are not tracked and never run out. Checkout reserves every
+tracked line with a conditional decrement (``stock >= quantity``), so two
+buyers can never both take the last unit, and records what it took in
+``inventory_reservations`` under the order id. The reservation is committed
+once the order is paid, and released (units put back) when payment fails or
+it expires unpaid.
+
+Every write to ``stock`` or ``inStock`` also sets ``updated_at``, which the
+catalog ETag and Last-Modified are derived from.
+
+Hot products can spread their stock over ``stock_shards`` counters in
+``inventory_shards``; concurrent buyers then decrement different documents
+instead of queueing on one. ``products.stock`` of a sharded product is a
+snapshot refreshed by the sweeper.
+
+A worker dying between a decrement and the reservation insert loses those
+units until the stock is set again; the window is one round trip.
+"""
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+HELD = "held"
+COMMITTED = "committed"
+RELEASED = "released"
+
+
+class OutOfStock(ValueError):
+    def __init__(self, product_ids: List[str]):
+        super().__init__(f"Stock insuffisant: {', '.join(product_ids)}")
+        self.product_ids = product_ids
+
+
+def shard_id(product_id: str, shard: int) -> str:
+    return f"{product_id}:{shard}"
+
+
+def split_stock(stock: int, shards: int) -> List[int]:
+    """``stock`` spread over ``shards`` counters, differing by at most one unit"""
+    base, extra = divmod(stock, shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+
+class Inventory:
+    def __init__(self, db, reservation_ttl: float = 900):
+        self.db = db
+        self.reservation_ttl = reservation_ttl
+
+    async def set_stock(self, product_id: str, stock: Optional[int], shards: int = 1) -> bool:
+        """Set (or with None, stop tracking) the stock of a product; False if it does not exist
+
+        Units held by open reservations are not included: they come back on
+        top of ``stock`` if those reservations are released.
+        """
+        now = datetime.utcnow()
+        if stock is None:
+            update = {"$unset": {"stock": "", "stock_shards": ""}, "$set": {"updated_at": now}}
+        elif shards > 1:
+            update = {"$set": {"stock": stock, "stock_shards": shards, "inStock": stock > 0, "updated_at": now}}
+        else:
+            update = {"$set": {"stock": stock, "inStock": stock > 0, "updated_at": now},
+                      "$unset": {"stock_shards": ""}}
+        result = await self.db.products.update_one({"id": product_id}, update)
+        if not result.matched_count:
+            return False
+
+        await self.db.inventory_shards.delete_many({"product_id": product_id})
+        if stock is not None and shards > 1:
+            await self.db.inventory_shards.insert_many([
+                {"_id": shard_id(product_id, shard), "product_id": product_id, "shard": shard, "stock": units}
+                for shard, units in enumerate(split_stock(stock, shards))
+            ])
+        return True
+
+    async def stock_level(self, product_id: str) -> Optional[Tuple[Optional[int], int]]:
+        """(units left or None if untracked, shard count); None for an unknown product"""
+        product = await self.db.products.find_one({"id": product_id}, {"_id": 0, "stock": 1, "stock_shards": 1})
+        if product is None:
+            return None
+        shards = product.get("stock_shards") or 1
+        if shards == 1:
+            return product.get("stock"), 1
+        counters = await self.db.inventory_shards.find({"product_id": product_id}, {"stock": 1}).to_list(None)
+        return sum(counter["stock"] for counter in counters), shards
+
+    async def reserve(self, order_id: str, items: Iterable[Tuple[str, int]]) -> List[Dict[str, Any]]:
+        """Take ``(product_id, quantity)`` lines out of stock for an order
+
+        Returns the lines taken (empty if no product is tracked). Raises
+        OutOfStock, with nothing taken, if any tracked product is short.
+        """
+        quantities: Dict[str, int] = {}
+        for product_id, quantity in items:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        tracked = {
+            product["id"]: product.get("stock_shards") or 1
+            async for product in self.db.products.find(
+                {"id": {"$in": list(quantities)}, "stock": {"$ne": None}},
+                {"_id": 0, "id": 1, "stock_shards": 1})
+        }
+        if not tracked:
+            return []
+
+        taken: List[Dict[str, Any]] = []
+        try:
+            for product_id, quantity in quantities.items():
+                shards = tracked.get(product_id)
+                if shards is None:
+                    continue
+                if shards > 1:
+                    taken += await self._take_from_shards(product_id, quantity, shards)
+                    continue
+                result = await self.db.products.update_one(
+                    {"id": product_id, "stock": {"$gte": quantity}},
+                    {"$inc": {"stock": -quantity}, "$set": {"updated_at": datetime.utcnow()}})
+                if not result.modified_count:
+                    raise OutOfStock([product_id])
+                taken.append({"product_id": product_id, "shard": None, "quantity": quantity})
+        except BaseException:
+            await self._restock(taken)
+            raise
+
+        now = datetime.utcnow()
+        await self.db.inventory_reservations.insert_one({
+            "_id": order_id,
+            "state": HELD,
+            "lines": taken,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=self.reservation_ttl),
+        })
+        return taken
+
+    async def _take_from_shards(self, product_id: str, quantity: int, shards: int) -> List[Dict[str, Any]]:
+        counters = await self.db.inventory_shards.find(
+            {"product_id": product_id, "stock": {"$gt": 0}}, {"shard": 1, "stock": 1}).to_list(shards)
+        # Buyers start on different counters so they rarely contend
+        random.shuffle(counters)
+        taken: List[Dict[str, Any]] = []
+        needed = quantity
+        for counter in counters:
+            key, available = counter["_id"], counter["stock"]
+            while needed and available > 0:
+                take = min(available, needed)
+                result = await self.db.inventory_shards.update_one(
+                    {"_id": key, "stock": {"$gte": take}}, {"$inc": {"stock": -take}})
+                if result.modified_count:
+                    taken.append({"product_id": product_id, "shard": counter["shard"], "quantity": take})
+                    needed -= take
+                    available -= take
+                else:
+                    # Another buyer got there first
+                    current = await self.db.inventory_shards.find_one({"_id": key}, {"stock": 1})
+                    available = current["stock"] if current else 0
+            if not needed:
+                return taken
+        await self._restock(taken)
+        raise OutOfStock([product_id])
+
+    async def _restock(self, lines: List[Dict[str, Any]]) -> None:
+        now = datetime.utcnow()
+        products = [UpdateOne({"id": line["product_id"]},
+                              {"$inc": {"stock": line["quantity"]}, "$set": {"updated_at": now}})
+                    for line in lines if line["shard"] is None]
+        counters = [UpdateOne({"_id": shard_id(line["product_id"], line["shard"])},
+                              {"$inc": {"stock": line["quantity"]},
+                               "$setOnInsert": {"product_id": line["product_id"], "shard": line["shard"]}},
+                              upsert=True)
+                    for line in lines if line["shard"] is not None]
+        if products:
+            await self.db.products.bulk_write(products, ordered=False)
+        if counters:
+            await self.db.inventory_shards.bulk_write(counters, ordered=False)
+
+    async def commit(self, order_id: str) -> bool:
+        """Keep the units of a paid order; False if its reservation was already released"""
+        result = await self.db.inventory_reservations.update_one(
+            {"_id": order_id, "state": HELD},
+            {"$set": {"state": COMMITTED, "committed_at": datetime.utcnow()}})
+        if result.modified_count:
+            return True
+        reservation = await self.db.inventory_reservations.find_one({"_id": order_id}, {"state": 1})
+        if reservation is not None and reservation["state"] == RELEASED:
+            logger.warning("Order %s was paid after its stock reservation was released", order_id)
+            return False
+        return True
+
+    async def release(self, order_id: str) -> bool:
+        """Put the units of an unpaid order back, once"""
+        reservation = await self.db.inventory_reservations.find_one_and_update(
+            {"_id": order_id, "state": HELD},
+            {"$set": {"state": RELEASED, "released_at": datetime.utcnow()}})
+        if reservation is None:
+            return False
+        await self._restock(reservation["lines"])
+        return True
+
+    async def cancel(self, order_ids: List[str]) -> int:
+        """Put back the units of cancelled orders, paid or not, once; returns how many had any"""
+        reservations = await self.db.inventory_reservations.find(
+            {"_id": {"$in": order_ids}, "state": {"$in": [HELD, COMMITTED]}}, {"_id": 1}
+        ).to_list(None)
+        cancelled = 0
+        for reservation in reservations:
+            returned = await self.db.inventory_reservations.find_one_and_update(
+                {"_id": reservation["_id"], "state": {"$in": [HELD, COMMITTED]}},
+                {"$set": {"state": RELEASED, "released_at": datetime.utcnow()}})
+            if returned is not None:
+                await self._restock(returned["lines"])
+                cancelled += 1
+        return cancelled
+
+    async def release_expired(self, limit: int = 1000) -> int:
+        expired = await self.db.inventory_reservations.find(
+            {"state": HELD, "expires_at": {"$lt": datetime.utcnow()}}, {"_id": 1}
+        ).limit(limit).to_list(limit)
+        released = 0
+        for reservation in expired:
+            released += await self.release(reservation["_id"])
+        if released:
+            logger.info("Released %d expired stock reservations", released)
+        return released
+
+    async def refresh_snapshots(self) -> None:
+        """Copy shard totals into products.stock and keep inStock in line with stock"""
+        now = datetime.utcnow()
+        async for total in self.db.inventory_shards.aggregate([
+            {"$group": {"_id": "$product_id", "stock": {"$sum": "$stock"}}}
+        ]):
+            # Unchanged snapshots are left alone so that the catalog version holds
+            await self.db.products.update_one(
+                {"id": total["_id"], "stock_shards": {"$exists": True}, "stock": {"$ne": total["stock"]}},
+                {"$set": {"stock": total["stock"], "updated_at": now}})
+        await self.db.products.update_many({"stock": {"$lte": 0}, "inStock": True},
+                                           {"$set": {"inStock": False, "updated_at": now}})
+        await self.db.products.update_many({"stock": {"$gt": 0}, "inStock": False},
+                                           {"$set": {"inStock": True, "updated_at": now}})
+
+    async def run(self, interval: float) -> None:
+        """Release expired reservations and refresh snapshots every ``interval`` seconds"""
+        while True:
+            try:
+                await self.release_expired()
+                await self.refresh_snapshots()
+            except Exception:
+                logger.exception("Inventory sweep failed")
+            await asyncio.sleep(interval)
@@ -0,0 +1,398 @@
+"""
+In-process metrics, rendered in the Prometheus text format at /metrics.
+
+    http_request_duration_seconds{method, route, status}      histogram
+    mongodb_command_duration_seconds{collection, command}     histogram
+    mongodb_command_failures_total{collection, command}       counter
+    payment_provider_duration_seconds{payment_method, outcome} histogram
+    cache_requests_total{cache, result}                       counter
+    mongodb_pool_connections{address, state}                  gauge
+    mongodb_pool_max_size{address}                            gauge
+    mongodb_pool_wait_seconds{address}                        histogram
+    mongodb_pool_checkout_failures_total{address, reason}     counter
+
+Recording a sample is a dictionary lookup and a bisect under a lock, so the
+metrics stay on in production. Routes are labelled with their path template
+(``/api/products/{product_id}``), never the raw path.
+
+With a slow-request threshold, RequestMetricsMiddleware also collects the
+MongoDB commands each request issues (motor runs them with the request's
+context, so a ContextVar follows them into its worker threads) and logs the
+requests over the threshold with their commands and the query plan of the
+slowest one.
+"""
+import asyncio
+import bisect
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PAYMENT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+# Commands the query planner can explain
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Command fields explain rejects or that only make sense for the original run
+NOT_EXPLAINED = {"lsid", "txnNumber", "readConcern", "writeConcern", "$db", "$clusterTime",
+                 "$readPreference", "autocommit", "startTransaction"}
+
+
+def _label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: Any, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: Any) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: Any, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: Any) -> None:
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Any] = []
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+HTTP_REQUESTS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status"))
+MONGO_COMMANDS = REGISTRY.histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency seen by the driver",
+    ("collection", "command"))
+MONGO_FAILURES = REGISTRY.counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error",
+    ("collection", "command"))
+PAYMENT_CALLS = REGISTRY.histogram(
+    "payment_provider_duration_seconds", "Mobile money charge latency by payment method",
+    ("payment_method", "outcome"), PAYMENT_BUCKETS)
+CACHE_REQUESTS = REGISTRY.counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit or miss)",
+    ("cache", "result"))
+
+POOL_CONNECTIONS = REGISTRY.gauge(
+    "mongodb_pool_connections", "Driver pool connections by state (open, or checked_out by an operation)",
+    ("address", "state"))
+POOL_MAX_SIZE = REGISTRY.gauge(
+    "mongodb_pool_max_size", "maxPoolSize of the driver pool; checked_out / max_size is its saturation",
+    ("address",))
+POOL_WAITS = REGISTRY.histogram(
+    "mongodb_pool_wait_seconds", "Time operations waited to check a connection out of the pool",
+    ("address",))
+POOL_CHECKOUT_FAILURES = REGISTRY.counter(
+    "mongodb_pool_checkout_failures_total", "Connection checkouts that failed, e.g. on waitQueueTimeoutMS",
+    ("address", "reason"))
+
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0) -> None:
+    if hits:
+        CACHE_REQUESTS.inc(cache, "hit", amount=hits)
+    if misses:
+        CACHE_REQUESTS.inc(cache, "miss", amount=misses)
+
+
+class CommandRecord(NamedTuple):
+    database: str
+    collection: str
+    name: str
+    command: Optional[dict]
+    seconds: float
+
+
+# Commands of the request being handled, when slow-request logging is on
+_request_commands: ContextVar[Optional[List[CommandRecord]]] = ContextVar("request_commands", default=None)
+
+
+def _collection_of(event) -> str:
+    target = event.command.get(event.command_name)
+    if isinstance(target, str):
+        return target
+    return event.command.get("collection", "") if event.command_name == "getMore" else ""
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding MONGO_COMMANDS; pass it to the client
+    with ``event_listeners=[...]``"""
+
+    def __init__(self):
+        self._started: Dict[Tuple[int, Any], Tuple[str, str, Optional[dict]]] = {}
+
+    def started(self, event) -> None:
+        commands = _request_commands.get()
+        # The command document is only kept when it may have to be explained
+        command = dict(event.command) if commands is not None and event.command_name in EXPLAINABLE else None
+        self._started[(event.request_id, event.connection_id)] = (
+            _collection_of(event), event.database_name, command)
+
+    def succeeded(self, event) -> None:
+        self._finished(event, failed=False)
+
+    def failed(self, event) -> None:
+        self._finished(event, failed=True)
+
+    def _finished(self, event, failed: bool) -> None:
+        collection, database, command = self._started.pop(
+            (event.request_id, event.connection_id), ("", "", None))
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMANDS.observe(seconds, collection, event.command_name)
+        if failed:
+            MONGO_FAILURES.inc(collection, event.command_name)
+        commands = _request_commands.get()
+        if commands is not None:
+            commands.append(CommandRecord(database, collection, event.command_name, command, seconds))
+
+
+def _address(address) -> str:
+    host, port = address
+    return f"{host}:{port}"
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """pymongo pool listener feeding the POOL_* metrics; ``max_pool_size`` is
+    reported for pools whose options do not say"""
+
+    def __init__(self, max_pool_size: int = 100):
+        self.max_pool_size = max_pool_size
+        # Checkouts run synchronously in the thread issuing the operation
+        self._waiting = threading.local()
+
+    def pool_created(self, event) -> None:
+        POOL_MAX_SIZE.set(event.options.get("maxPoolSize", self.max_pool_size), _address(event.address))
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        POOL_CONNECTIONS.inc(_address(event.address), "open")
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        POOL_CONNECTIONS.dec(_address(event.address), "open")
+
+    def connection_check_out_started(self, event) -> None:
+        self._waiting.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event) -> None:
+        address = _address(event.address)
+        self._observe_wait(address)
+        POOL_CHECKOUT_FAILURES.inc(address, event.reason)
+
+    def connection_checked_out(self, event) -> None:
+        address = _address(event.address)
+        self._observe_wait(address)
+        POOL_CONNECTIONS.inc(address, "checked_out")
+
+    def connection_checked_in(self, event) -> None:
+        POOL_CONNECTIONS.dec(_address(event.address), "checked_out")
+
+    def _observe_wait(self, address: str) -> None:
+        started = getattr(self._waiting, "started", None)
+        if started is not None:
+            POOL_WAITS.observe(time.perf_counter() - started, address)
+            self._waiting.started = None
+
+
+def explain_command(command: dict) -> dict:
+    return {"explain": {key: value for key, value in command.items() if key not in NOT_EXPLAINED},
+            "verbosity": "queryPlanner"}
+
+
+def plan_summary(plan: Dict[str, Any]) -> str:
+    """Winning plan of an explain result, as nested stage names and index names"""
+    planner = plan.get("queryPlanner") or next(
+        (stage["$cursor"]["queryPlanner"] for stage in plan.get("stages", []) if "$cursor" in stage), {})
+
+    def describe(stage: Dict[str, Any]) -> str:
+        name = stage.get("stage", "?")
+        if "indexName" in stage:
+            name += f"({stage['indexName']})"
+        children = [stage[key] for key in ("inputStage", "queryPlan") if key in stage]
+        children += stage.get("inputStages", [])
+        return name + (" <- " + ", ".join(describe(child) for child in children) if children else "")
+
+    winning = planner.get("winningPlan")
+    return describe(winning.get("queryPlan", winning)) if winning else json.dumps(plan, default=str)[:500]
+
+
+def route_template(scope) -> str:
+    """Path template of the route serving a request, or "unmatched"
+
+    Requests answered by a middleware, such as the 304s of CatalogHttpCache,
+    never reach routing and are matched against the app's routes here.
+    """
+    route = scope.get("route")
+    if route is None and "app" in scope:
+        route = next((candidate for candidate in scope["app"].routes
+                      if candidate.matches(scope)[0] == Match.FULL), None)
+    return route.path if route is not None else "unmatched"
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing every HTTP request into HTTP_REQUESTS
+
+    With ``slow_request_ms`` > 0, requests slower than that are logged along
+    with their MongoDB commands; ``explain`` (database name, explain command)
+    is then used to log the plan of the slowest explainable command.
+    """
+
+    def __init__(self, app, slow_request_ms: float = 0,
+                 explain: Optional[Callable[[str, dict], Awaitable[dict]]] = None):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+        self.explain = explain
+        self._explaining: set = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        commands: Optional[List[CommandRecord]] = [] if self.slow_request_ms > 0 else None
+        token = _request_commands.set(commands)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_commands.reset(token)
+            template = route_template(scope)
+            HTTP_REQUESTS.observe(elapsed, scope["method"], template, status)
+            if commands is not None and elapsed * 1000 >= self.slow_request_ms:
+                self._log_slow(scope["method"], scope["path"], template, status, elapsed, commands)
+
+    def _log_slow(self, method: str, path: str, template: str, status: int, elapsed: float,
+                  commands: List[CommandRecord]) -> None:
+        commands = sorted(commands, key=lambda record: record.seconds, reverse=True)
+        summary = ", ".join(f"{record.name} {record.collection} {record.seconds * 1000:.1f}ms"
+                            for record in commands[:5])
+        logger.warning("Slow request %s %s (%s) -> %d in %.1f ms, %d MongoDB commands: %s",
+                       method, path, template, status, elapsed * 1000, len(commands), summary or "none")
+        slowest = next((record for record in commands if record.command is not None), None)
+        if slowest is not None and self.explain is not None:
+            # Explain after the response is sent; keep a reference until it finishes
+            task = asyncio.create_task(self._log_plan(method, template, slowest))
+            self._explaining.add(task)
+            task.add_done_callback(self._explaining.discard)
+
+    async def _log_plan(self, method: str, template: str, record: CommandRecord) -> None:
+        try:
+            plan = await self.explain(record.database, explain_command(record.command))
+            logger.warning("Query plan of %s %s on %s (%s %s): %s", record.name, record.collection,
+                           record.database, method, template, plan_summary(plan))
+        except Exception as e:
+            logger.warning("Could not explain %s %s: %s", record.name, record.collection, e)
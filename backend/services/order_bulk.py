@@ -0,0 +1,198 @@
+"""
+Bulk order operations for back-office fulfilment and marketplace sync.
+
+Status changes follow models.order.MANUAL_TRANSITIONS and are applied with
+one conditional update per source status, all sent in a single bulk_write;
+each order is only updated if its status did not change since it was read,
+and gets the event of its change queued in its outbox (services/outbox.py),
+like the ones written by checkout. The event id is also kept in
+``status_event_id``, so that orders a concurrent writer got to first are
+reported as not updated. Cancelled orders give their reserved or
+sold stock back (services/inventory.py).
+
+Imported orders are inserted with their ``order.created`` event.
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pydantic import ValidationError
+from pymongo import UpdateMany, UpdateOne
+
+from models.order import (
+    MAX_BULK_ORDERS, MANUAL_TRANSITIONS, Order, OrderFilter, OrderImport, OrderImportReport,
+    OrderImportResult, OrderItem, OrderStatus, OrderStatusBulkResult, OrderStatusResult
+)
+from services.outbox import ORDER_CREATED, order_event, transition
+
+STATUS_FIELDS = {"_id": 0, "id": 1, "status": 1}
+
+
+def sources_of(status: OrderStatus) -> List[OrderStatus]:
+    """Statuses an order may move to ``status`` from"""
+    return [source for source, targets in MANUAL_TRANSITIONS.items() if status in targets]
+
+
+def filter_query_for(order_filter: OrderFilter) -> Dict[str, Any]:
+    query: Dict[str, Any] = {}
+    if order_filter.session_id:
+        query["session_id"] = order_filter.session_id
+    if order_filter.user_id:
+        query["user_id"] = order_filter.user_id
+    if order_filter.status:
+        query["status"] = order_filter.status
+    created = {}
+    if order_filter.created_after:
+        created["$gte"] = order_filter.created_after
+    if order_filter.created_before:
+        created["$lt"] = order_filter.created_before
+    if created:
+        query["created_at"] = created
+    return query
+
+
+async def transition_orders(
+    db,
+    status: OrderStatus,
+    order_ids: Optional[Iterable[str]] = None,
+    order_filter: Optional[OrderFilter] = None,
+    inventory=None
+) -> OrderStatusBulkResult:
+    """Move orders to ``status``, reporting the outcome of each one
+
+    Orders are given by id, or selected by ``order_filter`` among those whose
+    current status allows the transition (at most MAX_BULK_ORDERS).
+    """
+    sources = sources_of(status)
+    if order_ids is not None:
+        order_ids = list(dict.fromkeys(order_ids))
+        query: Dict[str, Any] = {"id": {"$in": order_ids}}
+    else:
+        query = filter_query_for(order_filter or OrderFilter())
+        query["status"] = {"$in": [
+            source for source in sources if query.get("status") in (None, source)
+        ]}
+    current = {
+        order["id"]: OrderStatus(order["status"])
+        async for order in db.orders.find(query, STATUS_FIELDS).limit(MAX_BULK_ORDERS)
+    }
+    if order_ids is None:
+        order_ids = list(current)
+
+    results: Dict[str, OrderStatusResult] = {}
+    by_source: Dict[OrderStatus, List[str]] = {}
+    for order_id in order_ids:
+        previous = current.get(order_id)
+        if previous is None:
+            results[order_id] = OrderStatusResult(order_id=order_id, updated=False, error="Order not found")
+        elif previous not in sources:
+            results[order_id] = OrderStatusResult(
+                order_id=order_id, updated=False, previous_status=previous,
+                error=f"Cannot move from {previous.value} to {status.value}"
+            )
+        else:
+            by_source.setdefault(previous, []).append(order_id)
+            results[order_id] = OrderStatusResult(order_id=order_id, updated=True, previous_status=previous)
+
+    planned = sum(len(ids) for ids in by_source.values())
+    if planned:
+        now = datetime.utcnow()
+        operations, event_ids = [], []
+        for source, ids in by_source.items():
+            update = transition(status, source, now)
+            # Tells the orders this call changed from those a concurrent writer did
+            event_ids.append(update["$push"]["outbox"]["id"])
+            update["$set"]["status_event_id"] = event_ids[-1]
+            operations.append(UpdateMany({"id": {"$in": ids}, "status": source}, update))
+        outcome = await db.orders.bulk_write(operations, ordered=False)
+        if outcome.modified_count < planned:
+            # Another writer changed some of these orders after they were read
+            planned_ids = [order_id for ids in by_source.values() for order_id in ids]
+            async for order in db.orders.find(
+                    {"id": {"$in": planned_ids}, "status_event_id": {"$nin": event_ids}}, STATUS_FIELDS):
+                results[order["id"]] = OrderStatusResult(
+                    order_id=order["id"], updated=False, previous_status=order["status"],
+                    error="Status changed concurrently"
+                )
+        if status == OrderStatus.CANCELLED and inventory is not None:
+            await inventory.cancel([result.order_id for result in results.values() if result.updated])
+
+    return OrderStatusBulkResult(
+        status=status,
+        matched=len(current),
+        updated=sum(result.updated for result in results.values()),
+        results=list(results.values())
+    )
+
+
+def imported_order(row: OrderImport) -> Order:
+    items = [
+        OrderItem(**item.dict(), subtotal=item.product_price * item.quantity)
+        for item in row.items
+    ]
+    order = Order(
+        order_number=row.order_number,
+        items=items,
+        total=sum(item.subtotal for item in items),
+        payment_method=row.payment_method,
+        phone_number=row.phone_number,
+        status=row.status,
+        user_id=row.user_id
+    )
+    if row.created_at:
+        # updated_at stays at the import time, so incremental rollup refreshes see the order
+        order.created_at = row.created_at
+    return order
+
+
+async def import_orders(db, rows: List[Dict[str, Any]]) -> OrderImportReport:
+    """Insert marketplace orders in one unordered bulk_write
+
+    Orders whose order_number already exists are left untouched, so a sync
+    job can safely resend a batch.
+    """
+    results: List[OrderImportResult] = []
+    operations = []
+    pending: List[OrderImportResult] = []
+    seen = set()
+    for index, row in enumerate(rows):
+        try:
+            order = imported_order(OrderImport(**row))
+        except (ValidationError, TypeError) as e:
+            results.append(OrderImportResult(index=index, result="rejected", error=str(e)))
+            continue
+        if order.order_number in seen:
+            results.append(OrderImportResult(index=index, order_number=order.order_number,
+                                             result="rejected", error="Duplicate order_number in batch"))
+            continue
+        seen.add(order.order_number)
+        operations.append(UpdateOne({"order_number": order.order_number}, {"$setOnInsert": {
+            **order.dict(),
+            "outbox": [order_event(ORDER_CREATED, order.status, None, order.created_at)],
+        }}, upsert=True))
+        result = OrderImportResult(index=index, order_number=order.order_number,
+                                   order_id=order.id, result="existing")
+        pending.append(result)
+        results.append(result)
+
+    if operations:
+        outcome = await db.orders.bulk_write(operations, ordered=False)
+        for position in outcome.upserted_ids:
+            pending[position].result = "inserted"
+        existing = [result for result in pending if result.result == "existing"]
+        if existing:
+            ids = {
+                order["order_number"]: order["id"]
+                async for order in db.orders.find(
+                    {"order_number": {"$in": [result.order_number for result in existing]}},
+                    {"_id": 0, "order_number": 1, "id": 1}
+                )
+            }
+            for result in existing:
+                result.order_id = ids.get(result.order_number)
+
+    return OrderImportReport(
+        inserted=sum(result.result == "inserted" for result in results),
+        existing=sum(result.result == "existing" for result in results),
+        rejected=sum(result.result == "rejected" for result in results),
+        results=results
+    )
@@ -0,0 +1,206 @@
+"""
+Order events for downstream consumers (SMS confirmations, warehouse).
+
+Every order write that creates it or changes its status also pushes an event
+onto the order's ``outbox`` array. Both land in one single-document update,
+which MongoDB applies atomically, so an event exists if and only if its
+change was written, without multi-document transactions.
+
+OutboxRelay delivers the pending events in chunks: it claims up to
+``batch_size`` orders with events, hands all their events to the sink, then
+pulls the delivered ones off their orders. Every worker runs a relay; the
+claim (``outbox_claimed_by``, ``outbox_claimed_until``) is set per order by
+a conditional update, so each chunk goes to one relay, and lapses after
+``claim_lease`` seconds should that relay stop. A relay stopping between
+delivery and the pull delivers the chunk again, so delivery is at least
+once; consumers deduplicate on ``event_id``.
+
+When the sink rejects a chunk, its orders are retried one by one so that a
+single bad order cannot hold the others back. An order failing on its own
+while others go through counts an attempt (``outbox_attempts``); after
+``max_attempts`` its events are moved to ``outbox_failed`` on the order for
+someone to look at. If every order fails the sink is taken to be down and
+no attempt is counted.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from pymongo import UpdateOne
+
+from models.order import OrderStatus
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = "order.created"
+ORDER_STATUS_CHANGED = "order.status_changed"
+
+# Order fields sent along with each event
+ORDER_FIELDS = ("order_number", "user_id", "session_id", "phone_number", "payment_method", "total")
+RELAY_FIELDS = {"_id": 0, "id": 1, "outbox": 1, "outbox_attempts": 1, **{field: 1 for field in ORDER_FIELDS}}
+CLAIM_FIELDS = {"outbox_claimed_by": "", "outbox_claimed_until": ""}
+
+OUTBOX_EVENTS = REGISTRY.counter(
+    "outbox_events_total", "Order events handed to the outbox sink, by result (delivered, failed, dead)",
+    ("result",))
+
+Sink = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+def order_event(kind: str, status: OrderStatus, previous_status: Optional[OrderStatus],
+                occurred_at: datetime) -> Dict[str, Any]:
+    return {"id": uuid.uuid4().hex, "type": kind, "status": status,
+            "previous_status": previous_status, "occurred_at": occurred_at}
+
+
+def transition(status: OrderStatus, previous_status: OrderStatus, now: datetime, **fields: Any) -> Dict[str, Any]:
+    """Update moving an order to ``status`` and queuing its event; filter it on ``previous_status``"""
+    return {
+        "$set": {"status": status, "updated_at": now, **fields},
+        "$push": {"outbox": order_event(ORDER_STATUS_CHANGED, status, previous_status, now)},
+    }
+
+
+def delivered_event(order: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    # One update may queue the same event on many orders (bulk status changes)
+    return {
+        "event_id": f"{order['id']}:{event['id']}",
+        "type": event["type"],
+        "order_id": order["id"],
+        **{field: order.get(field) for field in ORDER_FIELDS},
+        "status": OrderStatus(event["status"]).value,
+        "previous_status": OrderStatus(event["previous_status"]).value if event["previous_status"] else None,
+        "occurred_at": event["occurred_at"].isoformat() + "Z",
+    }
+
+
+class WebhookSink:
+    """POSTs each chunk as ``{"events": [...]}``; any non-2xx answer fails the chunk"""
+
+    def __init__(self, url: str, timeout: float = 10.0,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.url = url
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(timeout), transport=transport)
+
+    async def __call__(self, events: List[Dict[str, Any]]) -> None:
+        response = await self.client.post(self.url, json={"events": events})
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+async def log_sink(events: List[Dict[str, Any]]) -> None:
+    """Sink used when no webhook is configured"""
+    for event in events:
+        logger.info("Order event %s %s -> %s", event["type"], event["order_number"], event["status"])
+
+
+class OutboxRelay:
+    def __init__(self, db, sink: Sink, batch_size: int = 100, interval: float = 1.0,
+                 claim_lease: float = 60, max_attempts: int = 5):
+        self.db = db
+        self.sink = sink
+        self.batch_size = batch_size
+        self.interval = interval
+        self.claim_lease = claim_lease
+        self.max_attempts = max_attempts
+
+    async def relay_once(self) -> int:
+        """Deliver one chunk; returns the number of events delivered"""
+        claim = uuid.uuid4().hex
+        orders = await self._claim(claim)
+        if not orders:
+            return 0
+        try:
+            return await self._deliver(orders, claim)
+        except Exception:
+            if len(orders) == 1:
+                await self._unclaim(orders, claim)
+                raise
+
+        delivered, failed, error = 0, [], None
+        for order in orders:
+            try:
+                delivered += await self._deliver([order], claim)
+            except Exception as e:
+                failed.append(order)
+                error = e
+        if not delivered:
+            await self._unclaim(failed, claim)
+            raise error
+        await self._count_attempts(failed, claim, error)
+        return delivered
+
+    async def _claim(self, claim: str) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        unclaimed = {"outbox.id": {"$exists": True},
+                     "$or": [{"outbox_claimed_until": {"$exists": False}},
+                             {"outbox_claimed_until": {"$lt": now}}]}
+        candidates = await self.db.orders.find(unclaimed, {"_id": 0, "id": 1}).limit(
+            self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+        ids = [order["id"] for order in candidates]
+        # Conditional per order: a relay racing for the same orders only gets those it updated
+        await self.db.orders.update_many({"id": {"$in": ids}, **unclaimed}, {"$set": {
+            "outbox_claimed_by": claim,
+            "outbox_claimed_until": now + timedelta(seconds=self.claim_lease),
+        }})
+        return await self.db.orders.find({"id": {"$in": ids}, "outbox_claimed_by": claim},
+                                         RELAY_FIELDS).to_list(None)
+
+    async def _deliver(self, orders: List[Dict[str, Any]], claim: str) -> int:
+        events = [delivered_event(order, event) for order in orders for event in order["outbox"]]
+        try:
+            await self.sink(events)
+        except Exception:
+            OUTBOX_EVENTS.inc("failed", amount=len(events))
+            raise
+        OUTBOX_EVENTS.inc("delivered", amount=len(events))
+        # Only the delivered events: more may have been queued meanwhile
+        await self.db.orders.bulk_write([
+            UpdateOne({"id": order["id"], "outbox_claimed_by": claim}, {
+                "$pull": {"outbox": {"id": {"$in": [event["id"] for event in order["outbox"]]}}},
+                "$unset": {**CLAIM_FIELDS, "outbox_attempts": ""},
+            })
+            for order in orders
+        ], ordered=False)
+        return len(events)
+
+    async def _unclaim(self, orders: List[Dict[str, Any]], claim: str) -> None:
+        await self.db.orders.update_many(
+            {"id": {"$in": [order["id"] for order in orders]}, "outbox_claimed_by": claim},
+            {"$unset": CLAIM_FIELDS})
+
+    async def _count_attempts(self, orders: List[Dict[str, Any]], claim: str, error: Exception) -> None:
+        for order in orders:
+            attempts = order.get("outbox_attempts", 0) + 1
+            if attempts < self.max_attempts:
+                update = {"$set": {"outbox_attempts": attempts}, "$unset": CLAIM_FIELDS}
+            else:
+                # One update: the events leave outbox exactly when they land in outbox_failed
+                update = {
+                    "$push": {"outbox_failed": {"$each": order["outbox"]}},
+                    "$pull": {"outbox": {"id": {"$in": [event["id"] for event in order["outbox"]]}}},
+                    "$unset": {**CLAIM_FIELDS, "outbox_attempts": ""},
+                }
+                OUTBOX_EVENTS.inc("dead", amount=len(order["outbox"]))
+                logger.error("Moved %d events of order %s to outbox_failed after %d attempts: %s",
+                             len(order["outbox"]), order["id"], attempts, error)
+            await self.db.orders.update_one({"id": order["id"], "outbox_claimed_by": claim}, update)
+
+    async def run(self) -> None:
+        """Deliver chunks back to back while there is a backlog, then poll every ``interval`` seconds"""
+        while True:
+            try:
+                delivered = await self.relay_once()
+            except Exception:
+                logger.exception("Outbox delivery failed, retrying in %.0fs", self.interval)
+                delivered = 0
+            if not delivered:
+                await asyncio.sleep(self.interval)
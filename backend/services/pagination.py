@@ -0,0 +1,59 @@
+import base64
+import json
+import time
+from typing import Any, Dict, List, Tuple
+
+from services.metrics import record_cache
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(sort: str, values: List[Any]) -> str:
+    """Opaque cursor holding the sort order and the last row's sort key"""
+    payload = json.dumps({"s": sort, "k": values}, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> List[Any]:
+    """Sort key stored in ``cursor``; ValueError if it is malformed or for another sort"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload["k"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid cursor") from e
+    if payload.get("s") != sort or not isinstance(values, list):
+        raise ValueError("Cursor does not match the requested sort order")
+    return values
+
+
+class CountCache:
+    """
+    Short-lived cache of count_documents results, so that paging through a
+    long list does not recount the collection on every page
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._counts: Dict[Tuple, Tuple[float, int]] = {}
+
+    async def count(self, collection, filter_query: Dict[str, Any]) -> int:
+        key = (collection.name, tuple(sorted(filter_query.items())))
+        cached = self._counts.get(key)
+        now = time.monotonic()
+        if cached and cached[0] > now:
+            record_cache("order_count", hits=1)
+            return cached[1]
+        record_cache("order_count", misses=1)
+        total = await collection.count_documents(filter_query)
+        if len(self._counts) >= self.max_entries:
+            self._counts = {k: v for k, v in self._counts.items() if v[0] > now}
+            if len(self._counts) >= self.max_entries:
+                self._counts.clear()
+        self._counts[key] = (now + self.ttl, total)
+        return total
+
+    def clear(self) -> None:
+        self._counts.clear()
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from models.order import PaymentMethod
+
+logger = logging.getLogger(__name__)
+
+
+class RetryableProviderError(Exception):
+    """Operator answered with a transient error (5xx, 429)"""
+
+
+class CircuitBreaker:
+    """
+    Stops calling an operator after ``failure_threshold`` consecutive failures,
+    then lets a single trial call through once ``reset_timeout`` has elapsed.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    @property
+    def trial_in_flight(self) -> bool:
+        return self._trial_in_flight
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def abandon_trial(self) -> None:
+        """Let another call through after a trial that ended without a verdict"""
+        self._trial_in_flight = False
+
+
+class PaymentProvider:
+    """
+    HTTP adapter for one mobile money operator.
+
+    Each operator gets its own pooled client, concurrency semaphore, timeout,
+    retry policy and circuit breaker, so a degraded operator cannot slow down
+    payments going to the other one.
+
+    The default wire format is ``POST {base_url}/payments`` with
+    ``{"phone_number", "amount", "currency", "reference"}`` answering
+    ``{"status": "success"|"failed", "transaction_id", "message"}``;
+    subclasses adapt it to each operator's API.
+    """
+
+    currency = "XOF"
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str] = None,
+        max_connections: int = 20,
+        max_concurrency: int = 20,
+        timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 0.2,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            transport=transport
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+    def build_request(self, phone_number: str, amount: float, order_number: str) -> Dict[str, Any]:
+        return {
+            "url": "/payments",
+            "json": {
+                "phone_number": phone_number,
+                "amount": amount,
+                "currency": self.currency,
+                "reference": order_number,
+            },
+            # Lets the operator deduplicate our retries
+            "headers": {"Idempotency-Key": order_number},
+        }
+
+    def parse_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if data.get("status") == "success":
+            return {"success": True, "error": None, "transaction_id": data.get("transaction_id")}
+        return {
+            "success": False,
+            "error": data.get("message") or "Paiement refusé par l'opérateur",
+            "transaction_id": None,
+        }
+
+    async def charge(self, phone_number: str, amount: float, order_number: str) -> Dict[str, Any]:
+        if not self.breaker.allow():
+            return {"success": False, "error": "Service temporairement indisponible", "transaction_id": None}
+        # allow() only marks a trial while half-open
+        trial = self.breaker.trial_in_flight
+        try:
+            return await self._charge(phone_number, amount, order_number)
+        finally:
+            # Cancelled or failed unexpectedly: without this the breaker would stay shut for good
+            if trial:
+                self.breaker.abandon_trial()
+
+    async def _charge(self, phone_number: str, amount: float, order_number: str) -> Dict[str, Any]:
+        request = self.build_request(phone_number, amount, order_number)
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await self.client.post(**request)
+                    if response.status_code == 429 or response.status_code >= 500:
+                        raise RetryableProviderError(f"HTTP {response.status_code}")
+                    response.raise_for_status()
+                    result = self.parse_response(response.json())
+                    self.breaker.record_success()
+                    return result
+                except (httpx.TransportError, RetryableProviderError) as e:
+                    if attempt == self.retries:
+                        self.breaker.record_failure()
+                        logger.warning("%s payment %s failed after %d attempts: %s",
+                                       type(self).__name__, order_number, attempt + 1, e)
+                        return {"success": False, "error": "Service temporairement indisponible",
+                                "transaction_id": None}
+                    # Exponential backoff with full jitter
+                    await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                except httpx.HTTPStatusError as e:
+                    # 4xx: the operator rejected the request, retrying will not help
+                    self.breaker.record_success()
+                    return {"success": False, "error": f"Paiement refusé ({e.response.status_code})",
+                            "transaction_id": None}
+                except ValueError:
+                    self.breaker.record_failure()
+                    return {"success": False, "error": "Réponse invalide de l'opérateur",
+                            "transaction_id": None}
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class MoovMoneyProvider(PaymentProvider):
+    pass
+
+
+class AirtelMoneyProvider(PaymentProvider):
+    pass
+
+
+PROVIDER_CLASSES = {
+    PaymentMethod.MOOV_MONEY: ("MOOV", MoovMoneyProvider),
+    PaymentMethod.AIRTEL_MONEY: ("AIRTEL", AirtelMoneyProvider),
+}
+
+
+def build_providers_from_env() -> Dict[PaymentMethod, PaymentProvider]:
+    """
+    Providers for every operator with ``<OPERATOR>_API_URL`` set, e.g.
+    MOOV_API_URL, MOOV_API_KEY, MOOV_MAX_CONCURRENCY, MOOV_TIMEOUT, MOOV_RETRIES
+    """
+    providers = {}
+    for method, (prefix, provider_class) in PROVIDER_CLASSES.items():
+        base_url = os.environ.get(f"{prefix}_API_URL")
+        if not base_url:
+            continue
+        providers[method] = provider_class(
+            base_url=base_url,
+            api_key=os.environ.get(f"{prefix}_API_KEY"),
+            max_connections=int(os.environ.get(f"{prefix}_MAX_CONNECTIONS", "20")),
+            max_concurrency=int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", "20")),
+            timeout=float(os.environ.get(f"{prefix}_TIMEOUT", "10")),
+            retries=int(os.environ.get(f"{prefix}_RETRIES", "2")),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.environ.get(f"{prefix}_BREAKER_THRESHOLD", "5")),
+                reset_timeout=float(os.environ.get(f"{prefix}_BREAKER_RESET", "30")),
+            ),
+        )
+        logger.info("Payment provider %s -> %s", method.value, base_url)
+    return providers
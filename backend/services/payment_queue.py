@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from models.order import Order, OrderStatus
+from services.outbox import transition
+from services.payment_service import PaymentService
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """The payment queue already holds ``maxsize`` orders"""
+
+
+class PaymentQueue:
+    """
+    File d'attente des paiements mobiles traités en arrière-plan.
+
+    Les commandes sont insérées en PENDING par l'API, puis un pool de workers
+    appelle l'opérateur et fait passer la commande en CONFIRMED ou CANCELLED.
+
+    The queue itself lives in memory; MongoDB is the durable record. A queued
+    order is inserted with a lease (``payment_owner``, ``payment_lease_until``)
+    naming the process that will charge it, renewed when a worker picks it up.
+    Pending orders whose lease ran out, because their process stopped or died,
+    are claimed back by ``recover()`` at start and every ``recovery_interval``
+    seconds, in whichever process gets there first. A charge may then run
+    twice; the operators deduplicate on the order number. Orders paid inside
+    the request have no lease and are never recovered.
+
+    ``lease`` must exceed the longest a queued order waits plus the longest a
+    charge takes, retries included.
+    """
+
+    def __init__(
+        self,
+        db,
+        cart_store,
+        inventory=None,
+        workers: int = 4,
+        maxsize: int = 1000,
+        lease: float = 300,
+        recovery_interval: float = 30
+    ):
+        self.db = db
+        self.cart_store = cart_store
+        self.inventory = inventory
+        self.workers = workers
+        self.lease = lease
+        self.recovery_interval = recovery_interval
+        self.owner = uuid.uuid4().hex
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._tasks: List[asyncio.Task] = []
+        self._recovery: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the worker pool and the recovery of orders left by stopped workers"""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"payment-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._recovery = asyncio.create_task(self._recover_periodically(), name="payment-recovery")
+        logger.info("Payment queue started with %d workers", self.workers)
+
+    async def stop(self, drain_timeout: float = 30) -> None:
+        """Let the workers finish the queued payments, for up to ``drain_timeout`` seconds
+
+        Payments still running after that are cancelled and orders still
+        queued are handed back, to be recovered by the next worker to start.
+        """
+        if self._recovery is not None:
+            self._recovery.cancel()
+            self._recovery = None
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Payment queue not drained after %.0fs, %d orders left",
+                           drain_timeout, self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        left = []
+        while not self.queue.empty():
+            left.append(self.queue.get_nowait().id)
+            self.queue.task_done()
+        if left:
+            await self.db.orders.update_many(
+                {"id": {"$in": left}, "status": OrderStatus.PENDING, "payment_owner": self.owner},
+                {"$set": {"payment_lease_until": datetime.utcnow()}}
+            )
+
+    def full(self) -> bool:
+        return self.queue.full()
+
+    def lease_fields(self) -> Dict[str, Any]:
+        """Fields to insert a queued order with, leasing it to this process"""
+        return {"payment_owner": self.owner,
+                "payment_lease_until": datetime.utcnow() + timedelta(seconds=self.lease)}
+
+    def enqueue(self, order: Order) -> None:
+        """Queue an order inserted with ``lease_fields()``; raises QueueFull"""
+        try:
+            self.queue.put_nowait(order)
+        except asyncio.QueueFull:
+            raise QueueFull(f"Payment queue is full ({self.queue.maxsize} orders)") from None
+
+    async def join(self) -> None:
+        """Wait until every queued payment has been processed"""
+        await self.queue.join()
+
+    async def recover(self) -> int:
+        """Claim pending orders whose lease ran out and queue them, as many as fit"""
+        recovered = 0
+        while not self.queue.full():
+            now = datetime.utcnow()
+            document = await self.db.orders.find_one_and_update(
+                {"status": OrderStatus.PENDING, "payment_lease_until": {"$lt": now}},
+                {"$set": {"payment_owner": self.owner,
+                          "payment_lease_until": now + timedelta(seconds=self.lease)}},
+                projection={"_id": 0, "outbox": 0}
+            )
+            if document is None:
+                break
+            self.queue.put_nowait(Order(**document))
+            recovered += 1
+        if recovered:
+            logger.warning("Recovered %d pending payments from stopped workers", recovered)
+        return recovered
+
+    async def _recover_periodically(self) -> None:
+        while True:
+            try:
+                await self.recover()
+            except Exception:
+                logger.exception("Payment recovery failed")
+            await asyncio.sleep(self.recovery_interval)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            order = await self.queue.get()
+            try:
+                await self.process(order)
+            except Exception:
+                logger.exception("Payment worker %d failed on order %s", index, order.id)
+            finally:
+                self.queue.task_done()
+
+    async def _renew(self, order_id: str) -> bool:
+        """Extend the lease on an order; False if it is settled or another process took it"""
+        result = await self.db.orders.update_one(
+            {"id": order_id, "status": OrderStatus.PENDING, "payment_owner": self.owner},
+            {"$set": {"payment_lease_until": datetime.utcnow() + timedelta(seconds=self.lease)}}
+        )
+        return bool(result.modified_count)
+
+    async def process(self, order: Order) -> Optional[OrderStatus]:
+        """Charge the customer and settle the order status"""
+        if not await self._renew(order.id):
+            logger.info("Order %s is no longer ours to charge", order.id)
+            return None
+        try:
+            payment_result = await PaymentService.process_mobile_payment(
+                phone_number=order.phone_number,
+                amount=order.total,
+                payment_method=order.payment_method,
+                order_number=order.order_number
+            )
+        except Exception as e:
+            payment_result = {"success": False, "error": str(e), "transaction_id": None}
+
+        status = OrderStatus.CONFIRMED if payment_result["success"] else OrderStatus.CANCELLED
+        fields = {}
+        if payment_result.get("transaction_id"):
+            fields["transaction_id"] = payment_result["transaction_id"]
+        if not payment_result["success"]:
+            fields["payment_error"] = payment_result["error"]
+
+        await self.db.orders.update_one(
+            {"id": order.id, "status": OrderStatus.PENDING},
+            transition(status, OrderStatus.PENDING, datetime.utcnow(), **fields)
+        )
+        if self.inventory is not None:
+            # Keep the reserved stock once paid, put it back otherwise
+            if payment_result["success"]:
+                await self.inventory.commit(order.id)
+            else:
+                await self.inventory.release(order.id)
+
+        if payment_result["success"] and order.session_id:
+            await self.cart_store.clear(order.session_id)
+
+        return status
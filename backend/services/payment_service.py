@@ -1,14 +1,30 @@
 import asyncio
 import random
+import time
 from typing import Dict, Any
 from models.order import PaymentMethod
+from services.metrics import PAYMENT_CALLS
 
 class PaymentService:
     """
-    Service de simulation des paiements mobiles pour Moov Money et Airtel Money
-    Dans un vrai projet, ceci intégrerait les APIs réelles des opérateurs
+    Service de paiement mobile pour Moov Money et Airtel Money
+    Les opérateurs configurés (voir services/payment_providers.py) sont appelés
+    via leur adaptateur HTTP ; les autres sont simulés
     """
     
+    providers: Dict[PaymentMethod, Any] = {}
+    
+    @classmethod
+    def configure(cls, providers: Dict[PaymentMethod, Any]) -> None:
+        """Register the operator adapters, keyed on payment method"""
+        cls.providers = dict(providers)
+    
+    @classmethod
+    async def close(cls) -> None:
+        for provider in cls.providers.values():
+            await provider.aclose()
+        cls.providers = {}
+    
     @staticmethod
     async def process_mobile_payment(
         phone_number: str,
@@ -17,11 +33,8 @@ class PaymentService:
         order_number: str
     ) -> Dict[str, Any]:
         """
-        Simule le traitement d'un paiement mobile
+        Traite un paiement mobile via l'adaptateur de l'opérateur, ou le simule
         """
-        # Simulation d'un délai de traitement
-        await asyncio.sleep(2)
-        
         # Validation basique du numéro
         if not phone_number or len(phone_number.replace(' ', '')) < 8:
             return {
@@ -38,6 +51,36 @@ class PaymentService:
                 "transaction_id": None
             }
         
+        provider = PaymentService.providers.get(payment_method)
+        started = time.perf_counter()
+        try:
+            if provider is not None:
+                result = await provider.charge(phone_number, amount, order_number)
+            else:
+                result = await PaymentService._simulate_charge()
+        except Exception:
+            PAYMENT_CALLS.observe(time.perf_counter() - started, payment_method.value, "error")
+            raise
+        PAYMENT_CALLS.observe(time.perf_counter() - started, payment_method.value,
+                              "success" if result["success"] else "failure")
+        if result["success"]:
+            result.update(
+                payment_method=payment_method,
+                amount=amount,
+                phone_number=phone_number,
+                order_number=order_number,
+                message=f"Paiement de {amount:,.0f} FCFA effectué avec succès via {payment_method.upper()}"
+            )
+        return result
+    
+    @staticmethod
+    async def _simulate_charge() -> Dict[str, Any]:
+        """
+        Simule l'opérateur pour les moyens de paiement sans adaptateur configuré
+        """
+        # Simulation d'un délai de traitement
+        await asyncio.sleep(2)
+        
         # Simulation de succès/échec (90% de succès)
         success_rate = 0.9
         is_successful = random.random() < success_rate
@@ -49,12 +92,7 @@ class PaymentService:
             return {
                 "success": True,
                 "error": None,
-                "transaction_id": transaction_id,
-                "payment_method": payment_method,
-                "amount": amount,
-                "phone_number": phone_number,
-                "order_number": order_number,
-                "message": f"Paiement de {amount:,.0f} FCFA effectué avec succès via {payment_method.upper()}"
+                "transaction_id": transaction_id
             }
         else:
             # Simulation d'erreurs possibles
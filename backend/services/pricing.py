@@ -0,0 +1,99 @@
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+from models.order import OrderItem
+from services.metrics import record_cache
+
+PRICE_FIELDS = {"_id": 0, "id": 1, "name": 1, "price": 1, "image": 1, "stock": 1}
+
+
+class UnknownProductsError(ValueError):
+    def __init__(self, product_ids: List[str]):
+        super().__init__(f"Produits introuvables: {', '.join(product_ids)}")
+        self.product_ids = product_ids
+
+
+class PricingEngine:
+    """
+    Authoritative prices for carts and orders.
+
+    Prices come from the products collection through a short-TTL cache; all
+    cache misses of a request are fetched with a single ``$in`` query, so
+    repricing a cart costs at most one round trip whatever its size.
+    """
+
+    def __init__(self, db, ttl: float = 30):
+        self.db = db
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+    def invalidate(self) -> None:
+        self._entries.clear()
+
+    async def lookup(self, product_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Current name, price and image of each known product"""
+        now = time.monotonic()
+        found: Dict[str, Dict[str, Any]] = {}
+        missing = []
+        for product_id in dict.fromkeys(product_ids):
+            entry = self._entries.get(product_id)
+            if entry and entry[0] > now:
+                found[product_id] = entry[1]
+            else:
+                missing.append(product_id)
+
+        record_cache("price", hits=len(found), misses=len(missing))
+        if missing:
+            expires_at = now + self.ttl
+            async for product in self.db.products.find({"id": {"$in": missing}}, PRICE_FIELDS):
+                self._entries[product["id"]] = (expires_at, product)
+                found[product["id"]] = product
+        return found
+
+    async def price_items(self, items: Iterable[Any]) -> List[OrderItem]:
+        """Order lines priced from the catalog; only product_id and quantity are trusted"""
+        items = list(items)
+        products = await self.lookup(item.product_id for item in items)
+        unknown = [item.product_id for item in items if item.product_id not in products]
+        if unknown:
+            raise UnknownProductsError(unknown)
+
+        priced = []
+        for item in items:
+            product = products[item.product_id]
+            priced.append(OrderItem(
+                product_id=item.product_id,
+                product_name=product["name"],
+                product_price=product["price"],
+                product_image=product["image"],
+                quantity=item.quantity,
+                subtotal=product["price"] * item.quantity
+            ))
+        return priced
+
+    async def reprice_cart(self, cart: Dict[str, Any]) -> bool:
+        """Refresh item prices and totals of a cart document in place
+
+        Items whose product left the catalog are kept with their last price.
+        Returns whether anything changed.
+        """
+        products = await self.lookup(item["product_id"] for item in cart.get("items", []))
+        changed = False
+        for item in cart.get("items", []):
+            product = products.get(item["product_id"])
+            if product is None:
+                continue
+            current = {
+                "product_name": product["name"],
+                "product_price": product["price"],
+                "product_image": product["image"],
+                "subtotal": product["price"] * item["quantity"],
+            }
+            if any(item.get(key) != value for key, value in current.items()):
+                item.update(current)
+                changed = True
+        total = sum(item["subtotal"] for item in cart.get("items", []))
+        if total != cart.get("total"):
+            cart["total"] = total
+            changed = True
+        return changed
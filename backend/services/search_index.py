@@ -0,0 +1,85 @@
+import bisect
+import re
+import unicodedata
+from operator import itemgetter
+from typing import Dict, Iterable, List, Tuple
+
+from models.product import Product
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Relevance contributed by one occurrence of a term in each field
+FIELD_WEIGHTS = {"name": 3.0, "description": 1.0}
+
+# Prefix matches rank below whole-word matches
+PREFIX_PENALTY = 0.5
+MIN_PREFIX_LENGTH = 2
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents so that "Écouteurs" matches "ecouteurs" """
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return text.lower()
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(fold(text))
+
+
+class SearchIndex:
+    """
+    Inverted index over product names and descriptions.
+
+    Every query term must match (AND), either as a whole word or as a prefix
+    of one, and results are ranked by the summed field weights. Query strings
+    are tokenized, never interpreted as patterns.
+    """
+
+    def __init__(self, products: Iterable[Product]):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        for product in products:
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(getattr(product, field)):
+                    scores = self.postings.setdefault(token, {})
+                    scores[product.id] = scores.get(product.id, 0.0) + weight
+        self.terms = sorted(self.postings)
+
+    def _expand(self, term: str) -> Iterable[Tuple[str, float]]:
+        """Index tokens matching ``term`` with their score multiplier"""
+        if term in self.postings:
+            yield term, 1.0
+        if len(term) < MIN_PREFIX_LENGTH:
+            return
+        start = bisect.bisect_right(self.terms, term)
+        for token in self.terms[start:]:
+            if not token.startswith(term):
+                break
+            yield token, PREFIX_PENALTY
+
+    def search(self, query: str) -> List[Tuple[str, float]]:
+        """(product id, score) pairs, best match first"""
+        scores: Dict[str, float] = {}
+        for i, term in enumerate(dict.fromkeys(tokenize(query))):
+            matches: Dict[str, float] = {}
+            for token, multiplier in self._expand(term):
+                if not matches and multiplier == 1.0:
+                    matches = dict(self.postings[token])
+                    continue
+                for product_id, weight in self.postings[token].items():
+                    score = weight * multiplier
+                    if score > matches.get(product_id, 0.0):
+                        matches[product_id] = score
+            if i == 0:
+                scores = matches
+            else:
+                scores = {
+                    product_id: score + matches[product_id]
+                    for product_id, score in scores.items()
+                    if product_id in matches
+                }
+            if not scores:
+                break
+        ranked = sorted(scores.items(), key=itemgetter(0))
+        ranked.sort(key=itemgetter(1), reverse=True)
+        return ranked
@@ -3,7 +3,7 @@ import { Heart, ShoppingCart, Star } from 'lucide-react';
 import { Button } from './ui/button';
 import { Badge } from './ui/badge';
 import { Card, CardContent, CardFooter } from './ui/card';
-import { cartAPI, formatPrice } from '../services/api';
+import { cartAPI, formatPrice, productImage } from '../services/api';
 import { useToast } from '../hooks/use-toast';
 
 const ProductCard = ({ product }) => {
@@ -62,8 +62,9 @@ const ProductCard = ({ product }) => {
     <Card className="group overflow-hidden transition-all duration-300 hover:shadow-xl hover:-translate-y-1 border-0 bg-white/80 backdrop-blur-sm">
       <div className="relative overflow-hidden">
         <img
-          src={product.image}
+          src={productImage(product, 'card')}
           alt={product.name}
+          loading="lazy"
           className="w-full h-48 object-cover transition-transform duration-300 group-hover:scale-110"
         />
         
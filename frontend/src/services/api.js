@@ -130,6 +130,12 @@ export const formatPrice = (price) => {
   return new Intl.NumberFormat('fr-FR').format(price) + ' FCFA';
 };
 
+// Copie redimensionnée de l'image produit ('thumbnail', 'card' ou 'detail'), servie par le backend
+export const productImage = (product, variant) => {
+  const path = product.image_variants?.[variant];
+  return path ? `${BACKEND_URL}${path}` : product.image;
+};
+
 export const paymentMethods = [
   {
     id: 'moov',
@@ -0,0 +1,67 @@
+"""
+Shared fixtures. Backend modules are imported the way the server runs them,
+from the backend directory (``from services.inventory import ...``).
+
+Tests needing a real MongoDB read its URL from TEST_MONGO_URL and are skipped
+without it:
+
+    TEST_MONGO_URL=mongodb://localhost:27017 python -m pytest tests
+
+Tests using ``database`` run on mongomock, and again on that server when it is
+set.
+"""
+import contextlib
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+BACKEND = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND))
+
+
+@pytest.fixture
+def mongo_url():
+    """(server URL, name of a throwaway database dropped afterwards)"""
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        pytest.skip("needs a MongoDB server in TEST_MONGO_URL")
+    from pymongo import MongoClient
+
+    name = f"test_{uuid.uuid4().hex[:8]}"
+    yield url, name
+    with MongoClient(url) as client:
+        client.drop_database(name)
+
+
+@pytest.fixture(params=["mongomock", "mongodb"])
+def database(request):
+    """Opens a fresh database with the app's indexes, inside the test's event loop
+
+        async with database() as db:
+            ...
+    """
+    from services.indexes import ensure_indexes
+
+    if request.param == "mongomock":
+        from mongomock_motor import AsyncMongoMockClient
+
+        url, name, client_class = None, "test", AsyncMongoMockClient
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        url, name = request.getfixturevalue("mongo_url")
+        client_class = AsyncIOMotorClient
+
+    @contextlib.asynccontextmanager
+    async def open_database():
+        client = client_class(url) if url else client_class()
+        try:
+            await ensure_indexes(client[name])
+            yield client[name]
+        finally:
+            client.close()
+
+    return open_database
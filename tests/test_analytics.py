@@ -0,0 +1,207 @@
+"""
+Sales rollups of services/analytics.py. The refresh ends in ``$merge``, which
+mongomock does not run, so those tests need a real MongoDB; the day helpers
+are checked everywhere.
+"""
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from models.order import OrderStatus, PaymentMethod
+from services.analytics import (category_sales, daily_sales, day_bounds, day_expression, day_ranges,
+                                payment_method_stats, product_sales, refresh_rollups, status_counts)
+from services.indexes import ensure_indexes
+
+PRODUCTS = {
+    "robe": ("Robe Wax", "Vêtements", 15000.0),
+    "pagne": ("Pagne Kita", "Tissus", 7500.0),
+    "sac": ("Sac Raphia", "Accessoires", 22000.0),
+}
+
+
+def order(created_at: datetime, status: OrderStatus = OrderStatus.CONFIRMED,
+          method: PaymentMethod = PaymentMethod.AIRTEL_MONEY, **quantities: int):
+    items = []
+    for product_id, quantity in quantities.items():
+        name, _, price = PRODUCTS[product_id]
+        items.append({"product_id": product_id, "product_name": name, "product_price": price,
+                      "product_image": "", "quantity": quantity, "subtotal": price * quantity})
+    return {
+        "id": str(uuid.uuid4()), "order_number": f"DRB{uuid.uuid4().hex[:12].upper()}",
+        "items": items, "total": sum(item["subtotal"] for item in items),
+        "payment_method": method.value, "phone_number": "074000000", "status": status.value,
+        # Past orders: only later writes mark their day as touched
+        "created_at": created_at, "updated_at": created_at,
+    }
+
+
+def run(mongo_url, scenario):
+    url, name = mongo_url
+
+    async def main():
+        client = AsyncIOMotorClient(url)
+        try:
+            db = client[name]
+            await ensure_indexes(db)
+            await db.products.insert_many([
+                {"id": product_id, "name": name, "category": category, "price": price}
+                for product_id, (name, category, price) in PRODUCTS.items()
+            ])
+            return await scenario(db)
+        finally:
+            client.close()
+
+    return asyncio.run(main())
+
+
+def test_day_ranges_merge_consecutive_days():
+    days = ["2024-05-01", "2024-05-02", "2024-05-03", "2024-05-07", "2024-05-31", "2024-06-01"]
+    assert day_ranges(days, "UTC") == [
+        (datetime(2024, 5, 1), datetime(2024, 5, 4)),
+        (datetime(2024, 5, 7), datetime(2024, 5, 8)),
+        (datetime(2024, 5, 31), datetime(2024, 6, 2)),
+    ]
+    assert day_ranges([], "UTC") == []
+
+
+def test_day_bounds_are_local_days_in_utc():
+    # Libreville is UTC+1 all year
+    assert day_bounds("2024-05-01", "2024-05-02", "Africa/Libreville") == \
+        (datetime(2024, 4, 30, 23), datetime(2024, 5, 2, 23))
+    # A day that loses an hour to daylight saving time
+    assert day_bounds("2024-03-31", "2024-03-31", "Europe/Paris") == \
+        (datetime(2024, 3, 30, 23), datetime(2024, 3, 31, 22))
+
+
+def test_day_expression_names_the_timezone_only_when_needed():
+    assert "timezone" not in day_expression("$created_at", "UTC")["$dateToString"]
+    assert day_expression("$created_at", "Africa/Libreville")["$dateToString"]["timezone"] == "Africa/Libreville"
+
+
+def test_full_refresh_builds_every_report(mongo_url):
+    orders = [
+        order(datetime(2024, 5, 1, 9), robe=2),
+        order(datetime(2024, 5, 1, 15), OrderStatus.DELIVERED, PaymentMethod.MOOV_MONEY, pagne=1, sac=1),
+        order(datetime(2024, 5, 1, 18), OrderStatus.CANCELLED, robe=5),
+        order(datetime(2024, 5, 2, 10), OrderStatus.PENDING, PaymentMethod.MOOV_MONEY, sac=1),
+        order(datetime(2024, 5, 3, 11), OrderStatus.SHIPPED, robe=1, pagne=2),
+    ]
+
+    async def scenario(db):
+        await db.orders.insert_many(orders)
+        report = await refresh_rollups(db)
+        return (report, await daily_sales(db, "2024-05-01", "2024-05-03"),
+                await status_counts(db, "2024-05-01", "2024-05-03"),
+                await payment_method_stats(db, "2024-05-01", "2024-05-03"),
+                await product_sales(db, "2024-05-01", "2024-05-03", 2),
+                await category_sales(db, "2024-05-01", "2024-05-03"))
+
+    report, daily, statuses, methods, top, categories = run(mongo_url, scenario)
+    assert report["days"] == 3
+    assert [(day.day, day.orders, day.paid_orders, day.revenue) for day in daily] == [
+        ("2024-05-01", 3, 2, 30000.0 + 29500.0),
+        ("2024-05-02", 1, 0, 0.0),
+        ("2024-05-03", 1, 1, 30000.0),
+    ]
+    assert {count.status: (count.orders, count.amount) for count in statuses} == {
+        OrderStatus.CONFIRMED: (1, 30000.0),
+        OrderStatus.DELIVERED: (1, 29500.0),
+        OrderStatus.CANCELLED: (1, 75000.0),
+        OrderStatus.PENDING: (1, 22000.0),
+        OrderStatus.SHIPPED: (1, 30000.0),
+    }
+    methods = {method.payment_method: method for method in methods}
+    airtel, moov = methods[PaymentMethod.AIRTEL_MONEY], methods[PaymentMethod.MOOV_MONEY]
+    assert (airtel.orders, airtel.paid_orders, airtel.cancelled_orders, airtel.revenue) == (3, 2, 1, 60000.0)
+    assert airtel.success_rate == pytest.approx(2 / 3, abs=1e-4)
+    assert (moov.orders, moov.paid_orders, moov.cancelled_orders, moov.revenue) == (2, 1, 0, 29500.0)
+    assert moov.success_rate == 1.0
+    # Cancelled and pending orders sell nothing
+    assert [(sale.product_id, sale.quantity, sale.revenue, sale.category) for sale in top] == [
+        ("robe", 3, 45000.0, "Vêtements"),
+        ("pagne", 3, 22500.0, "Tissus"),
+    ]
+    assert [(sale.category, sale.quantity, sale.revenue) for sale in categories] == [
+        ("Vêtements", 3, 45000.0),
+        ("Tissus", 3, 22500.0),
+        ("Accessoires", 1, 22000.0),
+    ]
+
+
+def test_incremental_refresh_recomputes_only_touched_days(mongo_url):
+    first, second, third = (order(datetime(2024, 5, day, 12), robe=1) for day in (1, 2, 3))
+
+    async def scenario(db):
+        await db.orders.insert_many([first, second, third])
+        await refresh_rollups(db)
+        before = {row["_id"]: row["refreshed_at"] async for row in db.sales_daily.find()}
+
+        # A status change on the 2nd and a marketplace import created on the 3rd
+        await db.orders.update_one({"id": second["id"]}, {"$set": {
+            "status": OrderStatus.CANCELLED.value, "updated_at": datetime.utcnow()
+        }})
+        imported = order(datetime(2024, 5, 3, 20), sac=1)
+        imported["updated_at"] = datetime.utcnow()
+        await db.orders.insert_one(imported)
+        report = await refresh_rollups(db)
+        after = {row["_id"]: row["refreshed_at"] async for row in db.sales_daily.find()}
+        return before, report, after, await daily_sales(db, "2024-05-01", "2024-05-03")
+
+    before, report, after, daily = run(mongo_url, scenario)
+    assert report["days"] == 2
+    assert after["2024-05-01"] == before["2024-05-01"]
+    assert after["2024-05-02"] > before["2024-05-02"]
+    assert after["2024-05-03"] > before["2024-05-03"]
+    assert [(day.day, day.orders, day.paid_orders, day.revenue) for day in daily] == [
+        ("2024-05-01", 1, 1, 15000.0),
+        ("2024-05-02", 1, 0, 0.0),
+        ("2024-05-03", 2, 2, 37000.0),
+    ]
+
+
+def test_refresh_without_changes_touches_nothing(mongo_url):
+    async def scenario(db):
+        await db.orders.insert_one(order(datetime(2024, 5, 1, 12), robe=1))
+        await refresh_rollups(db)
+        return await refresh_rollups(db), await refresh_rollups(db, full=True)
+
+    incremental, full = run(mongo_url, scenario)
+    assert incremental["days"] == 0
+    assert full["days"] == 1
+
+
+def test_day_without_sales_loses_its_product_rollup(mongo_url):
+    sale = order(datetime(2024, 5, 1, 12), robe=2)
+
+    async def scenario(db):
+        await db.orders.insert_one(sale)
+        await refresh_rollups(db)
+        sold = await product_sales(db, "2024-05-01", "2024-05-01", 10)
+        await db.orders.update_one({"id": sale["id"]}, {"$set": {
+            "status": OrderStatus.CANCELLED.value, "updated_at": datetime.utcnow()
+        }})
+        await refresh_rollups(db)
+        return (sold, await product_sales(db, "2024-05-01", "2024-05-01", 10),
+                await db.sales_products_daily.count_documents({}), await status_counts(db, "2024-05-01", "2024-05-01"))
+
+    sold, unsold, product_rows, statuses = run(mongo_url, scenario)
+    assert [sale.quantity for sale in sold] == [2]
+    assert unsold == []
+    assert product_rows == 0
+    assert [(count.status, count.orders) for count in statuses] == [(OrderStatus.CANCELLED, 1)]
+
+
+def test_days_follow_the_timezone(mongo_url):
+    late = order(datetime(2024, 5, 1, 23, 30), robe=1)
+
+    async def scenario(db):
+        await db.orders.insert_one(late)
+        await refresh_rollups(db, tz="Africa/Libreville")
+        return await daily_sales(db, "2024-05-01", "2024-05-02")
+
+    daily = run(mongo_url, scenario)
+    # 23:30 UTC is half past midnight in Libreville
+    assert [(day.day, day.orders) for day in daily] == [("2024-05-02", 1)]
@@ -0,0 +1,114 @@
+"""
+MongoCartStore against a real MongoDB: the update pipelines of
+services/cart_pipelines.py must never lose a concurrent change.
+"""
+import asyncio
+import random
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from models.cart import CartItem
+from services.cart_store import ItemNotInCart, MongoCartStore
+from services.indexes import ensure_indexes
+
+PRICES = {"robe": 15000.0, "pagne": 7500.0, "sac": 22000.0}
+
+
+def cart_item(product_id: str, quantity: int) -> CartItem:
+    price = PRICES[product_id]
+    return CartItem(product_id=product_id, product_name=product_id.title(), product_price=price,
+                    product_image="", quantity=quantity, subtotal=price * quantity)
+
+
+def run(mongo_url, scenario):
+    url, name = mongo_url
+
+    async def main():
+        client = AsyncIOMotorClient(url)
+        try:
+            # The unique session index lets racing upserts converge on one cart
+            await ensure_indexes(client[name])
+            return await scenario(MongoCartStore(client[name]))
+        finally:
+            client.close()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_adds_are_all_kept(mongo_url):
+    rng = random.Random(7)
+    plan = [(rng.choice(list(PRICES)), rng.randint(1, 3)) for _ in range(300)]
+
+    async def scenario(store):
+        await asyncio.gather(*(store.add_item("s1", cart_item(product_id, quantity))
+                               for product_id, quantity in plan))
+        return await store.get("s1")
+
+    cart = run(mongo_url, scenario)
+    expected = {}
+    for product_id, quantity in plan:
+        expected[product_id] = expected.get(product_id, 0) + quantity
+    assert {item["product_id"]: item["quantity"] for item in cart["items"]} == expected
+    assert len(cart["items"]) == len(expected)
+    assert cart["total"] == pytest.approx(sum(PRICES[p] * q for p, q in expected.items()))
+    for item in cart["items"]:
+        assert item["subtotal"] == pytest.approx(item["quantity"] * item["product_price"])
+
+
+def test_concurrent_adds_create_one_cart(mongo_url):
+    async def scenario(store):
+        carts = await asyncio.gather(*(store.add_item("s2", cart_item("robe", 1)) for _ in range(50)))
+        count = await store.db.carts.count_documents({"session_id": "s2"})
+        return carts, count
+
+    carts, count = run(mongo_url, scenario)
+    assert count == 1
+    assert len({cart["id"] for cart in carts}) == 1
+    assert max(cart["items"][0]["quantity"] for cart in carts) == 50
+
+
+def test_updates_and_removals_interleaved_with_adds(mongo_url):
+    async def scenario(store):
+        await store.add_item("s3", cart_item("robe", 1))
+        await store.add_item("s3", cart_item("pagne", 1))
+        await asyncio.gather(
+            *(store.add_item("s3", cart_item("sac", 1)) for _ in range(40)),
+            *(store.set_quantity("s3", "robe", quantity) for quantity in range(1, 41)),
+            store.remove_item("s3", "pagne"),
+        )
+        return await store.get("s3")
+
+    cart = run(mongo_url, scenario)
+    quantities = {item["product_id"]: item["quantity"] for item in cart["items"]}
+    assert quantities["sac"] == 40
+    assert 1 <= quantities["robe"] <= 40
+    assert "pagne" not in quantities
+    assert cart["total"] == pytest.approx(sum(item["subtotal"] for item in cart["items"]))
+
+
+def test_set_quantity_of_missing_item(mongo_url):
+    async def scenario(store):
+        missing_cart = await store.set_quantity("nobody", "robe", 2)
+        await store.add_item("s4", cart_item("robe", 1))
+        with pytest.raises(ItemNotInCart):
+            await store.set_quantity("s4", "sac", 2)
+        return missing_cart
+
+    assert run(mongo_url, scenario) is None
+
+
+def test_product_ids_are_literals(mongo_url):
+    # An id looking like a field path must not be evaluated by the pipeline
+    PRICES["$items"] = 1000.0
+    try:
+        async def scenario(store):
+            await store.add_item("s5", cart_item("robe", 1))
+            await store.add_item("s5", cart_item("$items", 2))
+            await store.set_quantity("s5", "$items", 3)
+            return await store.get("s5")
+
+        cart = run(mongo_url, scenario)
+    finally:
+        del PRICES["$items"]
+    assert {item["product_id"]: item["quantity"] for item in cart["items"]} == {"robe": 1, "$items": 3}
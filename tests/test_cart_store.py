@@ -0,0 +1,180 @@
+"""
+HashCartStore over both hash backends: the Lua scripts of RedisCartHashes
+(run by fakeredis's Lua engine) must behave like LocalCartHashes, and the
+periodic flush must not lose carts when MongoDB fails.
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from models.cart import CartItem
+from services.cart_store import HashCartStore, ItemNotInCart, LocalCartHashes, RedisCartHashes
+
+PRICES = {"robe": 15000.0, "pagne": 7500.0, "sac": 22000.0}
+
+
+def cart_item(product_id: str, quantity: int) -> CartItem:
+    price = PRICES[product_id]
+    return CartItem(product_id=product_id, product_name=product_id.title(), product_price=price,
+                    product_image="", quantity=quantity, subtotal=price * quantity)
+
+
+def quantities(cart):
+    return [(item["product_id"], item["quantity"]) for item in cart["items"]]
+
+
+@pytest.fixture(params=["local", "redis"])
+def backend(request):
+    return request.param
+
+
+def run(backend, scenario):
+    async def main():
+        if backend == "redis":
+            client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+            hashes = RedisCartHashes("redis://fake", ttl=3600, client=client)
+        else:
+            hashes = LocalCartHashes(ttl=3600)
+        db = AsyncMongoMockClient()["carts_test"]
+        store = HashCartStore(hashes, db, flush_interval=0)
+        try:
+            return await scenario(store, db)
+        finally:
+            await store.stop()
+
+    return asyncio.run(main())
+
+
+def test_mutations(backend):
+    async def scenario(store, db):
+        await store.add_item("s", cart_item("robe", 1))
+        await store.add_item("s", cart_item("pagne", 2))
+        cart = await store.add_item("s", cart_item("robe", 2))
+        assert quantities(cart) == [("robe", 3), ("pagne", 2)]
+        assert cart["items"][0]["subtotal"] == 3 * PRICES["robe"]
+        assert cart["total"] == 3 * PRICES["robe"] + 2 * PRICES["pagne"]
+
+        cart = await store.set_quantity("s", "pagne", 5)
+        assert quantities(cart) == [("robe", 3), ("pagne", 5)]
+        with pytest.raises(ItemNotInCart):
+            await store.set_quantity("s", "sac", 1)
+
+        cart = await store.remove_item("s", "robe")
+        assert quantities(cart) == [("pagne", 5)]
+        # Items keep their insertion order after a remove and a re-add
+        cart = await store.add_item("s", cart_item("robe", 1))
+        assert quantities(cart) == [("pagne", 5), ("robe", 1)]
+        assert await store.get("s") == cart
+
+    run(backend, scenario)
+
+
+def test_missing_and_cleared_carts(backend):
+    async def scenario(store, db):
+        assert await store.get("nobody") is None
+        assert await store.set_quantity("nobody", "robe", 1) is None
+        assert await store.remove_item("nobody", "robe") is None
+
+        await store.add_item("s", cart_item("robe", 1))
+        await store.persist("s")
+        await store.clear("s")
+        assert await store.get("s") is None
+        # The tombstone answers without MongoDB and is not flushed as a cart
+        assert await store.remove_item("s", "robe") is None
+        await store.flush()
+        assert await db.carts.count_documents({}) == 0
+
+    run(backend, scenario)
+
+
+def test_carts_are_loaded_from_mongo_once(backend):
+    async def scenario(store, db):
+        await store.add_item("s", cart_item("sac", 1))
+        await store.persist("s")
+        saved = await db.carts.find_one({"session_id": "s"}, {"_id": 0})
+
+        # A restarted store with empty hashes
+        fresh = HashCartStore(LocalCartHashes(ttl=3600) if backend == "local" else RedisCartHashes(
+            "redis://fake", ttl=3600,
+            client=fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)),
+            db, flush_interval=0)
+        cart = await fresh.add_item("s", cart_item("sac", 2))
+        assert cart["id"] == saved["id"]
+        assert quantities(cart) == [("sac", 3)]
+        await fresh.stop()
+
+    run(backend, scenario)
+
+
+def test_prices_refresh_subtotals(backend):
+    async def scenario(store, db):
+        await store.add_item("s", cart_item("robe", 2))
+        cart = await store.get("s")
+        cart["items"][0].update(product_name="Robe wax", product_price=12000.0)
+        await store.save_prices("s", cart)
+        cart = await store.get("s")
+        assert cart["items"][0]["product_name"] == "Robe wax"
+        assert cart["items"][0]["subtotal"] == 24000.0
+        assert cart["total"] == 24000.0
+
+    run(backend, scenario)
+
+
+def test_concurrent_adds_are_all_kept(backend):
+    async def scenario(store, db):
+        await asyncio.gather(*(store.add_item("s", cart_item("pagne", 1)) for _ in range(50)))
+        return await store.get("s")
+
+    cart = run(backend, scenario)
+    assert quantities(cart) == [("pagne", 50)]
+
+
+def test_flush_writes_changed_carts(backend):
+    async def scenario(store, db):
+        for session in ("a", "b", "c"):
+            await store.add_item(session, cart_item("robe", 1))
+        assert await store.flush() == 3
+        assert await store.flush() == 0
+        await store.set_quantity("b", "robe", 4)
+        assert await store.flush() == 1
+        return await db.carts.find_one({"session_id": "b"})
+
+    assert run(backend, scenario)["items"][0]["quantity"] == 4
+
+
+def test_failed_flush_keeps_carts_dirty(backend):
+    async def scenario(store, db):
+        for session in ("a", "b"):
+            await store.add_item(session, cart_item("robe", 1))
+
+        async def unavailable(*args, **kwargs):
+            raise ConnectionError("MongoDB unavailable")
+
+        store.db = SimpleNamespace(carts=SimpleNamespace(bulk_write=unavailable))
+        with pytest.raises(ConnectionError):
+            await store.flush()
+        store.db = db
+        assert await store.flush() == 2
+        return await db.carts.count_documents({})
+
+    assert run(backend, scenario) == 2
+
+
+def test_redis_hashes_expire_and_track_dirty_sessions():
+    async def scenario(store, db):
+        redis = store.hashes.redis
+        await store.add_item("s", cart_item("robe", 1))
+        assert 0 < await redis.ttl("cart:s") <= 3600
+        assert await redis.smembers("carts:dirty") == {"s"}
+        item = json.loads(await redis.hget("cart:s", "item:robe"))
+        assert item["seq"] == 1
+
+        # load() never overwrites a live hash
+        await store.hashes.load("s", {"updated_at": "2020-01-01T00:00:00"})
+        assert await redis.hexists("cart:s", "meta")
+
+    run("redis", scenario)
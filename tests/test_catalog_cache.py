@@ -0,0 +1,46 @@
+"""
+CatalogCache loading the products collection, including documents stored
+before a model constraint existed.
+"""
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from models.product import ProductImport
+from services.catalog_cache import CatalogCache
+from services.catalog_loader import bulk_upsert_products
+
+
+def product(name: str, price: float, **fields) -> dict:
+    return {"id": name, "name": name.title(), "price": price, "category": "bijoux",
+            "subcategory": "colliers", "image": f"/{name}.jpg", "description": "", **fields}
+
+
+def test_invalid_documents_are_skipped():
+    async def main():
+        db = AsyncMongoMockClient()["catalog_test"]
+        await db.products.insert_many([
+            product("perles", 5000.0),
+            product("cauris", -1.0),
+            product("ancien", 3000.0, rating=9),
+        ])
+        cache = CatalogCache(db)
+        await cache.refresh()
+        return cache
+
+    cache = asyncio.run(main())
+    # A negative price is only rejected on the way in
+    assert set(cache.products) == {"perles", "cauris"}
+    assert cache.products["cauris"].price == -1.0
+
+
+def test_imports_reject_negative_prices():
+    async def main():
+        db = AsyncMongoMockClient()["catalog_test"]
+        report = await bulk_upsert_products(db, [product("perles", 5000.0), product("cauris", -1.0)])
+        return report, await db.products.distinct("id")
+
+    report, ids = asyncio.run(main())
+    assert report["rejected"] == 1
+    assert ids == ["perles"]
+    assert ProductImport(**product("perles", 0.0)).price == 0.0
@@ -0,0 +1,93 @@
+"""
+Reloading a catalog over existing products, through the row loader
+(catalog_loader) and the pandas import (catalog_io), against mongomock.
+"""
+import asyncio
+
+import pandas as pd
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services.catalog_io import import_catalog
+from services.catalog_loader import bulk_upsert_products
+from services.inventory import Inventory
+
+
+def row(product_id: str, **fields) -> dict:
+    return {"id": product_id, "name": product_id.title(), "price": 5000.0, "category": "bijoux",
+            "subcategory": "colliers", "image": f"/{product_id}.jpg", "description": "Fait main", **fields}
+
+
+async def load_with_rows(db, rows):
+    return await bulk_upsert_products(db, rows)
+
+
+async def load_with_pandas(db, rows):
+    return await import_catalog(db, iter([pd.DataFrame(rows)]))
+
+
+@pytest.fixture(params=[load_with_rows, load_with_pandas], ids=["rows", "pandas"])
+def load(request):
+    return request.param
+
+
+def run(scenario):
+    async def main():
+        return await scenario(AsyncMongoMockClient()["catalog_test"])
+
+    return asyncio.run(main())
+
+
+def test_reload_leaves_tracked_stock_alone(load):
+    async def scenario(db):
+        await load(db, [row("perles"), row("cauris"), row("wax")])
+        inventory = Inventory(db)
+        await inventory.set_stock("perles", 5)
+        await inventory.set_stock("cauris", 0)
+
+        report = await load(db, [row("perles", price=6000.0, inStock=True), row("cauris", inStock=True),
+                                 row("wax", inStock=False)])
+        products = {p["id"]: p for p in await db.products.find({}, {"_id": 0}).to_list(None)}
+        return report, products
+
+    report, products = run(scenario)
+    assert report["products"] == 3
+    assert products["perles"]["price"] == 6000.0
+    assert products["perles"]["stock"] == 5
+    # inStock follows the inventory for tracked products, the file otherwise
+    assert products["cauris"]["stock"] == 0 and products["cauris"]["inStock"] is False
+    assert products["wax"].get("stock") is None and products["wax"]["inStock"] is False
+
+
+def test_new_products_are_inserted_whole(load):
+    async def scenario(db):
+        report = await load(db, [row("perles", inStock=False)])
+        return report, await db.products.find_one({"id": "perles"}, {"_id": 0})
+
+    report, product = run(scenario)
+    assert report["inserted"] == 1 and report["products"] == 1
+    assert product["inStock"] is False
+    assert product["created_at"] and product["updated_at"]
+    assert "image_variants" not in product
+
+
+def test_unchanged_rows_keep_their_updated_at(load):
+    async def scenario(db):
+        rows = [row("perles"), row("cauris"), row("wax", inStock=False)]
+        await load(db, rows)
+        await Inventory(db).set_stock("cauris", 3)
+        before = {p["id"]: p["updated_at"] for p in await db.products.find().to_list(None)}
+
+        unchanged = await load(db, rows)
+        await asyncio.sleep(0.01)
+        rows[0]["price"] = 5500.0
+        rows[2]["inStock"] = True
+        changed = await load(db, rows)
+        after = {p["id"]: p["updated_at"] for p in await db.products.find().to_list(None)}
+        return unchanged, changed, before, after
+
+    unchanged, changed, before, after = run(scenario)
+    assert unchanged["updated"] == 0 and unchanged["inserted"] == 0 and unchanged["products"] == 3
+    assert changed["updated"] == 2
+    assert after["cauris"] == before["cauris"]
+    assert after["perles"] > before["perles"] and after["wax"] > before["wax"]
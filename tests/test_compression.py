@@ -0,0 +1,126 @@
+"""
+CompressionMiddleware on a minimal app: negotiation, the weak ETag and Vary
+of encoded responses, and the responses it must leave alone.
+"""
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from services.compression import CompressionMiddleware, negotiate
+
+PAYLOAD = [{"id": f"p{i}", "image": f"https://images.example.com/products/{i}.jpg"} for i in range(100)]
+BODY = json.dumps(PAYLOAD).encode()
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.get("/large")
+    async def large():
+        return Response(BODY, media_type="application/json",
+                        headers={"ETag": '"v1"', "Vary": "Origin"})
+
+    @app.get("/small")
+    async def small():
+        return {"id": "p1"}
+
+    @app.get("/encoded")
+    async def encoded():
+        return Response(gzip.compress(BODY), media_type="application/json",
+                        headers={"Content-Encoding": "gzip"})
+
+    @app.get("/image")
+    async def image():
+        return Response(b"\x89PNG" + bytes(4096), media_type="image/png")
+
+    @app.get("/stream")
+    async def stream():
+        return StreamingResponse(iter([BODY, BODY]), media_type="application/x-ndjson")
+
+    @app.get("/text")
+    async def text():
+        return PlainTextResponse("collier " * 500)
+
+    @app.get("/not-modified")
+    async def not_modified():
+        return Response(status_code=304, headers={"ETag": '"v1"'})
+
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    with TestClient(app) as client:
+        yield client
+
+
+def get(client, path, accept_encoding="gzip"):
+    return client.get(path, headers={"Accept-Encoding": accept_encoding})
+
+
+def test_large_json_is_gzipped(client):
+    response = get(client, "/large")
+    assert response.headers["content-encoding"] == "gzip"
+    # httpx decodes the body; the length is that of the encoded one
+    assert response.content == BODY
+    assert int(response.headers["content-length"]) < len(BODY)
+
+
+def test_encoded_response_gets_weak_etag_and_vary(client):
+    response = get(client, "/large")
+    assert response.headers["etag"] == 'W/"v1"'
+    assert response.headers.get_list("vary") == ["Origin", "Accept-Encoding"]
+
+
+def test_brotli_is_preferred():
+    pytest.importorskip("brotli")
+    app = FastAPI()
+
+    @app.get("/large")
+    async def large():
+        return Response(BODY, media_type="application/json")
+
+    app.add_middleware(CompressionMiddleware)
+    with TestClient(app) as client:
+        response = client.get("/large", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.content == BODY
+
+
+@pytest.mark.parametrize("path", ["/small", "/encoded", "/image", "/stream"])
+def test_left_alone(client, path):
+    response = get(client, path)
+    assert response.status_code == 200
+    if path == "/encoded":
+        # Passed through as is, still encoded once
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.content == BODY
+    else:
+        assert "content-encoding" not in response.headers
+        assert "accept-encoding" not in response.headers.get("vary", "").lower()
+
+
+def test_text_is_compressed(client):
+    assert get(client, "/text").headers["content-encoding"] == "gzip"
+
+
+@pytest.mark.parametrize("accept_encoding", ["identity", "gzip;q=0", "deflate"])
+def test_unacceptable_codings_are_not_used(client, accept_encoding):
+    response = get(client, "/large", accept_encoding)
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"] == '"v1"'
+
+
+def test_not_modified_validates_the_encoded_representation(client):
+    response = get(client, "/not-modified")
+    assert response.status_code == 304
+    assert response.headers["etag"] == 'W/"v1"'
+
+
+def test_negotiate():
+    assert negotiate("gzip, br", ("br", "gzip")) == "br"
+    assert negotiate("br;q=0.5, gzip", ("br", "gzip")) == "gzip"
+    assert negotiate("*", ("br", "gzip")) == "br"
+    assert negotiate("*;q=0, gzip", ("br", "gzip")) == "gzip"
+    assert negotiate("identity", ("br", "gzip")) is None
@@ -0,0 +1,106 @@
+"""
+CatalogHttpCache on a minimal app: validators on catalog responses and 304s
+for conditional GETs, answered without running the route.
+"""
+from datetime import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.catalog_cache import CatalogVersion
+from services.http_cache import CatalogHttpCache, etag_for
+
+LAST_MODIFIED = datetime(2026, 3, 1, 12, 30, 15, 250000)
+
+
+class Catalog:
+    """Stands in for CatalogCache: only its version is read"""
+
+    def __init__(self):
+        self.version = CatalogVersion("abc123", LAST_MODIFIED)
+        self.refreshes = 0
+
+    async def ensure_fresh(self):
+        self.refreshes += 1
+
+
+@pytest.fixture
+def catalog():
+    return Catalog()
+
+
+@pytest.fixture
+def client(catalog):
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.get("/api/products")
+    async def products():
+        app.state.calls += 1
+        return [{"id": "p1"}]
+
+    @app.get("/api/products/export")
+    async def export():
+        return {"streamed": True}
+
+    @app.get("/api/cart/{session_id}")
+    async def cart(session_id: str):
+        return {"session_id": session_id}
+
+    app.add_middleware(CatalogHttpCache, get_catalog=lambda: catalog, max_age=60, stale_while_revalidate=300)
+    with TestClient(app) as client:
+        yield client
+
+
+def test_catalog_responses_carry_validators(client, catalog):
+    response = client.get("/api/products")
+    assert response.status_code == 200
+    assert response.headers["etag"] == '"abc123"'
+    assert response.headers["last-modified"] == "Sun, 01 Mar 2026 12:30:15 GMT"
+    assert response.headers["cache-control"] == "public, max-age=60, stale-while-revalidate=300"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert catalog.refreshes == 1
+
+
+@pytest.mark.parametrize("if_none_match", ['"abc123"', 'W/"abc123"', '"old", "abc123"', "*"])
+def test_matching_etag_is_not_modified(client, if_none_match):
+    response = client.get("/api/products", headers={"If-None-Match": if_none_match})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == '"abc123"'
+    assert client.app.state.calls == 0
+
+
+def test_changed_catalog_is_sent_again(client, catalog):
+    etag = client.get("/api/products").headers["etag"]
+    catalog.version = CatalogVersion("def456", datetime(2026, 3, 2))
+    response = client.get("/api/products", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] == etag_for(catalog.version)
+    assert client.app.state.calls == 2
+
+
+@pytest.mark.parametrize("since, status", [
+    ("Sun, 01 Mar 2026 12:30:15 GMT", 304),
+    ("Mon, 02 Mar 2026 00:00:00 GMT", 304),
+    ("Sun, 01 Mar 2026 12:30:14 GMT", 200),
+    ("not a date", 200),
+])
+def test_if_modified_since(client, since, status):
+    assert client.get("/api/products", headers={"If-Modified-Since": since}).status_code == status
+
+
+def test_if_none_match_takes_precedence(client):
+    response = client.get("/api/products", headers={
+        "If-None-Match": '"old"', "If-Modified-Since": "Mon, 02 Mar 2026 00:00:00 GMT"})
+    assert response.status_code == 200
+
+
+def test_other_routes_are_left_alone(client, catalog):
+    for path in ("/api/products/export", "/api/cart/s1"):
+        response = client.get(path, headers={"If-None-Match": '"abc123"'})
+        assert response.status_code == 200
+        assert "etag" not in response.headers
+    assert client.post("/api/products", headers={"If-None-Match": "*"}).status_code == 405
+    assert catalog.refreshes == 0
@@ -0,0 +1,52 @@
+"""
+IdempotencyStore with two stores over one database, standing for two workers.
+"""
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from services.idempotency import IdempotencyStore, StoredResponse
+
+LEASE = 0.1
+
+
+def test_slow_request_keeps_its_claim():
+    calls = []
+
+    def work(duration):
+        async def attempt():
+            calls.append(duration)
+            await asyncio.sleep(duration)
+            return StoredResponse(200, b'{"ok":true}', "application/json")
+        return attempt
+
+    async def main():
+        db = AsyncMongoMockClient()["idempotency_test"]
+        first = IdempotencyStore(db, lease=LEASE, poll_interval=0.01)
+        retry = IdempotencyStore(db, lease=LEASE, poll_interval=0.01)
+        running = asyncio.create_task(first.run("orders", "k", "f", work(5 * LEASE)))
+        await asyncio.sleep(2 * LEASE)
+        # The first attempt has outlived its initial lease but is still renewing it
+        replay = await retry.run("orders", "k", "f", work(0))
+        return await running, replay
+
+    (response, replayed), (replay, replay_replayed) = asyncio.run(main())
+    assert calls == [5 * LEASE]
+    assert not replayed and replay_replayed
+    assert replay == response
+
+
+def test_dead_worker_is_taken_over():
+    async def main():
+        db = AsyncMongoMockClient()["idempotency_test"]
+        dead = IdempotencyStore(db, lease=LEASE)
+        # A claim nobody renews, as left by a worker that died mid-request
+        assert await dead._claim("orders:k", "f") is not None
+        await asyncio.sleep(1.5 * LEASE)
+
+        async def attempt():
+            return StoredResponse(201, b"{}", "application/json")
+
+        return await IdempotencyStore(db, lease=LEASE, poll_interval=0.01).run("orders", "k", "f", attempt)
+
+    assert asyncio.run(main()) == (StoredResponse(201, b"{}", "application/json"), False)
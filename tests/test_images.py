@@ -0,0 +1,150 @@
+"""
+ImageStore: resizing, the content-addressed disk cache and its hit/miss path,
+on the images in tests/fixtures.
+"""
+import asyncio
+from pathlib import Path
+
+import httpx
+import pytest
+from PIL import Image
+
+from models.product import IMAGE_VARIANTS
+from services.images import IMAGE_FORMATS, ImageSourceError, ImageStore
+from services.metrics import CACHE_REQUESTS
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+def cache_counts():
+    values = dict(CACHE_REQUESTS._values)
+    return values.get(("image", "hit"), 0), values.get(("image", "miss"), 0)
+
+
+def run(tmp_path, scenario, **options):
+    async def main():
+        store = ImageStore(tmp_path / "cache", FIXTURES, workers=1, **options)
+        try:
+            return await scenario(store)
+        finally:
+            await store.close()
+
+    return asyncio.run(main())
+
+
+def test_renders_every_variant_and_format(tmp_path):
+    async def scenario(store):
+        return await store.variant("photo.jpg", "card", "webp")
+
+    path = run(tmp_path, scenario)
+    with Image.open(path) as image:
+        assert image.format == "WEBP"
+        # The fixture is 1500x1000 and tagged to display rotated a quarter turn
+        assert image.size == (320, 480)
+
+    digest = path.name.split("-")[0]
+    for variant, size in IMAGE_VARIANTS.items():
+        for fmt, (extension, _, pil_format) in IMAGE_FORMATS.items():
+            rendered = path.parent / f"{digest}-{variant}.{extension}"
+            with Image.open(rendered) as image:
+                assert image.format == pil_format
+                assert max(image.size) == min(size, 1500)
+                assert image.mode == "RGB"
+
+
+def test_transparency_is_flattened_on_white(tmp_path):
+    async def scenario(store):
+        return await store.variant("alpha.png", "thumbnail", "jpeg")
+
+    with Image.open(run(tmp_path, scenario)) as image:
+        assert image.size == (160, 80)
+        red, green, blue = image.getpixel((150, 5))
+        assert min(red, green, blue) > 240
+
+
+def test_second_request_is_a_cache_hit(tmp_path):
+    async def scenario(store):
+        first = await store.variant("photo.jpg", "detail", "jpeg")
+        after_miss = cache_counts()
+
+        async def no_ingest(url, url_key):
+            raise AssertionError("a cached variant was rendered again")
+
+        store._ingest = no_ingest
+        second = await store.variant("photo.jpg", "detail", "jpeg")
+        other_format = await store.variant("photo.jpg", "thumbnail", "webp")
+        return first, second, other_format, after_miss
+
+    hits, misses = cache_counts()
+    first, second, other_format, after_miss = run(tmp_path, scenario)
+    assert first == second
+    assert other_format.exists()
+    assert after_miss == (hits, misses + 1)
+    assert cache_counts() == (hits + 2, misses + 1)
+
+
+def test_cache_survives_a_new_store(tmp_path):
+    async def render(store):
+        return await store.variant("photo.jpg", "card", "jpeg")
+
+    first = run(tmp_path, render)
+    hits, misses = cache_counts()
+    assert run(tmp_path, render) == first
+    assert cache_counts() == (hits + 1, misses)
+
+
+def test_concurrent_misses_fetch_once(tmp_path):
+    source = (FIXTURES / "photo.jpg").read_bytes()
+    fetches = []
+
+    def handler(request):
+        fetches.append(str(request.url))
+        return httpx.Response(200, content=source)
+
+    async def scenario(store):
+        return await asyncio.gather(*(
+            store.variant("https://cdn.example/photo.jpg", variant, "webp")
+            for variant in list(IMAGE_VARIANTS) * 3
+        ))
+
+    paths = run(tmp_path, scenario, transport=httpx.MockTransport(handler))
+    assert fetches == ["https://cdn.example/photo.jpg"]
+    assert all(path.exists() for path in paths)
+
+
+def test_same_bytes_share_variants(tmp_path):
+    def handler(request):
+        return httpx.Response(200, content=(FIXTURES / "photo.jpg").read_bytes())
+
+    async def scenario(store):
+        remote = await store.variant("https://cdn.example/a.jpg", "card", "webp")
+        local = await store.variant("photo.jpg", "card", "webp")
+        return remote, local
+
+    remote, local = run(tmp_path, scenario, transport=httpx.MockTransport(handler))
+    assert remote == local
+
+
+@pytest.mark.parametrize("url", ["broken.jpg", "missing.jpg", "../conftest.py", "/etc/hostname"])
+def test_unusable_sources_are_rejected(tmp_path, url):
+    async def scenario(store):
+        with pytest.raises(ImageSourceError):
+            await store.variant(url, "card", "webp")
+
+    run(tmp_path, scenario)
+    # Nothing is recorded for the url, so a fixed source is picked up later
+    assert not (tmp_path / "cache" / "urls").exists()
+
+
+def test_oversized_and_failing_remote_sources(tmp_path):
+    def handler(request):
+        if request.url.path == "/gone.jpg":
+            return httpx.Response(404)
+        return httpx.Response(200, content=b"\0" * 4096)
+
+    async def scenario(store):
+        for url in ("https://cdn.example/big.jpg", "https://cdn.example/gone.jpg"):
+            with pytest.raises(ImageSourceError):
+                await store.variant(url, "card", "webp")
+
+    run(tmp_path, scenario, max_source_bytes=1024, transport=httpx.MockTransport(handler))
@@ -0,0 +1,175 @@
+"""
+Inventory under concurrent checkouts: reservations never oversell, whether
+stock sits on the product or is spread over shard counters, and units come
+back exactly once however a reservation ends.
+"""
+import asyncio
+
+import pytest
+
+from services.inventory import COMMITTED, HELD, RELEASED, Inventory, OutOfStock
+
+
+def product(product_id: str, **fields) -> dict:
+    return {"id": product_id, "name": product_id.title(), "price": 5000.0, "category": "bijoux",
+            "subcategory": "colliers", "image": "", "description": "", "inStock": True, **fields}
+
+
+def run(database, scenario, reservation_ttl: float = 900):
+    async def main():
+        async with database() as db:
+            await db.products.insert_many([product("perles"), product("cauris"), product("wax")])
+            return await scenario(Inventory(db, reservation_ttl=reservation_ttl), db)
+
+    return asyncio.run(main())
+
+
+async def attempt(inventory, order_id, lines):
+    try:
+        return await inventory.reserve(order_id, lines)
+    except OutOfStock:
+        return None
+
+
+async def stock(inventory, product_id):
+    return (await inventory.stock_level(product_id))[0]
+
+
+def test_concurrent_reservations_on_the_last_unit(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 1)
+        results = await asyncio.gather(*(attempt(inventory, f"o{i}", [("perles", 1)]) for i in range(20)))
+        return results, await stock(inventory, "perles"), await db.inventory_reservations.count_documents({})
+
+    results, left, reservations = run(database, scenario)
+    assert sum(result is not None for result in results) == 1
+    assert left == 0
+    assert reservations == 1
+
+
+def test_shard_race_never_oversells(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 21, shards=4)
+        results = await asyncio.gather(*(attempt(inventory, f"o{i}", [("perles", 2)]) for i in range(15)))
+        counters = await db.inventory_shards.find({"product_id": "perles"}).to_list(None)
+        return results, counters
+
+    results, counters = run(database, scenario)
+    taken = [sum(line["quantity"] for line in lines) for lines in results if lines is not None]
+    assert taken == [2] * 10
+    # The odd unit is left in one counter; none went negative
+    assert sorted(counter["stock"] for counter in counters) == [0, 0, 0, 1]
+
+
+def test_lines_are_taken_all_or_nothing(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 5)
+        await inventory.set_stock("cauris", 2, shards=2)
+        with pytest.raises(OutOfStock) as error:
+            await inventory.reserve("o1", [("perles", 3), ("cauris", 1), ("cauris", 2)])
+        levels = [await stock(inventory, "perles"), await stock(inventory, "cauris")]
+        return error.value.product_ids, levels, await db.inventory_reservations.count_documents({})
+
+    short, levels, reservations = run(database, scenario)
+    assert short == ["cauris"]
+    assert levels == [5, 2]
+    assert reservations == 0
+
+
+def test_untracked_products_are_not_reserved(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 1)
+        taken = await inventory.reserve("o1", [("wax", 50), ("perles", 1)])
+        return taken, await stock(inventory, "wax")
+
+    taken, wax = run(database, scenario)
+    assert taken == [{"product_id": "perles", "shard": None, "quantity": 1}]
+    assert wax is None
+
+
+def test_release_restocks_once(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 3)
+        await inventory.reserve("o1", [("perles", 2)])
+        released = await asyncio.gather(*(inventory.release("o1") for _ in range(5)))
+        # Paid too late: the units are already back on sale
+        committed = await inventory.commit("o1")
+        return released, committed, await stock(inventory, "perles")
+
+    released, committed, left = run(database, scenario)
+    assert sorted(released) == [False] * 4 + [True]
+    assert committed is False
+    assert left == 3
+
+
+def test_cancelled_paid_order_restocks_exactly_once(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 4)
+        await inventory.set_stock("cauris", 6, shards=3)
+        await inventory.reserve("o1", [("perles", 3), ("cauris", 4)])
+        assert await inventory.commit("o1")
+        cancelled = await asyncio.gather(*(inventory.cancel(["o1"]) for _ in range(5)))
+        # Neither a later release nor the sweeper gives the units back again
+        assert not await inventory.release("o1")
+        await inventory.release_expired()
+        reservation = await db.inventory_reservations.find_one({"_id": "o1"})
+        return cancelled, reservation["state"], [await stock(inventory, "perles"), await stock(inventory, "cauris")]
+
+    cancelled, state, levels = run(database, scenario)
+    assert sum(cancelled) == 1
+    assert state == RELEASED
+    assert levels == [4, 6]
+
+
+def test_expired_reservations_are_released(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 2)
+        await inventory.reserve("o1", [("perles", 2)])
+        await asyncio.sleep(0.01)
+        released = await inventory.release_expired()
+        return released, await stock(inventory, "perles"), (await db.inventory_reservations.find_one())["state"]
+
+    assert run(database, scenario, reservation_ttl=0) == (1, 2, RELEASED)
+
+
+def test_committed_reservations_do_not_expire(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 2)
+        await inventory.reserve("o1", [("perles", 1)])
+        await inventory.commit("o1")
+        await asyncio.sleep(0.01)
+        return await inventory.release_expired(), await stock(inventory, "perles")
+
+    assert run(database, scenario, reservation_ttl=0) == (0, 1)
+
+
+def test_snapshots_follow_the_shards(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 2, shards=2)
+        await inventory.set_stock("cauris", 1)
+        await inventory.reserve("o1", [("perles", 2), ("cauris", 1)])
+        await inventory.refresh_snapshots()
+        products = {p["id"]: p for p in await db.products.find({}, {"_id": 0}).to_list(None)}
+        stamps = {product_id: p.get("updated_at") for product_id, p in products.items()}
+
+        # A second sweep with nothing changed leaves the catalog version alone
+        await inventory.refresh_snapshots()
+        again = {p["id"]: p.get("updated_at") for p in await db.products.find({}, {"_id": 0}).to_list(None)}
+        return products, stamps, again
+
+    products, stamps, again = run(database, scenario)
+    assert products["perles"]["stock"] == 0 and products["perles"]["inStock"] is False
+    assert products["cauris"]["stock"] == 0 and products["cauris"]["inStock"] is False
+    assert products["wax"]["inStock"] is True
+    assert again == stamps
+
+
+def test_reservation_states(database):
+    async def scenario(inventory, db):
+        await inventory.set_stock("perles", 5)
+        await inventory.reserve("o1", [("perles", 1)])
+        held = (await db.inventory_reservations.find_one({"_id": "o1"}))["state"]
+        await inventory.commit("o1")
+        return held, (await db.inventory_reservations.find_one({"_id": "o1"}))["state"]
+
+    assert run(database, scenario) == (HELD, COMMITTED)
@@ -0,0 +1,71 @@
+"""
+Metrics recorded outside the /metrics route itself: payment latency and the
+route label of HTTP requests.
+"""
+import asyncio
+from datetime import datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from models.order import PaymentMethod
+from services import payment_service
+from services.catalog_cache import CatalogVersion
+from services.http_cache import CatalogHttpCache, etag_for
+from services.metrics import HTTP_REQUESTS, PAYMENT_CALLS, RequestMetricsMiddleware
+from services.payment_service import PaymentService
+
+
+def observations(histogram, *labels) -> int:
+    series = histogram._series.get(labels)
+    return sum(series[0]) if series else 0
+
+
+def test_simulated_payments_are_timed(monkeypatch):
+    async def no_delay(seconds):
+        pass
+
+    monkeypatch.setattr(payment_service.asyncio, "sleep", no_delay)
+    monkeypatch.setattr(payment_service.random, "random", lambda: 0.0)
+    monkeypatch.setattr(PaymentService, "providers", {})
+    before = observations(PAYMENT_CALLS, "moov", "success")
+
+    result = asyncio.run(PaymentService.process_mobile_payment(
+        "01234567", 1000, PaymentMethod.MOOV_MONEY, "DRB0001"))
+    assert result["success"] and result["order_number"] == "DRB0001"
+    assert observations(PAYMENT_CALLS, "moov", "success") == before + 1
+
+
+class Catalog:
+    """Stands in for CatalogCache in CatalogHttpCache"""
+
+    def __init__(self):
+        self.version = CatalogVersion("v1", datetime(2026, 1, 1))
+
+    async def ensure_fresh(self):
+        pass
+
+
+def test_requests_answered_by_middleware_keep_their_route():
+    catalog = Catalog()
+    app = FastAPI()
+
+    @app.get("/api/products/{product_id}")
+    async def product(product_id: str):
+        return {"id": product_id}
+
+    app.add_middleware(CatalogHttpCache, get_catalog=lambda: catalog)
+    app.add_middleware(RequestMetricsMiddleware)
+    labels = ("GET", "/api/products/{product_id}")
+    before = {status: observations(HTTP_REQUESTS, *labels, status) for status in (200, 304)}
+    unmatched = observations(HTTP_REQUESTS, "GET", "unmatched", 404)
+
+    with TestClient(app) as client:
+        assert client.get("/api/products/p1").status_code == 200
+        etag = etag_for(catalog.version)
+        assert client.get("/api/products/p1", headers={"If-None-Match": etag}).status_code == 304
+        assert client.get("/api/nowhere").status_code == 404
+
+    assert observations(HTTP_REQUESTS, *labels, 200) == before[200] + 1
+    assert observations(HTTP_REQUESTS, *labels, 304) == before[304] + 1
+    assert observations(HTTP_REQUESTS, "GET", "unmatched", 404) == unmatched + 1
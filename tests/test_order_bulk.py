@@ -0,0 +1,178 @@
+"""
+Bulk order status transitions and marketplace imports: each order changes
+once with one event, however many writers race for it, and re-sent imports
+insert nothing twice.
+"""
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from models.order import OrderFilter, OrderStatus
+from services.inventory import Inventory
+from services.order_bulk import import_orders, transition_orders
+from services.outbox import ORDER_CREATED, ORDER_STATUS_CHANGED
+
+PENDING, CONFIRMED, PROCESSING, CANCELLED = (
+    OrderStatus.PENDING, OrderStatus.CONFIRMED, OrderStatus.PROCESSING, OrderStatus.CANCELLED)
+
+
+def order(order_id: str, status: OrderStatus, session_id: str = "s1") -> dict:
+    return {"id": order_id, "order_number": f"DRB{order_id.upper()}", "session_id": session_id,
+            "status": status, "created_at": datetime(2026, 5, 1), "outbox": []}
+
+
+def run(database, scenario, orders=()):
+    async def main():
+        async with database() as db:
+            if orders:
+                await db.orders.insert_many(list(orders))
+            return await scenario(db)
+
+    return asyncio.run(main())
+
+
+def outcomes(result):
+    return {item.order_id: (item.updated, item.error) for item in result.results}
+
+
+def test_transitions_by_id(database):
+    async def scenario(db):
+        result = await transition_orders(db, PROCESSING, ["a", "b", "a", "missing"])
+        return result, await db.orders.find_one({"id": "a"}), await db.orders.find_one({"id": "b"})
+
+    result, a, b = run(database, scenario, [order("a", CONFIRMED), order("b", PENDING)])
+    assert outcomes(result) == {
+        "a": (True, None),
+        "b": (False, "Cannot move from pending to processing"),
+        "missing": (False, "Order not found"),
+    }
+    assert result.matched == 2 and result.updated == 1
+    assert a["status"] == PROCESSING and b["status"] == PENDING
+    (event,) = a["outbox"]
+    assert (event["type"], event["status"], event["previous_status"]) == (
+        ORDER_STATUS_CHANGED, PROCESSING, CONFIRMED)
+    assert b["outbox"] == []
+
+
+def test_pending_orders_are_only_confirmed_by_payment(database):
+    async def scenario(db):
+        return await transition_orders(db, CONFIRMED, ["a"])
+
+    assert outcomes(run(database, scenario, [order("a", PENDING)])) == {
+        "a": (False, "Cannot move from pending to confirmed")}
+
+
+def test_transitions_by_filter(database):
+    async def scenario(db):
+        result = await transition_orders(db, CANCELLED, order_filter=OrderFilter(session_id="s1"))
+        statuses = {o["id"]: o["status"] for o in await db.orders.find().to_list(None)}
+        return result, statuses
+
+    result, statuses = run(database, scenario, [
+        order("a", PENDING), order("b", CONFIRMED), order("c", OrderStatus.DELIVERED), order("d", PENDING, "s2")])
+    # Only orders the transition applies to are selected
+    assert outcomes(result) == {"a": (True, None), "b": (True, None)}
+    assert statuses == {"a": CANCELLED, "b": CANCELLED, "c": OrderStatus.DELIVERED, "d": PENDING}
+
+
+def test_racing_transitions_change_each_order_once(database):
+    ids = [f"o{i}" for i in range(20)]
+
+    async def scenario(db):
+        results = await asyncio.gather(*(transition_orders(db, CANCELLED, ids) for _ in range(4)))
+        orders = await db.orders.find({}, {"_id": 0, "id": 1, "outbox": 1}).to_list(None)
+        return results, orders
+
+    results, orders = run(database, scenario, [order(order_id, PENDING) for order_id in ids])
+    for order_id in ids:
+        winners = [result for result in results if outcomes(result)[order_id] == (True, None)]
+        assert len(winners) == 1
+        for result in results:
+            if result is not winners[0]:
+                assert outcomes(result)[order_id][0] is False
+    assert sum(result.updated for result in results) == 20
+    assert all(len(o["outbox"]) == 1 for o in orders)
+
+
+def test_orders_changed_between_read_and_write_are_not_claimed(database):
+    class Orders:
+        """db.orders, with another writer cancelling ``b`` just before the bulk write"""
+
+        def __init__(self, db):
+            self.db = db
+
+        def find(self, *args, **kwargs):
+            return self.db.orders.find(*args, **kwargs)
+
+        async def bulk_write(self, *args, **kwargs):
+            await transition_orders(self.db, CANCELLED, ["b"])
+            return await self.db.orders.bulk_write(*args, **kwargs)
+
+    async def scenario(db):
+        return await transition_orders(SimpleNamespace(orders=Orders(db)), CANCELLED, ["a", "b"])
+
+    result = run(database, scenario, [order("a", PENDING), order("b", PENDING)])
+    assert outcomes(result) == {"a": (True, None), "b": (False, "Status changed concurrently")}
+    assert result.updated == 1
+
+
+def test_cancelled_orders_restock_once(database):
+    async def scenario(db):
+        inventory = Inventory(db)
+        await db.products.insert_one({"id": "perles", "stock": 0})
+        await inventory.set_stock("perles", 5)
+        await inventory.reserve("a", [("perles", 2)])
+        await inventory.reserve("b", [("perles", 3)])
+        await inventory.commit("b")
+        await asyncio.gather(*(transition_orders(db, CANCELLED, ["a", "b"], inventory=inventory)
+                               for _ in range(3)))
+        return (await inventory.stock_level("perles"))[0]
+
+    assert run(database, scenario, [order("a", PENDING), order("b", PENDING)]) == 5
+
+
+def import_row(order_number: str, **fields) -> dict:
+    return {"order_number": order_number, "payment_method": "moov", "phone_number": "01234567",
+            "items": [{"product_id": "perles", "product_name": "Perles", "product_price": 2500.0,
+                       "quantity": 2}], **fields}
+
+
+def test_imports_are_idempotent(database):
+    rows = [
+        import_row("JUMIA-1", created_at="2026-04-30T10:00:00"),
+        import_row("JUMIA-2", status="delivered"),
+        import_row("JUMIA-1"),
+        {"order_number": "JUMIA-3", "items": []},
+    ]
+
+    async def scenario(db):
+        first = await import_orders(db, rows)
+        again = await import_orders(db, rows[:2])
+        stored = await db.orders.find_one({"order_number": "JUMIA-1"})
+        return first, again, stored, await db.orders.count_documents({})
+
+    first, again, stored, count = run(database, scenario)
+    assert [result.result for result in first.results] == ["inserted", "inserted", "rejected", "rejected"]
+    assert first.results[2].error == "Duplicate order_number in batch"
+    assert (again.inserted, again.existing) == (0, 2)
+    assert again.results[0].order_id == first.results[0].order_id == stored["id"]
+    assert count == 2
+    assert stored["total"] == 5000.0 and stored["status"] == CONFIRMED
+    assert stored["created_at"] == datetime(2026, 4, 30, 10)
+    # updated_at is the import time, so incremental rollups pick the order up
+    assert stored["updated_at"] > stored["created_at"]
+    (event,) = stored["outbox"]
+    assert event["type"] == ORDER_CREATED and event["previous_status"] is None
+
+
+def test_concurrent_imports_insert_once(database):
+    rows = [import_row(f"JUMIA-{i}") for i in range(30)]
+
+    async def scenario(db):
+        reports = await asyncio.gather(*(import_orders(db, rows) for _ in range(3)))
+        return reports, await db.orders.count_documents({})
+
+    reports, count = run(database, scenario)
+    assert sum(report.inserted for report in reports) == 30
+    assert sum(report.existing for report in reports) == 60
+    assert count == 30
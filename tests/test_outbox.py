@@ -0,0 +1,177 @@
+"""
+OutboxRelay delivering order events: at least once across relay crashes,
+once per chunk across competing relays, and without one bad order holding
+the others back.
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from models.order import OrderStatus
+from services.outbox import ORDER_CREATED, OutboxRelay, order_event, transition
+
+
+def order(order_id: str) -> dict:
+    return {"id": order_id, "order_number": f"DRB{order_id.upper()}", "user_id": None, "session_id": "s",
+            "phone_number": "01234567", "payment_method": "moov", "total": 5000.0,
+            "status": OrderStatus.PENDING,
+            "outbox": [order_event(ORDER_CREATED, OrderStatus.PENDING, None, datetime.utcnow())]}
+
+
+class Sink:
+    """Records delivered chunks; rejects those holding an order in ``rejected``"""
+
+    def __init__(self, rejected=(), down=False):
+        self.chunks = []
+        self.rejected = set(rejected)
+        self.down = down
+
+    async def __call__(self, events):
+        await asyncio.sleep(0)
+        if self.down or any(event["order_id"] in self.rejected for event in events):
+            raise ConnectionError("webhook rejected the chunk")
+        self.chunks.append(events)
+
+    @property
+    def event_ids(self):
+        return [event["event_id"] for chunk in self.chunks for event in chunk]
+
+
+def run(database, scenario, orders=("a", "b", "c")):
+    async def main():
+        async with database() as db:
+            await db.orders.insert_many([order(order_id) for order_id in orders])
+            return await scenario(db)
+
+    return asyncio.run(main())
+
+
+async def pending(db):
+    return await db.orders.count_documents({"outbox.id": {"$exists": True}})
+
+
+def test_events_are_delivered_and_pulled(database):
+    async def scenario(db):
+        sink = Sink()
+        relay = OutboxRelay(db, sink, batch_size=2)
+        delivered = [await relay.relay_once() for _ in range(3)]
+        return sink, delivered, await pending(db), await db.orders.find_one({"id": "a"})
+
+    sink, delivered, left, order_a = run(database, scenario)
+    assert delivered == [2, 1, 0]
+    assert sorted(event["order_id"] for chunk in sink.chunks for event in chunk) == ["a", "b", "c"]
+    event = sink.chunks[0][0]
+    assert event["type"] == ORDER_CREATED and event["status"] == "pending" and event["previous_status"] is None
+    assert left == 0
+    assert "outbox_claimed_by" not in order_a and "outbox_attempts" not in order_a
+
+
+def test_events_queued_during_delivery_are_kept(database):
+    async def scenario(db):
+        class Racing(Sink):
+            async def __call__(self, events):
+                # A status change lands while the chunk is in flight
+                await db.orders.update_one({"id": "a", "status": OrderStatus.PENDING}, transition(
+                    OrderStatus.CANCELLED, OrderStatus.PENDING, datetime.utcnow()))
+                await super().__call__(events)
+
+        sink = Racing()
+        relay = OutboxRelay(db, sink)
+        await relay.relay_once()
+        relay.sink = Sink()
+        await relay.relay_once()
+        return relay.sink.chunks
+
+    (later,) = run(database, scenario)
+    assert [(event["order_id"], event["previous_status"], event["status"]) for event in later] == [
+        ("a", "pending", "cancelled")]
+
+
+def test_crash_before_ack_is_redelivered_after_the_lease(database):
+    async def scenario(db):
+        class Crashing(Sink):
+            async def __call__(self, events):
+                await super().__call__(events)
+                # The worker dies after the webhook took the chunk, before the pull
+                raise asyncio.CancelledError
+
+        crashing = Crashing()
+        with pytest.raises(asyncio.CancelledError):
+            await OutboxRelay(db, crashing, claim_lease=0.2).relay_once()
+
+        sink = Sink()
+        relay = OutboxRelay(db, sink, claim_lease=0.2)
+        during_lease = await relay.relay_once()
+        await asyncio.sleep(0.3)
+        after_lease = await relay.relay_once()
+        return crashing.event_ids, sink.event_ids, during_lease, after_lease, await pending(db)
+
+    crashed, redelivered, during_lease, after_lease, left = run(database, scenario)
+    assert during_lease == 0 and after_lease == 3
+    # At least once: the same event ids, for consumers to deduplicate
+    assert sorted(redelivered) == sorted(crashed)
+    assert left == 0
+
+
+def test_competing_relays_deliver_each_order_once(database):
+    async def scenario(db):
+        sink = Sink()
+        relays = [OutboxRelay(db, sink, batch_size=5) for _ in range(4)]
+        while await pending(db):
+            await asyncio.gather(*(relay.relay_once() for relay in relays))
+        return sink
+
+    orders = [f"o{i}" for i in range(40)]
+    sink = run(database, scenario, orders)
+    assert sorted(sink.event_ids) == sorted(set(sink.event_ids))
+    assert len(sink.event_ids) == 40
+
+
+def test_poison_order_is_set_aside(database):
+    async def scenario(db):
+        sink = Sink(rejected={"b"})
+        relay = OutboxRelay(db, sink, max_attempts=3)
+        delivered, attempts = [], []
+        for step in range(3):
+            if step:
+                # Fresh orders keep arriving, so the sink is seen working
+                await db.orders.insert_one(order(f"new{step}"))
+            delivered.append(await relay.relay_once())
+            attempts.append((await db.orders.find_one({"id": "b"})).get("outbox_attempts"))
+        return sink, delivered, attempts, await db.orders.find_one({"id": "b"}), await pending(db)
+
+    sink, delivered, attempts, poison, left = run(database, scenario)
+    assert delivered == [2, 1, 1]
+    assert attempts == [1, 2, None]
+    assert "b" not in {event["order_id"] for chunk in sink.chunks for event in chunk}
+    assert poison["outbox"] == [] and len(poison["outbox_failed"]) == 1
+    assert "outbox_claimed_by" not in poison
+    assert left == 0
+
+
+def test_lone_failing_order_is_retried(database):
+    async def scenario(db):
+        relay = OutboxRelay(db, Sink(rejected={"a"}), max_attempts=1)
+        with pytest.raises(ConnectionError):
+            await relay.relay_once()
+        # Alone in its chunk it cannot be told from the sink being down
+        return await db.orders.find_one({"id": "a"})
+
+    lone = run(database, scenario, orders=("a",))
+    assert len(lone["outbox"]) == 1 and "outbox_failed" not in lone
+    assert "outbox_claimed_by" not in lone
+
+
+def test_sink_down_counts_no_attempt(database):
+    async def scenario(db):
+        relay = OutboxRelay(db, Sink(down=True), max_attempts=1)
+        for _ in range(3):
+            with pytest.raises(ConnectionError):
+                await relay.relay_once()
+        # Claims were released, so the sink coming back delivers everything at once
+        relay.sink = Sink()
+        delivered = await relay.relay_once()
+        return delivered, await db.orders.count_documents({"outbox_failed": {"$exists": True}})
+
+    assert run(database, scenario) == (3, 0)
@@ -0,0 +1,153 @@
+"""
+PaymentProvider's circuit breaker going closed -> open -> half-open -> closed,
+against benchmarks.fake_operator served in-process.
+"""
+import asyncio
+
+import httpx
+
+from benchmarks import fake_operator
+from services.payment_providers import CircuitBreaker, PaymentProvider
+
+RESET = 0.05
+
+
+class Operator(httpx.AsyncBaseTransport):
+    """The fake operator behind a switch, counting the calls that reach it"""
+
+    def __init__(self):
+        self.calls = 0
+        self.up()
+
+    def up(self, latency: float = 0.0):
+        self.transport = httpx.ASGITransport(app=fake_operator.create_app(latency))
+
+    def down(self):
+        self.transport = httpx.ASGITransport(app=fake_operator.create_app(0.0, error_rate=1.0))
+
+    async def handle_async_request(self, request):
+        self.calls += 1
+        return await self.transport.handle_async_request(request)
+
+
+def run(scenario):
+    async def main():
+        operator = Operator()
+        provider = PaymentProvider("http://operator", retries=0, transport=operator,
+                                   breaker=CircuitBreaker(failure_threshold=3, reset_timeout=RESET))
+        try:
+            return await scenario(provider, operator)
+        finally:
+            await provider.aclose()
+
+    return asyncio.run(main())
+
+
+async def charge(provider):
+    return await provider.charge("01234567", 1000, "DRB0001")
+
+
+async def open_breaker(provider, operator):
+    operator.down()
+    for _ in range(3):
+        assert not (await charge(provider))["success"]
+    assert provider.breaker.state == "open"
+
+
+def test_opens_after_consecutive_failures_and_stops_calling():
+    async def scenario(provider, operator):
+        operator.down()
+        for _ in range(2):
+            await charge(provider)
+        assert provider.breaker.state == "closed"
+        await charge(provider)
+        assert provider.breaker.state == "open"
+
+        calls = operator.calls
+        result = await charge(provider)
+        assert result == {"success": False, "error": "Service temporairement indisponible",
+                          "transaction_id": None}
+        assert operator.calls == calls
+
+    run(scenario)
+
+
+def test_successful_trial_closes():
+    async def scenario(provider, operator):
+        await open_breaker(provider, operator)
+        await asyncio.sleep(RESET)
+        assert provider.breaker.state == "half-open"
+
+        operator.up()
+        assert (await charge(provider))["success"]
+        assert provider.breaker.state == "closed"
+        assert provider.breaker.failures == 0
+
+    run(scenario)
+
+
+def test_failed_trial_reopens():
+    async def scenario(provider, operator):
+        await open_breaker(provider, operator)
+        await asyncio.sleep(RESET)
+        calls = operator.calls
+        await charge(provider)
+        assert operator.calls == calls + 1
+        assert provider.breaker.state == "open"
+
+    run(scenario)
+
+
+def test_one_trial_at_a_time():
+    async def scenario(provider, operator):
+        await open_breaker(provider, operator)
+        await asyncio.sleep(RESET)
+        operator.up(latency=0.05)
+        calls = operator.calls
+        results = await asyncio.gather(*(charge(provider) for _ in range(5)))
+        assert operator.calls == calls + 1
+        assert sum(result["success"] for result in results) == 1
+        assert provider.breaker.state == "closed"
+
+    run(scenario)
+
+
+def test_cancelled_trial_lets_the_next_call_through():
+    async def scenario(provider, operator):
+        await open_breaker(provider, operator)
+        await asyncio.sleep(RESET)
+        operator.up(latency=10)
+        trial = asyncio.create_task(charge(provider))
+        await asyncio.sleep(0.01)
+        assert provider.breaker.trial_in_flight
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+
+        assert not provider.breaker.trial_in_flight
+        operator.up()
+        assert (await charge(provider))["success"]
+        assert provider.breaker.state == "closed"
+
+    run(scenario)
+
+
+def test_unexpected_error_in_trial_lets_the_next_call_through():
+    class Broken(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            raise RuntimeError("bug in the transport")
+
+    async def scenario(provider, operator):
+        await open_breaker(provider, operator)
+        await asyncio.sleep(RESET)
+        operator.transport = Broken()
+        try:
+            await charge(provider)
+        except RuntimeError:
+            pass
+        assert not provider.breaker.trial_in_flight
+
+        operator.up()
+        assert (await charge(provider))["success"]
+        assert provider.breaker.state == "closed"
+
+    run(scenario)